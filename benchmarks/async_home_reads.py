@@ -0,0 +1,95 @@
+"""Compares the throughput of concurrent home tab reads made with the sync DAO (a thread per request) and with the
+asyncio DAO (a task per request on one event loop, the queries of a request made concurrently).
+
+    THANK_YOU_DAO=sqlite python -m benchmarks.async_home_reads [--requests 500] [--concurrency 10]
+
+A home tab read is what the "All Thank yous" home tab queries: the newest page of messages, the sender and receiver
+leaderboards by company value and the number of messages. The company is seeded like the one of the query advisor
+(see thankyou.dao.advisor).
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from statistics import quantiles
+from timeit import default_timer as timer
+from typing import List
+
+from thankyou.dao import dao
+from thankyou.dao.advisor import seed_company
+from thankyou.dao.interface import LoadProfile
+
+
+def _read_home_tab_sync(company_uuid: str) -> float:
+    started_at = timer()
+    now = datetime.utcnow()
+    dao.read_thank_you_messages_page(company_uuid=company_uuid, page_size=20, private=False,
+                                     load_profile=LoadProfile.HOME_FEED)
+    dao.get_thank_you_sender_leaders_by_type(company_uuid=company_uuid, created_after=now - timedelta(days=30),
+                                             created_before=now)
+    dao.get_thank_you_receiver_leaders_by_type(company_uuid=company_uuid, created_after=now - timedelta(days=30),
+                                               created_before=now)
+    dao.read_thank_you_messages_num(company_uuid=company_uuid, private=True)
+    return timer() - started_at
+
+
+async def _read_home_tab_async(async_dao, company_uuid: str) -> float:
+    started_at = timer()
+    now = datetime.utcnow()
+    await asyncio.gather(
+        async_dao.read_thank_you_messages_page(company_uuid=company_uuid, page_size=20, private=False,
+                                               load_profile=LoadProfile.HOME_FEED),
+        async_dao.get_thank_you_sender_leaders_by_type(company_uuid=company_uuid,
+                                                       created_after=now - timedelta(days=30), created_before=now),
+        async_dao.get_thank_you_receiver_leaders_by_type(company_uuid=company_uuid,
+                                                         created_after=now - timedelta(days=30), created_before=now),
+        async_dao.read_thank_you_messages_num(company_uuid=company_uuid, private=True),
+    )
+    return timer() - started_at
+
+
+def _run_sync(company_uuid: str, requests_num: int, concurrency: int) -> List[float]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda _: _read_home_tab_sync(company_uuid), range(requests_num)))
+
+
+async def _run_async(company_uuid: str, requests_num: int, concurrency: int) -> List[float]:
+    async_dao = dao.create_async_dao()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read():
+        async with semaphore:
+            return await _read_home_tab_async(async_dao, company_uuid)
+
+    try:
+        return list(await asyncio.gather(*(read() for _ in range(requests_num))))
+    finally:
+        await async_dao.dispose()
+
+
+def _report(mode: str, latencies: List[float], elapsed: float):
+    percentiles = quantiles(latencies, n=100)
+    print(f"{mode}: {len(latencies) / elapsed:.0f} home tabs/s, "
+          f"p50 {percentiles[49] * 1000:.1f} ms, p95 {percentiles[94] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed-messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    company = seed_company(dao, messages_num=args.seed_messages)
+
+    started_at = timer()
+    latencies = _run_sync(company.uuid, args.requests, args.concurrency)
+    _report("sync", latencies, timer() - started_at)
+
+    started_at = timer()
+    latencies = asyncio.run(_run_async(company.uuid, args.requests, args.concurrency))
+    _report("async", latencies, timer() - started_at)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Measures how long it takes to render the "All Thank yous" home tab view (100 blocks) and serialize it to JSON,
+the way it is sent to views.publish.
+
+    python -m benchmarks.home_view_render [--iterations 200]
+
+"cold" renders every message from scratch, "warm" takes the blocks of the messages from the rendered blocks cache.
+"""
+import argparse
+import json
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+from thankyou.core.models import Company, LeaderbordTimeSettings, ThankYouMessage, ThankYouType, ThankYouReceiver, \
+    ThankYouMessageImage
+from thankyou.slackbot.blocks import thank_you as thank_you_blocks
+from thankyou.slackbot.views.homepage import home_page_company_thank_yous_view
+
+
+RICH_TEXT = json.dumps({"type": "rich_text", "elements": [{"type": "rich_text_section", "elements": [
+    {"type": "text", "text": "Thank you for "},
+    {"type": "text", "text": "the great release", "style": {"bold": True}},
+    {"type": "emoji", "name": "tada"},
+]}]})
+
+
+def _company() -> Company:
+    return Company(
+        slack_team_id="T_BENCHMARK",
+        admins=[],
+        enable_sharing_in_a_slack_channel=True,
+        share_messages_in_slack_channel="C_BENCHMARK",
+        leaderbord_time_settings=LeaderbordTimeSettings.LAST_30_DAYS,
+        enable_weekly_thank_you_limit=False,
+        weekly_thank_you_limit=10,
+        receivers_number_limit=10,
+        enable_leaderboard=True,
+        enable_private_message_counting_in_leaderboard=False,
+        enable_company_values=True,
+        enable_rich_text_in_thank_you_messages=True,
+        enable_attaching_files=True,
+        enable_private_messages=True,
+        max_attached_files_num=10,
+    )
+
+
+def _thank_you_messages(company: Company, thank_you_types, messages_num: int):
+    now = datetime.utcnow()
+    messages = []
+    for i in range(messages_num):
+        is_rich_text = i % 3 == 0
+        messages.append(ThankYouMessage(
+            text=RICH_TEXT if is_rich_text else f"Thank you for *the help* with the migration #{i}!",
+            company=company,
+            is_rich_text=is_rich_text,
+            is_private=False,
+            type=thank_you_types[i % len(thank_you_types)],
+            author_slack_user_id=f"U_AUTHOR_{i % 7}",
+            receivers=[ThankYouReceiver(slack_user_id=f"U_RECEIVER_{(i + j) % 11}") for j in range(1 + i % 3)],
+            images=[] if i % 4 else [ThankYouMessageImage(url=f"https://example.com/image_{i}.png",
+                                                          filename=f"image_{i}.png", ordering_key=0)],
+            created_at=now - timedelta(hours=5 * i),
+        ))
+    return messages
+
+
+def _render(company: Company, thank_you_types, messages) -> str:
+    leaders = [(thank_you_type, [(f"U_RECEIVER_{i}", 10 - i) for i in range(3)]) for thank_you_type in thank_you_types]
+    view = home_page_company_thank_yous_view(
+        thank_you_messages=messages,
+        app_name="Merci",
+        sender_leaders=leaders,
+        receiver_leaders=leaders,
+        current_user_slack_id="U_RECEIVER_1",
+        slack_channel_with_all_messages=company.share_messages_in_slack_channel,
+        hidden_messages_num=100,
+    )
+    return json.dumps(view if isinstance(view, dict) else view.to_dict())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    company = _company()
+    thank_you_types = [ThankYouType(name=name, company_uuid=company.uuid)
+                       for name in ("🎉 Collaboration", "🚀 Innovation", "🌐 Ethical Responsibility")]
+    messages = _thank_you_messages(company, thank_you_types, messages_num=40)
+    blocks_num = len(json.loads(_render(company, thank_you_types, messages))["blocks"])
+
+    for mode in ("cold", "warm"):
+        started_at = timer()
+        for _ in range(args.iterations):
+            if mode == "cold":
+                thank_you_blocks._thank_you_message_blocks_cache.clear()
+            _render(company, thank_you_types, messages)
+        elapsed = timer() - started_at
+        print(f"{mode}: {blocks_num} blocks, {elapsed / args.iterations * 1000:.2f} ms per render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compares the home tab throughput of the sync Slack app handlers and of the async ones (see SlackAppMode) when the
+Slack Web API is slow.
+
+    THANK_YOU_DAO=sqlite python -m benchmarks.slack_app_modes [--requests 500] [--workers 10] [--concurrency 100] \
+        [--slack-latency-ms 200]
+
+Every request is an app_home_opened event of a different user: the handler reads the home feed and publishes the
+home tab. views_publish is answered by a fake client after slack_latency_ms. The sync handlers run in a pool of
+workers threads, like the sync gunicorn workers of wsgi.py which handle one request each; the async handlers run as
+up to concurrency tasks of one event loop, like an aiohttp worker. The company is seeded like the one of the query
+advisor (see thankyou.dao.advisor).
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from timeit import default_timer as timer
+from typing import List
+
+from thankyou.dao import dao, get_async_dao
+from thankyou.dao.advisor import seed_company, ADVISOR_COMPANY_SLACK_TEAM_ID
+from thankyou.slackbot.handlers.homepage import app_home_opened_action_handler, async_app_home_opened_action_handler
+
+
+class _FakeWebClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.default_params = {"team_id": ADVISOR_COMPANY_SLACK_TEAM_ID}
+
+    def views_publish(self, user_id, view):
+        time.sleep(self.latency)
+
+
+class _FakeAsyncWebClient(_FakeWebClient):
+    async def views_publish(self, user_id, view):
+        await asyncio.sleep(self.latency)
+
+
+def _event(request_num: int) -> dict:
+    # No "view" in the event: the home tab is published even if it has not changed
+    return {"user": f"U_ADVISOR_{request_num % 200}"}
+
+
+def _open_home_tab_sync(client: _FakeWebClient, request_num: int) -> float:
+    started_at = timer()
+    with dao.transaction():
+        app_home_opened_action_handler(client, _event(request_num), logging.getLogger(__name__))
+    return timer() - started_at
+
+
+def _run_sync(requests_num: int, workers: int, latency: float) -> List[float]:
+    client = _FakeWebClient(latency)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda request_num: _open_home_tab_sync(client, request_num), range(requests_num)))
+
+
+async def _run_async(requests_num: int, concurrency: int, latency: float) -> List[float]:
+    client = _FakeAsyncWebClient(latency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_home_tab(request_num: int) -> float:
+        async with semaphore:
+            started_at = timer()
+            await async_app_home_opened_action_handler(client, _event(request_num), logging.getLogger(__name__))
+            return timer() - started_at
+
+    try:
+        return list(await asyncio.gather(*(open_home_tab(request_num) for request_num in range(requests_num))))
+    finally:
+        await get_async_dao().dispose()
+
+
+def _report(mode: str, latencies: List[float], elapsed: float):
+    percentiles = quantiles(latencies, n=100)
+    print(f"{mode}: {len(latencies) / elapsed:.0f} home tabs/s, "
+          f"p50 {percentiles[49] * 1000:.1f} ms, p95 {percentiles[94] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--slack-latency-ms", type=float, default=200)
+    parser.add_argument("--seed-messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    seed_company(dao, messages_num=args.seed_messages)
+    latency = args.slack_latency_ms / 1000
+
+    started_at = timer()
+    latencies = _run_sync(args.requests, args.workers, latency)
+    _report(f"sync, {args.workers} workers", latencies, timer() - started_at)
+
+    started_at = timer()
+    latencies = asyncio.run(_run_async(args.requests, args.concurrency, latency))
+    _report(f"async, {args.concurrency} tasks", latencies, timer() - started_at)
+
+
+if __name__ == "__main__":
+    main()
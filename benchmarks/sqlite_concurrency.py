@@ -0,0 +1,101 @@
+"""Measures the throughput of the SQLite DAO under a concurrent read/write load, in the SIMPLE and TUNED modes
+(see SQLiteMode).
+
+    python -m benchmarks.sqlite_concurrency [--threads 10] [--seconds 10] [--write-ratio 0.2]
+
+Every thread either creates a thank you message (with write_ratio probability) or reads a page of the home feed, the
+way the Slack handlers do. Every mode runs in a separate process, against a new database file seeded with the same
+messages.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from timeit import default_timer as timer
+
+
+def _worker(threads_num: int, seconds: float, write_ratio: float, seed_messages: int):
+    from thankyou.core.models import ThankYouMessage, ThankYouReceiver
+    from thankyou.dao import dao
+    from thankyou.dao.advisor import seed_company
+    from thankyou.dao.interface import LoadProfile
+
+    company = seed_company(dao, messages_num=seed_messages, users_num=50)
+    thank_you_types = dao.read_thank_you_types(company_uuid=company.uuid)
+    counts = Counter()
+    counts_lock = threading.Lock()
+    deadline = timer() + seconds
+
+    def run(thread_num: int):
+        rnd = random.Random(thread_num)
+        local_counts = Counter()
+        while timer() < deadline:
+            is_write = rnd.random() < write_ratio
+            kind = "writes" if is_write else "reads"
+            try:
+                if is_write:
+                    dao.create_thank_you_message(ThankYouMessage(
+                        text=f"Thank you from thread #{thread_num}",
+                        company=company,
+                        is_rich_text=False,
+                        is_private=False,
+                        type=rnd.choice(thank_you_types),
+                        author_slack_user_id=f"U_ADVISOR_{rnd.randrange(50)}",
+                        receivers=[ThankYouReceiver(slack_user_id=f"U_ADVISOR_{rnd.randrange(50)}")],
+                    ))
+                else:
+                    dao.read_thank_you_messages_page(company_uuid=company.uuid, page_size=20, private=False,
+                                                     load_profile=LoadProfile.HOME_FEED)
+                local_counts[kind] += 1
+            except Exception:
+                local_counts[f"failed {kind}"] += 1
+        with counts_lock:
+            counts.update(local_counts)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(threads_num)]
+    started_at = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - started_at
+    print(json.dumps({"elapsed": elapsed, **counts}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--seed-messages", type=int, default=2000)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.threads, args.seconds, args.write_ratio, args.seed_messages)
+        return
+
+    for mode in ("SIMPLE", "TUNED"):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, THANK_YOU_DAO="SQLITE", MERCI_SQLITE_MODE=mode,
+                       MERCI_SQLITE_DATABASE_FILE=os.path.join(directory, "thank_you.db"))
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.sqlite_concurrency", "--worker", "--threads", str(args.threads),
+                 "--seconds", str(args.seconds), "--write-ratio", str(args.write_ratio),
+                 "--seed-messages", str(args.seed_messages)],
+                env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        elapsed = result["elapsed"]
+        print(f"{mode}: {args.threads} threads, "
+              f"{result.get('reads', 0) / elapsed:.0f} reads/s, {result.get('writes', 0) / elapsed:.0f} writes/s, "
+              f"{result.get('failed reads', 0)} failed reads, {result.get('failed writes', 0)} failed writes")
+
+
+if __name__ == "__main__":
+    main()
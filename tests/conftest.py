@@ -0,0 +1,4 @@
+import os
+
+# The tests run on a local SQLite database, which is migrated when the Dao is created (thankyou.dao is imported)
+os.environ.setdefault("MERCI_DATABASE_MIGRATE_ON_STARTUP", "true")
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import stat
+import time
+import threading
+from datetime import datetime
+
+import pytest
+
+from cachetools import cached
+from cachetools.keys import hashkey
+
+from thankyou.core.models import ThankYouType, LeaderbordTimeSettings, CompanyAdmin
+from thankyou.utils.cache import SQLiteCacheBackend, SharedTTLCache, InProcessCacheBackend, async_cached
+from thankyou.utils.ratelimit import SQLiteTokenBucketStore, InProcessTokenBucketStore
+
+
+def test_sqlite_cache_is_shared_and_expires(tmp_path):
+    filename = str(tmp_path / "cache.sqlite3")
+    calls = []
+
+    def thank_you_types(company_uuid: str):
+        calls.append(company_uuid)
+        return [ThankYouType(name="Innovation", company_uuid=company_uuid)]
+
+    # Two "workers": separate backend objects (and connections) working with the same file
+    worker_1 = cached(cache=SharedTTLCache("types", maxsize=10, ttl=0.5, backend=SQLiteCacheBackend(filename)))(
+        thank_you_types)
+    worker_2 = cached(cache=SharedTTLCache("types", maxsize=10, ttl=0.5, backend=SQLiteCacheBackend(filename)))(
+        thank_you_types)
+
+    assert worker_1("COMPANY")[0].name == "Innovation"
+    assert worker_2("COMPANY")[0].name == "Innovation"
+    assert calls == ["COMPANY"]
+
+    time.sleep(0.6)
+    worker_2("COMPANY")
+    assert calls == ["COMPANY", "COMPANY"]
+
+
+def test_sqlite_cache_evicts_least_recently_used_entries(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), touch_interval_seconds=0)
+    cache = SharedTTLCache("lru", maxsize=2, ttl=60, backend=backend)
+
+    cache["a"] = 1
+    cache["b"] = 2
+    time.sleep(0.01)
+    assert cache["a"] == 1
+    cache["c"] = 3
+    backend.evict("lru", maxsize=2)
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_sqlite_cache_hits_do_not_write(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    cache = SharedTTLCache("read_only_hits", maxsize=2, ttl=60, backend=backend)
+    cache["a"] = 1
+
+    changes = backend._connection().total_changes
+    assert cache["a"] == 1
+    assert backend._connection().total_changes == changes
+
+
+def test_sqlite_cache_stores_values_as_json(tmp_path):
+    from thankyou.slackbot.handlers.common import SendersReceiversStats
+
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    cache = SharedTTLCache("json", maxsize=10, ttl=60, backend=backend)
+    thank_you_type = ThankYouType(name="Innovation", company_uuid="COMPANY")
+    stats = SendersReceiversStats(
+        leaders_stats_from_datetime=datetime(2024, 1, 1),
+        leaders_stats_until_datetime=datetime(2024, 1, 31, 23, 59, 59, 999999),
+        sender_leaders=[(thank_you_type, [("U1", 2), ("U2", 1)])],
+        receiver_leaders=[(None, [])],
+    )
+    value = {"stats": stats, "settings": LeaderbordTimeSettings.LAST_30_DAYS,
+             "admins": (CompanyAdmin(company_uuid="COMPANY", slack_user_id="U1"),)}
+
+    cache["value"] = value
+    assert cache["value"] == value
+    assert cache["value"]["stats"].sender_leaders[0][0].name == "Innovation"
+    assert backend._connection().execute("SELECT typeof(value) FROM cache_entries").fetchone() == ("text",)
+
+    # Values which can not be restored are not stored, and only the classes of the app are loaded
+    cache["function"] = len
+    assert "function" not in cache
+    backend._connection().execute(
+        "UPDATE cache_entries SET value = ? WHERE namespace = 'json'",
+        ('{"dataclass":"subprocess:Popen","fields":{"args":"echo"}}',))
+    assert "value" not in cache
+
+
+def test_shared_sqlite_file_is_private(tmp_path):
+    filename = str(tmp_path / "cache" / "cache.sqlite3")
+    SQLiteCacheBackend(filename)
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
+
+    link = str(tmp_path / "link.sqlite3")
+    os.symlink(filename, link)
+    with pytest.raises(OSError):
+        SQLiteTokenBucketStore(link)
+
+
+def test_in_process_cache_backend():
+    cache = SharedTTLCache("in_process", maxsize=2, ttl=60, backend=InProcessCacheBackend())
+    cache["a"] = 1
+    assert cache["a"] == 1
+    assert "b" not in cache
+    del cache["a"]
+    assert len(cache) == 0
+
+
+def test_async_cached_shares_values_with_cached():
+    calls = []
+
+    def key(company_uuid: str, private: bool = False):
+        return hashkey(company_uuid, private)
+
+    @cached(cache=SharedTTLCache("async_cached", maxsize=10, ttl=60, backend=InProcessCacheBackend()), key=key)
+    def messages_num(company_uuid: str, private: bool = False):
+        calls.append(("sync", company_uuid, private))
+        return 1
+
+    @async_cached(cache=messages_num.cache, key=key)
+    async def async_messages_num(company_uuid: str, private: bool = False):
+        calls.append(("async", company_uuid, private))
+        return 2
+
+    assert messages_num("A") == 1
+    assert asyncio.run(async_messages_num(company_uuid="A")) == 1
+    assert asyncio.run(async_messages_num("B", private=True)) == 2
+    assert asyncio.run(async_messages_num("B", True)) == 2
+    assert messages_num(company_uuid="B", private=True) == 2
+    assert calls == [("sync", "A", False), ("async", "B", True)]
+
+
+def test_async_cached_reads_a_shared_cache_outside_of_the_event_loop(tmp_path):
+    threads = []
+
+    class RecordingSQLiteCacheBackend(SQLiteCacheBackend):
+        def get(self, namespace: str, key: str):
+            threads.append(threading.get_ident())
+            return super().get(namespace, key)
+
+        def set(self, namespace: str, key: str, value, ttl: float, maxsize: int):
+            threads.append(threading.get_ident())
+            super().set(namespace, key, value, ttl, maxsize)
+
+    cache = SharedTTLCache("async_cached_shared", maxsize=10, ttl=60,
+                           backend=RecordingSQLiteCacheBackend(str(tmp_path / "cache.db")))
+
+    @async_cached(cache=cache)
+    async def nothing(company_uuid: str):
+        return None
+
+    assert asyncio.run(nothing("A")) is None
+    assert asyncio.run(nothing("A")) is None
+    assert len(threads) == 3  # A miss, a set and a hit of the cached None
+    assert threading.get_ident() not in threads
+
+
+def test_sqlite_token_buckets_are_shared(tmp_path):
+    filename = str(tmp_path / "cache.sqlite3")
+    worker_1 = SQLiteTokenBucketStore(filename)
+    worker_2 = SQLiteTokenBucketStore(filename)
+
+    def reserve(store):
+        return store.reserve("slack:T1:TIER_3", rate_per_second=1, capacity=2, max_wait_seconds=1.5)
+
+    assert reserve(worker_1) == 0
+    assert reserve(worker_2) == 0
+    # The bucket is empty: the next token will be there in a second, the one after it in two seconds
+    assert 0.9 < reserve(worker_1) <= 1
+    assert reserve(worker_2) is None
+    assert worker_1.reserve("slack:T2:TIER_3", rate_per_second=1, capacity=2, max_wait_seconds=1.5) == 0
+
+
+def test_post_message_is_rate_limited_per_channel():
+    from thankyou.slackbot.utils.webclient import _reserve_slack_api_call
+
+    store = InProcessTokenBucketStore()
+    # A burst of 10 seconds worth of messages to a channel, then about one per second
+    assert all(_reserve_slack_api_call(store, "T1", "chat.postMessage", 10, channel="U1") == 0 for _ in range(10))
+    assert _reserve_slack_api_call(store, "T1", "chat.postMessage", 10, channel="U1") > 0
+    # A fan-out of direct messages is not throttled by the other channels
+    assert all(_reserve_slack_api_call(store, "T1", "chat.postMessage", 10, channel=f"U{i}") == 0
+               for i in range(2, 50))
+
+
+def test_calls_with_a_trigger_id_do_not_wait_until_it_expires():
+    from thankyou.slackbot.utils.webclient import _reserve_slack_api_call
+
+    store = InProcessTokenBucketStore()
+    while _reserve_slack_api_call(store, "T1", "views.publish", 10) < 2:
+        pass
+    # The Tier-4 bucket is drained: views.publish would wait, views.open is made within the 3 seconds of its trigger_id
+    assert _reserve_slack_api_call(store, "T1", "views.publish", 10) > 2
+    assert _reserve_slack_api_call(store, "T1", "views.open", 10) == 0
+
+
+def test_slack_retries_are_deduplicated_across_workers(tmp_path):
+    import json
+    import time as time_
+
+    from flask import Response
+    from slack_sdk.signature import SignatureVerifier
+
+    from thankyou.slackbot.utils.dedup import SlackRequestDeduplicator
+
+    filename = str(tmp_path / "cache.sqlite3")
+    worker_1 = SlackRequestDeduplicator("secret", SharedTTLCache("requests", 10, 60, SQLiteCacheBackend(filename)))
+    worker_2 = SlackRequestDeduplicator("secret", SharedTTLCache("requests", 10, 60, SQLiteCacheBackend(filename)))
+    processed = []
+
+    def handler(status: int = 200):
+        def handle():
+            processed.append(status)
+            return Response(status=status)
+        return handle
+
+    def signed_headers(body: str, secret: str = "secret") -> dict:
+        timestamp = str(int(time_.time()))
+        return {"X-Slack-Request-Timestamp": timestamp,
+                "X-Slack-Signature": SignatureVerifier(secret).generate_signature(timestamp=timestamp, body=body)}
+
+    event = json.dumps({"type": "event_callback", "event_id": "Ev1", "event": {"type": "app_home_opened"}})
+    # A forged request is not recorded, so it does not suppress the real one
+    worker_1.handle(event, signed_headers(event, "wrong secret"), handler())
+    assert worker_1.handle(event, signed_headers(event), handler(500)).status_code == 500
+    # The first attempt failed, so the retry is processed
+    worker_2.handle(event, {**signed_headers(event), "X-Slack-Retry-Num": "1"}, handler())
+    assert worker_1.handle(event, {**signed_headers(event), "X-Slack-Retry-Num": "2"}, handler()).status_code == 200
+    assert processed == [200, 500, 200]
+
+
+def test_identical_home_views_are_published_once():
+    from slack_sdk.models.blocks import SectionBlock
+    from slack_sdk.models.views import View
+
+    from thankyou.slackbot.handlers.common import publish_home_view
+
+    class FakeWebClient:
+        def __init__(self):
+            self.published = []
+
+        def views_publish(self, user_id, view):
+            self.published.append((user_id, view))
+
+    def home_view(text: str) -> View:
+        return View(type="home", blocks=[SectionBlock(text=text)])
+
+    client = FakeWebClient()
+    publish_home_view(client, slack_team_id="T_HOME_VIEW_TEST", user_id="U_HOME_VIEW_TEST",
+                      view=home_view("Thank you!"))
+    publish_home_view(client, slack_team_id="T_HOME_VIEW_TEST", user_id="U_HOME_VIEW_TEST",
+                      view=home_view("Thank you!"))
+    assert len(client.published) == 1
+    publish_home_view(client, slack_team_id="T_HOME_VIEW_TEST", user_id="U_HOME_VIEW_TEST", view=home_view("Merci!"))
+    publish_home_view(client, slack_team_id="T_HOME_VIEW_TEST", user_id="U_HOME_VIEW_TEST", view=home_view("Merci!"),
+                      force=True)
+    assert len(client.published) == 3
+    # Slack user IDs are unique within a workspace only
+    publish_home_view(client, slack_team_id="T_OTHER_HOME_VIEW_TEST", user_id="U_HOME_VIEW_TEST",
+                      view=home_view("Merci!"))
+    assert len(client.published) == 4
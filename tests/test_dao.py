@@ -1,10 +1,41 @@
+import asyncio
 import string
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
 from random import choices
 
 import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
 
-from thankyou.core.models import Company, ThankYouMessage, LeaderbordTimeSettings, ThankYouType
+from thankyou.core.config import SQLiteMode, sqlite_busy_timeout_ms
+from thankyou.core.models import Company, ThankYouMessage, LeaderbordTimeSettings, ThankYouType, ThankYouReceiver, \
+    ThankYouMessageImage
 from thankyou.dao import dao, create_initial_data
+from thankyou.dao.advisor import advise
+from thankyou.dao.instrumentation import count_handler_statements, statement_fingerprint
+from thankyou.dao.interface import LoadProfile
+from thankyou.dao.migrations import MIGRATIONS, applied_versions, migrate
+from thankyou.dao.pool import InstrumentedQueuePool
+from thankyou.dao.sqlite import create_sqlite_engine
+from thankyou.slackbot.blocks.homepage import thank_you_list_blocks
+from thankyou.slackbot.blocks.thank_you import thank_you_message_block_dicts, invalidate_thank_you_message_blocks
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(dao.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(dao.engine, "before_cursor_execute", before_cursor_execute)
 
 
 @pytest.fixture
@@ -64,3 +95,677 @@ def test_thank_you_message_insertion(existing_company):
     dao.create_thank_you_message(thank_you_message)
     assert thank_you_message.uuid in [su.uuid for su in dao.read_thank_you_messages(
         company_uuid=existing_company.uuid)]
+
+
+def test_leaders_by_type_match_per_type_leaders(existing_company):
+    thank_you_types = dao.read_thank_you_types(company_uuid=existing_company.uuid)
+    for i, (author, receivers) in enumerate([
+        ("AUTHOR_1", ["RECEIVER_1", "RECEIVER_2"]),
+        ("AUTHOR_1", ["RECEIVER_2"]),
+        ("AUTHOR_3", ["RECEIVER_1"]),
+        ("AUTHOR_2", ["RECEIVER_2", "RECEIVER_3"]),
+        ("AUTHOR_3", ["RECEIVER_1"]),
+    ]):
+        dao.create_thank_you_message(ThankYouMessage(
+            author_slack_user_id=author,
+            text="Some Text",
+            type=thank_you_types[i % 2],
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False,
+            receivers=[ThankYouReceiver(slack_user_id=receiver) for receiver in receivers]
+        ))
+
+    sender_leaders = dao.get_thank_you_sender_leaders_by_type(company_uuid=existing_company.uuid, leaders_num=2)
+    receiver_leaders = dao.get_thank_you_receiver_leaders_by_type(company_uuid=existing_company.uuid, leaders_num=2)
+
+    for thank_you_type in thank_you_types:
+        expected_senders = dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid,
+                                                            thank_you_type=thank_you_type, leaders_num=2)
+        expected_receivers = dao.get_thank_you_receiver_leaders(company_uuid=existing_company.uuid,
+                                                                thank_you_type=thank_you_type, leaders_num=2)
+        assert sorted(n for _, n in sender_leaders.get(thank_you_type.uuid, [])) \
+               == sorted(n for _, n in expected_senders)
+        assert sorted(n for _, n in receiver_leaders.get(thank_you_type.uuid, [])) \
+               == sorted(n for _, n in expected_receivers)
+
+    assert sender_leaders[thank_you_types[0].uuid][0] == ("AUTHOR_3", 2)
+
+
+def test_leaders_follow_thank_you_message_edits_and_deletions(existing_company):
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1"), ThankYouReceiver(slack_user_id="RECEIVER_2")]
+    )
+    dao.create_thank_you_message(thank_you_message)
+    assert dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid) == [("AUTHOR_SLACK_ID", 1)]
+    assert dao.get_thank_you_receiver_leaders(company_uuid=existing_company.uuid) == [("RECEIVER_1", 1),
+                                                                                      ("RECEIVER_2", 1)]
+
+    edited_thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Edited Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_2"), ThankYouReceiver(slack_user_id="RECEIVER_3")]
+    )
+    dao.update_thank_you_message(
+        dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                   thank_you_message_uuid=thank_you_message.uuid),
+        edited_thank_you_message
+    )
+    assert dao.get_thank_you_receiver_leaders(company_uuid=existing_company.uuid) == [("RECEIVER_2", 1),
+                                                                                      ("RECEIVER_3", 1)]
+
+    dao.rebuild_thank_you_daily_counts(batch_size=2)
+    assert dao.get_thank_you_receiver_leaders(company_uuid=existing_company.uuid) == [("RECEIVER_2", 1),
+                                                                                      ("RECEIVER_3", 1)]
+
+    dao.delete_thank_you_message(thank_you_message.uuid)
+    assert dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid) == []
+    assert dao.get_thank_you_receiver_leaders(company_uuid=existing_company.uuid) == []
+
+
+def test_home_feed_render_query_count_does_not_depend_on_messages_num(existing_company):
+    thank_you_types = dao.read_thank_you_types(company_uuid=existing_company.uuid)
+
+    def create_messages(num: int):
+        for i in range(num):
+            dao.create_thank_you_message(ThankYouMessage(
+                author_slack_user_id="AUTHOR_SLACK_ID",
+                text=f"Some Text {i}",
+                type=thank_you_types[i % len(thank_you_types)],
+                company=existing_company,
+                is_rich_text=False,
+                is_private=False,
+                receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1"), ThankYouReceiver(slack_user_id="RECEIVER_2")],
+                images=[ThankYouMessageImage(url="https://example.com/image.png", filename="image.png",
+                                             ordering_key=0)]
+            ))
+
+    def render_home_feed() -> int:
+        with count_queries() as statements:
+            messages = dao.read_thank_you_messages(company_uuid=existing_company.uuid, last_n=20,
+                                                   load_profile=LoadProfile.HOME_FEED)
+            thank_you_list_blocks(messages, current_user_slack_id="RECEIVER_1")
+        return len(statements)
+
+    create_messages(2)
+    queries_num = render_home_feed()
+    create_messages(10)
+    assert render_home_feed() == queries_num
+
+
+def test_thank_you_message_blocks_are_cached_per_message_version(existing_company):
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")]
+    )
+    dao.create_thank_you_message(thank_you_message)
+
+    def read_blocks(show_say_thank_you_button: bool = False):
+        return thank_you_message_block_dicts(
+            dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                       thank_you_message_uuid=thank_you_message.uuid,
+                                       load_profile=LoadProfile.HOME_FEED),
+            show_say_thank_you_button=show_say_thank_you_button)
+
+    blocks = read_blocks()
+    assert read_blocks() is blocks
+    assert read_blocks(show_say_thank_you_button=True) is not blocks
+
+    dao.update_thank_you_message(
+        dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                   thank_you_message_uuid=thank_you_message.uuid),
+        ThankYouMessage(
+            author_slack_user_id="AUTHOR_SLACK_ID",
+            text="Edited Text",
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False,
+            receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")]
+        )
+    )
+    edited_blocks = read_blocks()
+    assert edited_blocks != blocks
+    assert "Edited Text" in str(edited_blocks)
+
+    invalidate_thank_you_message_blocks(thank_you_message.uuid)
+    assert read_blocks() is not edited_blocks
+    assert read_blocks() == edited_blocks
+
+
+def test_derived_fields_are_computed_on_write_and_backfilled(existing_company):
+    rich_text = '{"type": "rich_text", "elements": [{"type": "rich_text_section", "elements": [' \
+                '{"type": "text", "text": "Thanks", "style": {"bold": true}}]}]}'
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text=rich_text,
+        company=existing_company,
+        is_rich_text=True,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")],
+        images=[ThankYouMessageImage(url="https://example.com/2.png", filename="2.png", ordering_key=2),
+                ThankYouMessageImage(url="https://example.com/1.png", filename="1.png", ordering_key=1)]
+    )
+    dao.create_thank_you_message(thank_you_message)
+
+    def read_message() -> ThankYouMessage:
+        return dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                          thank_you_message_uuid=thank_you_message.uuid,
+                                          load_profile=LoadProfile.HOME_FEED)
+
+    saved_message = read_message()
+    assert saved_message.markdown_text == "*Thanks*"
+    assert saved_message.has_valid_image is True
+    assert [image.filename for image in saved_message.images] == ["1.png", "2.png"]
+    blocks = thank_you_list_blocks([saved_message])
+
+    with dao.engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE thank_you_messages SET markdown_text = NULL, has_valid_image = NULL "
+                                   f"WHERE uuid = '{thank_you_message.uuid}'")
+    assert read_message().has_valid_image is None
+    dao.backfill_thank_you_message_derived_fields(batch_size=2)
+    backfilled_message = read_message()
+    assert (backfilled_message.markdown_text, backfilled_message.has_valid_image) == ("*Thanks*", True)
+    assert thank_you_list_blocks([backfilled_message]) == blocks
+
+
+def test_thank_you_messages_pages_do_not_overlap(existing_company):
+    created_uuids = []
+    for i in range(7):
+        thank_you_message = ThankYouMessage(
+            author_slack_user_id="AUTHOR_SLACK_ID",
+            text=f"Some Text {i}",
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False
+        )
+        dao.create_thank_you_message(thank_you_message)
+        created_uuids.append(thank_you_message.uuid)
+
+    read_uuids = []
+    cursor = None
+    while True:
+        messages, cursor = dao.read_thank_you_messages_page(company_uuid=existing_company.uuid, page_size=3,
+                                                            older_than=cursor)
+        assert len(messages) <= 3
+        read_uuids.extend(message.uuid for message in messages)
+        if cursor is None:
+            break
+
+    assert len(read_uuids) == len(set(read_uuids))
+    assert sorted(read_uuids) == sorted(created_uuids)
+
+
+def test_messages_sent_or_received_by_a_user(existing_company):
+    def create_message(author: str, receivers: list) -> ThankYouMessage:
+        thank_you_message = ThankYouMessage(
+            author_slack_user_id=author,
+            text="Some Text",
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False,
+            receivers=[ThankYouReceiver(slack_user_id=receiver) for receiver in receivers]
+        )
+        dao.create_thank_you_message(thank_you_message)
+        return thank_you_message
+
+    sent = create_message("USER_A", ["USER_B", "USER_C"])
+    received = create_message("USER_C", ["USER_A", "USER_B"])
+    create_message("USER_C", ["USER_B"])
+
+    messages, _ = dao.read_thank_you_messages_page(company_uuid=existing_company.uuid, page_size=10,
+                                                   author_slack_user_id="USER_A", receiver_slack_user_id="USER_A")
+    assert [m.uuid for m in messages] == [received.uuid, sent.uuid]
+    assert [m.uuid for m in dao.read_thank_you_messages(company_uuid=existing_company.uuid,
+                                                        receiver_slack_user_id="USER_A")] == [received.uuid]
+
+
+def test_dao_queries_do_not_read_whole_tables():
+    assert advise(dao, seed_messages=500, min_rows=200, output=None) == []
+
+
+def test_migrations_are_recorded_and_reapply_only_pending_ones():
+    assert applied_versions(dao) == [migration.version for migration in MIGRATIONS]
+    assert migrate(dao) == []
+
+    index_name = "ix_thank_you_receivers__slack_user_id__message"
+    with dao.engine.begin() as connection:
+        connection.exec_driver_sql(f"DROP INDEX {index_name}")
+        connection.exec_driver_sql("DELETE FROM schema_migrations WHERE version = 4")
+
+    assert [migration.version for migration in migrate(dao)] == [4]
+    assert index_name in {index["name"] for index in inspect(dao.engine).get_indexes("thank_you_receivers")}
+    assert applied_versions(dao) == [migration.version for migration in MIGRATIONS]
+
+
+def test_daily_counts_are_filled_by_a_migration(existing_company):
+    dao.create_thank_you_message(ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")]
+    ))
+    # A database which had messages before the rollup table was added
+    with dao.engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM thank_you_daily_counts WHERE company_uuid = ?",
+                                   (existing_company.uuid,))
+        connection.exec_driver_sql("DELETE FROM schema_migrations WHERE version = 5")
+    assert dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid) == []
+
+    assert [migration.version for migration in migrate(dao)] == [5]
+    assert dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid) == [("AUTHOR_SLACK_ID", 1)]
+
+
+def test_pool_metrics_follow_checkouts_and_timeouts():
+    engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool, pool_logging_name="test_pool", pool_size=1,
+                           max_overflow=1, pool_timeout=0.05)
+
+    def sample(name: str) -> float:
+        return REGISTRY.get_sample_value(name, {"pool": "test_pool"}) or 0
+
+    first, second = engine.connect(), engine.connect()
+    assert sample("database_pool_checked_out_connections") == 2
+    assert sample("database_pool_overflow_connections") == 1
+
+    with pytest.raises(SQLAlchemyTimeoutError):
+        engine.connect()
+    assert sample("database_pool_number_of_checkout_timeouts_total") == 1
+    assert sample("database_pool_checkout_wait_time_count") == 3
+
+    first.close()
+    second.close()
+    assert sample("database_pool_checked_out_connections") == 0
+    assert sample("database_pool_overflow_connections") == 0
+    engine.dispose()
+
+
+def test_tuned_sqlite_engine_pools_connections_and_applies_pragmas(tmp_path):
+    engine = create_sqlite_engine(str(tmp_path / "tuned.db"), mode=SQLiteMode.TUNED)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == sqlite_busy_timeout_ms()
+        first_connection = connection.connection.dbapi_connection
+    with engine.connect() as connection:
+        assert connection.connection.dbapi_connection is first_connection
+    engine.dispose()
+
+
+def test_async_dao_matches_sync_dao(existing_company):
+    thank_you_types = dao.read_thank_you_types(company_uuid=existing_company.uuid)
+
+    def summary(messages):
+        return [(m.uuid, m.type.uuid, sorted(r.slack_user_id for r in m.receivers)) for m in messages]
+
+    async def run():
+        async_dao = dao.create_async_dao()
+        committed = []
+        try:
+            async with async_dao.transaction():
+                for i, receivers in enumerate([["USER_A"], ["USER_A", "USER_B"], ["USER_B"]]):
+                    await async_dao.create_thank_you_message(ThankYouMessage(
+                        author_slack_user_id=f"AUTHOR_{i % 2}",
+                        text=f"Async message #{i}",
+                        type=thank_you_types[i % 2],
+                        company=existing_company,
+                        is_rich_text=False,
+                        is_private=False,
+                        receivers=[ThankYouReceiver(slack_user_id=receiver) for receiver in receivers]
+                    ))
+                async_dao.call_after_commit(lambda: committed.append(True))
+
+            with pytest.raises(RuntimeError):
+                async with async_dao.transaction():
+                    await async_dao.delete_thank_you_message(thank_you_message_uuid="does not matter")
+                    raise RuntimeError()
+
+            messages, cursor = await async_dao.read_thank_you_messages_page(
+                company_uuid=existing_company.uuid, page_size=2, load_profile=LoadProfile.HOME_FEED)
+            older_messages, _ = await async_dao.read_thank_you_messages_page(
+                company_uuid=existing_company.uuid, page_size=2, older_than=cursor, load_profile=LoadProfile.HOME_FEED)
+            await async_dao.update_thank_you_message(older_messages[0], ThankYouMessage(
+                author_slack_user_id=older_messages[0].author_slack_user_id,
+                text="Edited async message",
+                type=older_messages[0].type,
+                company=existing_company,
+                is_rich_text=False,
+                is_private=False,
+                receivers=[ThankYouReceiver(slack_user_id="USER_C")]
+            ))
+            return committed, summary(messages), cursor, summary(older_messages), {
+                "messages_num": await async_dao.read_thank_you_messages_num(company_uuid=existing_company.uuid),
+                "receiver_leaders": await async_dao.get_thank_you_receiver_leaders_by_type(
+                    company_uuid=existing_company.uuid),
+                "sender_leaders": await async_dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid),
+                "types": [t.uuid for t in await async_dao.read_thank_you_types(company_uuid=existing_company.uuid)],
+                "company": (await async_dao.read_company(existing_company.uuid)).slack_team_id,
+            }
+        finally:
+            await async_dao.dispose()
+
+    committed, messages, cursor, older_messages, results = asyncio.run(run())
+
+    assert committed == [True]
+    sync_messages, sync_cursor = dao.read_thank_you_messages_page(
+        company_uuid=existing_company.uuid, page_size=2, load_profile=LoadProfile.HOME_FEED)
+    assert messages == summary(sync_messages)
+    assert cursor == sync_cursor
+    edited_message = dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                                thank_you_message_uuid=older_messages[0][0],
+                                                load_profile=LoadProfile.FULL)
+    assert edited_message.text == "Edited async message"
+    assert [r.slack_user_id for r in edited_message.receivers] == ["USER_C"]
+    assert results == {
+        "messages_num": 3,
+        "receiver_leaders": dao.get_thank_you_receiver_leaders_by_type(company_uuid=existing_company.uuid),
+        "sender_leaders": dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid),
+        "types": [t.uuid for t in thank_you_types],
+        "company": existing_company.slack_team_id,
+    }
+
+
+def test_thank_you_message_creation_inserts_without_selects(existing_company):
+    thank_you_type = dao.read_thank_you_types(company_uuid=existing_company.uuid)[0]
+    company = dao.read_company(existing_company.uuid)
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        type=thank_you_type,
+        company=company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1"), ThankYouReceiver(slack_user_id="RECEIVER_2")],
+        images=[ThankYouMessageImage(url="https://example.com/image.png", filename="image.png", ordering_key=0),
+                ThankYouMessageImage(url="https://example.com/image2.png", filename="image2.png", ordering_key=1)]
+    )
+
+    with count_queries() as statements:
+        dao.create_thank_you_message(thank_you_message)
+        assert [r.slack_user_id for r in thank_you_message.receivers] == ["RECEIVER_1", "RECEIVER_2"]
+
+    # company and type may be refreshed (they were expired by the previous commit), but none of the inserted rows
+    # is looked up first
+    for table in ("thank_you_messages", "thank_you_receivers", "thank_you_message_images"):
+        assert not [s for s in statements if s.lstrip().upper().startswith("SELECT") and f"FROM {table} " in s]
+        assert len([s for s in statements if s.lstrip().upper().startswith(f"INSERT INTO {table.upper()} ")]) == 1
+
+    read_message = dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                              thank_you_message_uuid=thank_you_message.uuid,
+                                              load_profile=LoadProfile.FULL)
+    assert sorted(r.slack_user_id for r in read_message.receivers) == ["RECEIVER_1", "RECEIVER_2"]
+    assert len(read_message.images) == 2
+
+
+def test_transaction_commits_once_and_rolls_back_on_error(existing_company):
+    commits = []
+
+    def commit(conn):
+        commits.append(conn)
+
+    def create_thank_you_message() -> ThankYouMessage:
+        thank_you_message = ThankYouMessage(
+            author_slack_user_id="AUTHOR_SLACK_ID",
+            text="Some Text",
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False,
+            receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")]
+        )
+        dao.create_thank_you_message(thank_you_message)
+        return thank_you_message
+
+    event.listen(dao.engine, "commit", commit)
+    try:
+        with dao.transaction():
+            committed_messages = [create_thank_you_message() for _ in range(3)]
+            with dao.transaction():
+                committed_messages.append(create_thank_you_message())
+            dao.read_thank_you_messages(company_uuid=existing_company.uuid)
+        assert len(commits) == 1
+    finally:
+        event.remove(dao.engine, "commit", commit)
+
+    with pytest.raises(ValueError):
+        with dao.transaction():
+            rolled_back_message = create_thank_you_message()
+            raise ValueError("Something went wrong in a handler")
+
+    messages_uuids = [m.uuid for m in dao.read_thank_you_messages(company_uuid=existing_company.uuid)]
+    assert all(m.uuid in messages_uuids for m in committed_messages)
+    assert rolled_back_message.uuid not in messages_uuids
+    assert dao.get_thank_you_sender_leaders(company_uuid=existing_company.uuid) == [("AUTHOR_SLACK_ID", 4)]
+
+
+def test_company_cache_is_invalidated_after_commit(existing_company):
+    from thankyou.slackbot.utils import company as company_utils
+    from thankyou.slackbot.utils.company import get_or_create_company_by_slack_team_id, invalidate_company_cache
+
+    snapshot = get_or_create_company_by_slack_team_id(existing_company.slack_team_id)
+    with count_queries() as statements:
+        assert get_or_create_company_by_slack_team_id(existing_company.slack_team_id) is snapshot
+    assert not statements
+
+    with dao.transaction():
+        company = dao.read_company(existing_company.uuid)
+        company.custom_merci_app_name = "Kudos"
+        invalidate_company_cache(company.slack_team_id)
+        # A concurrent request reads the configuration which is not committed yet and caches it
+        company_utils._companies_cache[existing_company.slack_team_id] = snapshot
+
+    assert get_or_create_company_by_slack_team_id(existing_company.slack_team_id).merci_app_name == "Kudos"
+
+
+def test_read_only_methods_query_replicas_unless_the_user_has_just_written(existing_company, tmp_path, monkeypatch):
+    from thankyou.dao import sqlalchemy as sqlalchemy_dao
+    from thankyou.utils.cache import InProcessCacheBackend, SQLiteCacheBackend
+
+    replica = create_sqlite_engine(str(tmp_path / "replica.db"), mode=SQLiteMode.SIMPLE)
+    dao.metadata.create_all(replica)
+
+    # The read-your-writes window must be seen by all the gunicorn workers
+    monkeypatch.setattr(sqlalchemy_dao._recent_writers, "_backend", InProcessCacheBackend())
+    with pytest.raises(ValueError):
+        dao.set_replica_engines([replica])
+    monkeypatch.setattr(sqlalchemy_dao._recent_writers, "_backend",
+                        SQLiteCacheBackend(str(tmp_path / "shared_cache.sqlite3")))
+
+    def create_thank_you_message() -> ThankYouMessage:
+        thank_you_message = ThankYouMessage(
+            author_slack_user_id="REPLICA_TEST_AUTHOR",
+            text="Some Text",
+            company=existing_company,
+            is_rich_text=False,
+            is_private=False,
+            receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1")]
+        )
+        dao.create_thank_you_message(thank_you_message)
+        return thank_you_message
+
+    def read_messages_uuids() -> list:
+        return [m.uuid for m in dao.read_thank_you_messages(company_uuid=existing_company.uuid)]
+
+    dao.set_replica_engines([replica])
+    try:
+        # The replica is empty, it has not caught up with the primary database yet. The companies are read from the
+        # primary database
+        assert dao.read_companies(slack_team_id=existing_company.slack_team_id)
+        with dao.transaction():
+            thank_you_message = create_thank_you_message()
+            assert thank_you_message.uuid in read_messages_uuids()
+        assert read_messages_uuids() == []
+
+        with dao.on_behalf_of("REPLICA_TEST_AUTHOR"), dao.transaction():
+            thank_you_message = create_thank_you_message()
+        with dao.on_behalf_of("REPLICA_TEST_AUTHOR"):
+            assert thank_you_message.uuid in read_messages_uuids()
+        with dao.on_behalf_of("REPLICA_TEST_READER"):
+            assert read_messages_uuids() == []
+            with dao.primary_reads():
+                assert thank_you_message.uuid in read_messages_uuids()
+    finally:
+        dao.set_replica_engines([])
+        replica.dispose()
+    assert thank_you_message.uuid in read_messages_uuids()
+
+
+def test_dao_methods_and_slow_queries_are_instrumented(existing_company, monkeypatch, caplog):
+    def sample(name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    calls_before = sample("dao_method_latency_count", method="read_thank_you_types")
+    rows_before = sample("dao_method_rows_returned_sum", method="read_thank_you_types")
+    handler_statements_before = sample("slack_handler_dao_statements_sum", handler="test_handler")
+    monkeypatch.setenv("MERCI_DATABASE_SLOW_QUERY_MS", "0.000001")
+
+    with count_handler_statements("test_handler"), count_queries() as statements:
+        thank_you_types = dao.read_thank_you_types(company_uuid=existing_company.uuid)
+        dao.read_companies(slack_team_id=existing_company.slack_team_id)
+
+    assert sample("dao_method_latency_count", method="read_thank_you_types") == calls_before + 1
+    assert sample("dao_method_rows_returned_sum", method="read_thank_you_types") == rows_before + len(thank_you_types)
+    assert sample("slack_handler_dao_statements_sum", handler="test_handler") == \
+           handler_statements_before + len(statements)
+    # The parameters are logged as their types only
+    assert any("Slow query" in r.message and "in read_thank_you_types" in r.message and "parameters: (str)" in r.message
+               and existing_company.uuid not in r.message for r in caplog.records)
+
+    assert statement_fingerprint("SELECT * FROM t WHERE a = ? AND b IN (?, ?, ?) AND c = 'x' LIMIT 10") == \
+           statement_fingerprint("SELECT * FROM t WHERE a = ? AND b IN (?, ?)  AND c = 'y' LIMIT 20") == \
+           "SELECT * FROM t WHERE a = ? AND b IN (?...) AND c = ? LIMIT ?"
+
+
+def test_slack_delivery_outbox_dispatch(existing_company):
+    from slack_sdk.errors import SlackApiError
+
+    from thankyou.core.models import SlackDeliveryOutboxItemKind
+    from thankyou.slackbot.dispatcher import SlackDeliveryDispatcher
+    from thankyou.slackbot.utils.outbox import initial_slack_delivery_outbox_items
+
+    class FakeWebClient:
+        def __init__(self):
+            self.posted_to = []
+
+        def chat_postMessage(self, channel, **kwargs):
+            if channel == "NOT_INVITED_CHANNEL":
+                raise SlackApiError("channel_not_found", {"ok": False, "error": "channel_not_found"})
+            self.posted_to.append(channel)
+            return type("Response", (), {"data": {"ok": True, "ts": str(len(self.posted_to))}})()
+
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        slash_command_slack_channel_id="NOT_INVITED_CHANNEL",
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1"), ThankYouReceiver(slack_user_id="RECEIVER_2")]
+    )
+    with dao.transaction():
+        dao.create_thank_you_message(thank_you_message)
+        items = initial_slack_delivery_outbox_items(thank_you_message)
+        dao.create_slack_delivery_outbox_items(items)
+    assert [item.kind for item in items] == [SlackDeliveryOutboxItemKind.CHANNEL_MESSAGE]
+    # Enqueuing the same deliveries again is a no-op
+    dao.create_slack_delivery_outbox_items(initial_slack_delivery_outbox_items(thank_you_message))
+
+    client = FakeWebClient()
+    dispatcher = SlackDeliveryDispatcher(batch_size=10, max_attempts=3, web_client_factory=lambda _: client)
+    # The channel is not found: the author is notified and the receivers get direct messages
+    assert dispatcher.dispatch_batch() >= 1
+    assert dispatcher.dispatch_batch() >= 3
+    assert dispatcher.dispatch_batch() == 0
+    assert sorted(client.posted_to) == ["AUTHOR_SLACK_ID", "RECEIVER_1", "RECEIVER_2"]
+
+    thank_you_message = dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                                   thank_you_message_uuid=thank_you_message.uuid,
+                                                   load_profile=LoadProfile.FULL)
+    assert sorted(d.slack_channel_id for d in thank_you_message.slack_deliveries) == \
+           ["AUTHOR_SLACK_ID", "RECEIVER_1", "RECEIVER_2"]
+
+
+def test_inline_slack_deliveries_are_made_after_the_commit_and_retried_if_not_stored(existing_company, monkeypatch):
+    from thankyou.core.models import SlackDeliveryOutboxItem, SlackDeliveryOutboxItemStatus
+    from thankyou.slackbot.dispatcher import SlackDeliveryDispatcher, lease_slack_delivery_outbox_items
+    from thankyou.slackbot.utils.outbox import initial_slack_delivery_outbox_items
+
+    commits = []
+
+    def commit(conn):
+        commits.append(conn)
+
+    thank_you_message = ThankYouMessage(
+        author_slack_user_id="AUTHOR_SLACK_ID",
+        text="Some Text",
+        company=existing_company,
+        is_rich_text=False,
+        is_private=False,
+        receivers=[ThankYouReceiver(slack_user_id="RECEIVER_1"), ThankYouReceiver(slack_user_id="RECEIVER_2")]
+    )
+
+    class FakeWebClient:
+        def __init__(self):
+            self.posted_to = []
+
+        def chat_postMessage(self, channel, **kwargs):
+            # The handler has committed once, before its first Slack call (the dispatcher commits are not counted)
+            assert len(commits) == 1
+            with dao.session_maker() as other_session:
+                assert other_session.get(ThankYouMessage, thank_you_message.uuid) is not None
+            self.posted_to.append(channel)
+            return type("Response", (), {"data": {"ok": True, "ts": str(len(self.posted_to))}})()
+
+    def fail_to_store_deliveries(slack_deliveries):
+        raise ValueError("The database is gone")
+
+    def outbox_items():
+        with dao.session_maker() as session:
+            return session.query(SlackDeliveryOutboxItem).filter(
+                SlackDeliveryOutboxItem.thank_you_message_uuid == thank_you_message.uuid).all()
+
+    client = FakeWebClient()
+    dispatcher = SlackDeliveryDispatcher(batch_size=10, max_attempts=3, web_client_factory=lambda _: client)
+    monkeypatch.setattr(dao, "create_thank_you_message_slack_deliveries", fail_to_store_deliveries)
+    event.listen(dao.engine, "commit", commit)
+    try:
+        # What the save handler does in the INLINE delivery mode
+        with pytest.raises(ValueError):
+            with dao.transaction():
+                dao.create_thank_you_message(thank_you_message)
+                items = initial_slack_delivery_outbox_items(thank_you_message)
+                lease_slack_delivery_outbox_items(items)
+                dao.call_after_commit(partial(dispatcher.deliver_items, items, web_client=client))
+                dao.create_slack_delivery_outbox_items(items)
+    finally:
+        event.remove(dao.engine, "commit", commit)
+    assert client.posted_to
+
+    # The message and its pending deliveries are committed, no delivery is half stored
+    assert dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                      thank_you_message_uuid=thank_you_message.uuid,
+                                      load_profile=LoadProfile.FULL).slack_deliveries == []
+    assert [item.status for item in outbox_items()] == [SlackDeliveryOutboxItemStatus.PENDING] * 2
+
+    # The dispatcher takes the deliveries over when their lease expires
+    monkeypatch.undo()
+    for item in outbox_items():
+        item.next_attempt_at = datetime.utcnow()
+        dao.update_slack_delivery_outbox_item(item)
+    while dispatcher.dispatch_batch():
+        pass
+    assert [item.status for item in outbox_items()] == [SlackDeliveryOutboxItemStatus.DONE] * 2
+    assert len(dao.read_thank_you_message(company_uuid=existing_company.uuid,
+                                          thank_you_message_uuid=thank_you_message.uuid,
+                                          load_profile=LoadProfile.FULL).slack_deliveries) == 2
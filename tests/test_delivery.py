@@ -0,0 +1,86 @@
+import threading
+import time
+from functools import partial
+
+from slack_sdk.errors import SlackApiError
+
+from thankyou.slackbot.utils.delivery import SlackDeliveryExecutor, slack_api_error_code
+
+
+class FakeWebClient:
+    """Counts the chat_postMessage calls which are running at once"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def chat_postMessage(self, channel: str, delay: float = None):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay if delay is None else delay)
+            if channel == "NOT_INVITED_CHANNEL":
+                raise SlackApiError("channel_not_found", {"ok": False, "error": "channel_not_found"})
+            return {"ok": True, "channel": channel}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_slack_delivery_executor_limits_concurrent_calls_per_workspace():
+    executor = SlackDeliveryExecutor(max_workers=8, max_concurrency_per_workspace=2)
+    client = FakeWebClient()
+
+    results = executor.run("WORKSPACE", [partial(client.chat_postMessage, channel=f"C{i}") for i in range(6)])
+
+    assert [result.error for result in results] == [None] * 6
+    assert client.max_running == 2
+
+
+def test_slack_delivery_executor_runs_workspaces_independently():
+    executor = SlackDeliveryExecutor(max_workers=8, max_concurrency_per_workspace=2)
+    client = FakeWebClient()
+
+    threads = [
+        threading.Thread(target=executor.run,
+                         args=(workspace_id, [partial(client.chat_postMessage, channel=f"C{i}") for i in range(4)]))
+        for workspace_id in ("WORKSPACE_1", "WORKSPACE_2")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A busy workspace does not take the slots of another one
+    assert client.max_running > 2
+
+
+def test_slack_delivery_executor_returns_results_in_the_order_of_the_calls():
+    executor = SlackDeliveryExecutor(max_workers=4, max_concurrency_per_workspace=4)
+    client = FakeWebClient()
+
+    # The first calls finish last
+    results = executor.run("WORKSPACE", [
+        partial(client.chat_postMessage, channel=f"C{i}", delay=0.01 * (4 - i)) for i in range(4)
+    ])
+
+    assert [result.response["channel"] for result in results] == ["C0", "C1", "C2", "C3"]
+
+
+def test_slack_delivery_executor_keeps_the_results_of_other_calls_if_one_fails():
+    executor = SlackDeliveryExecutor(max_workers=4, max_concurrency_per_workspace=2)
+    client = FakeWebClient(delay=0.01)
+
+    results = executor.run("WORKSPACE", [
+        partial(client.chat_postMessage, channel=channel) for channel in ("C1", "NOT_INVITED_CHANNEL", "C2")
+    ])
+
+    assert results[0].response["channel"] == "C1" and results[0].error is None
+    assert results[1].response is None and slack_api_error_code(results[1].error) == "channel_not_found"
+    assert results[2].response["channel"] == "C2" and results[2].error is None
+    # A single call is made in the caller thread, and its failure is returned as well
+    result, = executor.run("WORKSPACE", [partial(client.chat_postMessage, channel="NOT_INVITED_CHANNEL")])
+    assert slack_api_error_code(result.error) == "channel_not_found"
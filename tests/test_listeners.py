@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from urllib.parse import quote
+
+from slack_bolt import App, BoltRequest
+from slack_bolt.authorization import AuthorizeResult
+
+from thankyou.dao import dao
+from thankyou.slackbot.handlers.registry import EventType
+from thankyou.slackbot.utils.listeners import InstrumentedThreadPoolExecutor, register_slack_listener
+
+
+def test_listener_executor_runs_listeners_in_the_caller_thread_when_its_queue_is_full():
+    executor = InstrumentedThreadPoolExecutor(name="test-caller-runs", max_workers=1, max_queue_size=1)
+    running, release = threading.Event(), threading.Event()
+
+    def blocked():
+        running.set()
+        release.wait(5)
+        return threading.current_thread()
+
+    def failing():
+        raise ValueError("Listener error")
+
+    running_future = executor.submit(blocked)
+    assert running.wait(5)
+    queued_future = executor.submit(threading.current_thread)
+
+    # The only worker is busy and the queue is full
+    caller_run_future = executor.submit(threading.current_thread)
+    assert caller_run_future.done() and caller_run_future.result() is threading.current_thread()
+    failed_future = executor.submit(failing)
+    assert isinstance(failed_future.exception(), ValueError)
+    assert not queued_future.done()
+
+    release.set()
+    assert running_future.result(5) is not threading.current_thread()
+    assert queued_future.result(5) is not threading.current_thread()
+    # The slots of the finished listeners are free again
+    assert executor.submit(threading.current_thread).result(5) is not threading.current_thread()
+    executor.shutdown()
+
+
+def test_lazy_listeners_are_acknowledged_right_away_and_run_in_a_transaction():
+    executor = InstrumentedThreadPoolExecutor(name="test-lazy-listeners", max_workers=2, max_queue_size=2)
+    app = App(
+        signing_secret="SIGNING_SECRET",
+        authorize=lambda: AuthorizeResult(enterprise_id=None, team_id="T_LISTENER_TEST", bot_token="xoxb-test"),
+        request_verification_enabled=False,
+        listener_executor=executor,
+    )
+    running, release = threading.Event(), threading.Event()
+    listener_threads = []
+    committed = []
+
+    def button_clicked_handler(body, logger):
+        listener_threads.append(threading.current_thread())
+        # Inside the transaction of the listener the callback waits for the commit
+        dao.call_after_commit(lambda: committed.append(threading.current_thread()))
+        running.set()
+        release.wait(5)
+
+    register_slack_listener(app, EventType.Action, "listener_test_button_clicked", button_clicked_handler, lazy=True)
+
+    payload = {
+        "type": "block_actions",
+        "team": {"id": "T_LISTENER_TEST"},
+        "user": {"id": "U_LISTENER_TEST", "team_id": "T_LISTENER_TEST"},
+        "api_app_id": "A_LISTENER_TEST",
+        "trigger_id": "TRIGGER_ID",
+        "actions": [{"action_id": "listener_test_button_clicked", "block_id": "BLOCK_ID", "type": "button",
+                     "action_ts": "1"}],
+    }
+    response = app.dispatch(BoltRequest(
+        body=f"payload={quote(json.dumps(payload))}",
+        headers={"content-type": ["application/x-www-form-urlencoded"]},
+    ))
+
+    # Slack got the acknowledgement while the listener is still running
+    assert response.status == 200
+    assert running.wait(5)
+    assert listener_threads[0] is not threading.current_thread()
+    assert committed == []
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while not committed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert committed == listener_threads
+    executor.shutdown()
@@ -1,5 +1,6 @@
 import logging
 import os
+import sys
 from enum import Enum
 from typing import Optional, List
 
@@ -11,6 +12,13 @@ def _demand_env_variable(name: str) -> str:
     return result
 
 
+def _get_bool_env_variable(name: str, default: bool) -> bool:
+    value = os.getenv(name, "").lower().strip()
+    if value:
+        return value in ("1", "true", "yes")
+    return default
+
+
 def slack_bot_token() -> Optional[str]:
     return os.getenv("SLACK_BOT_TOKEN")
 
@@ -70,6 +78,215 @@ def get_active_dao_type(default=DaoType.POSTGRES) -> DaoType:
         return default
 
 
+class CacheBackendType(Enum):
+    MEMORY = 1  # Private to every process (gunicorn worker)
+    SQLITE = 2  # A local SQLite file shared by all the processes of a container
+
+
+def get_cache_backend_type(default=CacheBackendType.MEMORY) -> CacheBackendType:
+    try:
+        return CacheBackendType[os.getenv("MERCI_CACHE_BACKEND", "").upper().strip()]
+    except KeyError:
+        return default
+
+
+def shared_cache_sqlite_file(default=None) -> str:
+    """The file of the SQLite cache backend and token buckets. By default it is in the runtime directory of the user
+    ($XDG_RUNTIME_DIR) or next to the SQLite DAO database, not in a directory where other users can create it"""
+    filename = os.getenv("MERCI_CACHE_SQLITE_FILE") or default
+    if filename:
+        return filename
+    folder = os.getenv("XDG_RUNTIME_DIR") or os.path.join(os.path.dirname(__file__), "..", "..", "sqlite_data")
+    return os.path.join(folder, "merci_shared_cache.db")
+
+
+class SQLiteMode(Enum):
+    SIMPLE = 1  # A new connection per DAO call, rollback journal. Enough for development and tests
+    TUNED = 2  # Pooled connections, WAL journal and the sqlite_* pragmas below. For small self-hosted installs
+
+
+def get_sqlite_mode(default=SQLiteMode.SIMPLE) -> SQLiteMode:
+    try:
+        return SQLiteMode[os.getenv("MERCI_SQLITE_MODE", "").upper().strip()]
+    except KeyError:
+        return default
+
+
+def sqlite_database_file(default=None) -> Optional[str]:
+    """The SQLite DAO database file, sqlite_data/thank_you.db by default"""
+    return os.getenv("MERCI_SQLITE_DATABASE_FILE") or default
+
+
+def sqlite_pool_size(default=10) -> int:
+    """Connections kept open by the TUNED SQLite DAO, enough for every listener thread to have its own one"""
+    return int(os.getenv("MERCI_SQLITE_POOL_SIZE") or default)
+
+
+def sqlite_mmap_size_bytes(default=256 * 1024 * 1024) -> int:
+    return int(os.getenv("MERCI_SQLITE_MMAP_SIZE_BYTES") or default)
+
+
+def sqlite_cache_size_kib(default=64 * 1024) -> int:
+    """The page cache size of every connection"""
+    return int(os.getenv("MERCI_SQLITE_CACHE_SIZE_KIB") or default)
+
+
+def sqlite_busy_timeout_ms(default=5000) -> int:
+    """How long a writer waits for another one to commit before failing with a "database is locked" error"""
+    return int(os.getenv("MERCI_SQLITE_BUSY_TIMEOUT_MS") or default)
+
+
+def slack_delivery_max_workers(default=16) -> int:
+    """The number of threads (per process) which post, update and delete thank you messages in Slack"""
+    return int(os.getenv("MERCI_SLACK_DELIVERY_MAX_WORKERS") or default)
+
+
+def slack_delivery_max_concurrency_per_workspace(default=4) -> int:
+    return int(os.getenv("MERCI_SLACK_DELIVERY_MAX_CONCURRENCY_PER_WORKSPACE") or default)
+
+
+class SlackListenerMode(Enum):
+    SYNC = 1  # Slack gets the HTTP response after the handler finishes
+    # Requests are acknowledged right away, handlers run in the listener executor (Bolt lazy listeners). Slack does
+    # not retry the requests of the handlers which fail then
+    LAZY = 2
+
+
+def get_slack_listener_mode(default=SlackListenerMode.SYNC) -> SlackListenerMode:
+    try:
+        return SlackListenerMode[os.getenv("MERCI_SLACK_LISTENER_MODE", "").upper().strip()]
+    except KeyError:
+        return default
+
+
+class SlackAppMode(Enum):
+    SYNC = 1  # slack_bolt.App, a request pins a thread (a gunicorn sync worker) until its handler finishes
+    ASYNC = 2  # slack_bolt.async_app.AsyncApp, requests are handled by asyncio tasks of one event loop
+
+
+def get_slack_app_mode(default=SlackAppMode.SYNC) -> SlackAppMode:
+    try:
+        return SlackAppMode[os.getenv("MERCI_SLACK_APP_MODE", "").upper().strip()]
+    except KeyError:
+        return default
+
+
+def slack_listener_max_workers(default=10) -> int:
+    """The number of threads (per process) which run the lazy listeners"""
+    return int(os.getenv("MERCI_SLACK_LISTENER_MAX_WORKERS") or default)
+
+
+def slack_listener_max_queue_size(default=100) -> int:
+    """How many lazy listeners can wait for a thread. When the queue is full, handlers run in the request thread"""
+    return int(os.getenv("MERCI_SLACK_LISTENER_MAX_QUEUE_SIZE") or default)
+
+
+class SlackDeliveryMode(Enum):
+    INLINE = 1  # The handler which saves a new thank you message posts it to Slack once it is committed
+    OUTBOX = 2  # The handler writes the deliveries to an outbox which is drained by thankyou.slackbot.dispatcher
+
+
+def get_slack_delivery_mode(default=SlackDeliveryMode.INLINE) -> SlackDeliveryMode:
+    try:
+        return SlackDeliveryMode[os.getenv("MERCI_SLACK_DELIVERY_MODE", "").upper().strip()]
+    except KeyError:
+        return default
+
+
+def slack_delivery_outbox_batch_size(default=50) -> int:
+    return int(os.getenv("MERCI_SLACK_DELIVERY_OUTBOX_BATCH_SIZE") or default)
+
+
+def slack_delivery_outbox_poll_interval_seconds(default=1.0) -> float:
+    """How long the dispatcher sleeps when there is nothing to deliver"""
+    return float(os.getenv("MERCI_SLACK_DELIVERY_OUTBOX_POLL_INTERVAL_SECONDS") or default)
+
+
+def slack_delivery_outbox_max_attempts(default=6) -> int:
+    return int(os.getenv("MERCI_SLACK_DELIVERY_OUTBOX_MAX_ATTEMPTS") or default)
+
+
+def slack_rate_limit_max_wait_seconds(default=10.0) -> float:
+    """The longest time a Slack Web API call waits for a rate limit token before it is made anyway"""
+    return float(os.getenv("MERCI_SLACK_RATE_LIMIT_MAX_WAIT_SECONDS") or default)
+
+
+def slack_rate_limit_max_retries(default=2) -> int:
+    """How many times a rate limited (HTTP 429) Slack Web API call is retried"""
+    return int(os.getenv("MERCI_SLACK_RATE_LIMIT_MAX_RETRIES") or default)
+
+
+def validate_slack_blocks(default=None) -> bool:
+    """Whether the blocks built as dicts (see thankyou.slackbot.blocks.builders) are validated with slack_sdk.
+    By default they are validated only by tests"""
+    value = os.getenv("MERCI_VALIDATE_SLACK_BLOCKS", "").lower().strip()
+    if value:
+        return value in ("1", "true", "yes")
+    return "pytest" in sys.modules if default is None else default
+
+
+def database_migrate_on_startup(default=False) -> bool:
+    """Whether SQLAlchemyDao applies the schema migrations when it is created. By default they are applied by
+    `python -m thankyou.dao migrate` (the merci-migrate service), once, before the workers start. Turned on by the
+    tests and local runs on a throwaway SQLite database"""
+    return _get_bool_env_variable("MERCI_DATABASE_MIGRATE_ON_STARTUP", default)
+
+
+def database_pool_size(default=5) -> int:
+    """Connections kept open by the pool of every process. A process may open up to database_pool_size() +
+    database_pool_max_overflow() connections, which all the gunicorn workers together must fit in max_connections"""
+    return int(os.getenv("MERCI_DATABASE_POOL_SIZE") or default)
+
+
+def database_pool_max_overflow(default=10) -> int:
+    """Connections opened above the pool size when all of them are checked out, closed when returned"""
+    return int(os.getenv("MERCI_DATABASE_POOL_MAX_OVERFLOW") or default)
+
+
+def database_pool_timeout_seconds(default=20.0) -> float:
+    """How long a thread waits for a connection when the pool and its overflow are exhausted"""
+    return float(os.getenv("MERCI_DATABASE_POOL_TIMEOUT_SECONDS") or default)
+
+
+def database_pool_pre_ping(default=False) -> bool:
+    """Whether a connection is tested (SELECT 1) before it is checked out, to survive database restarts"""
+    return _get_bool_env_variable("MERCI_DATABASE_POOL_PRE_PING", default)
+
+
+def database_pool_use_lifo(default=False) -> bool:
+    """Whether the most recently returned connection is reused first, which lets the idle ones time out"""
+    return _get_bool_env_variable("MERCI_DATABASE_POOL_USE_LIFO", default)
+
+
+def database_statement_timeout_ms(default=None) -> Optional[int]:
+    """Postgres statement_timeout of the connections, no timeout if it is not set or 0"""
+    timeout_ms = int(os.getenv("MERCI_DATABASE_STATEMENT_TIMEOUT_MS") or default or 0)
+    return timeout_ms or None
+
+
+def database_application_name(default="merci") -> str:
+    """Postgres application_name of the connections, shown in pg_stat_activity"""
+    return os.getenv("MERCI_DATABASE_APPLICATION_NAME") or default
+
+
+def database_replica_hosts(default=None) -> List[str]:
+    """host[:port] of the Postgres read replicas, comma separated. The read-only DAO methods query a replica, all the
+    other statements go to POSTGRES_HOST. Replicas require MERCI_CACHE_BACKEND=SQLITE"""
+    return [host.strip() for host in (os.getenv("MERCI_DATABASE_REPLICA_HOSTS") or default or "").split(",")
+            if host.strip()]
+
+
+def database_read_your_writes_seconds(default=10.0) -> float:
+    """For how long the reads made for a Slack user go to the primary database after a transaction of this user
+    wrote to it. It should be longer than the usual replication lag"""
+    return float(os.getenv("MERCI_DATABASE_READ_YOUR_WRITES_SECONDS") or default)
+
+
+def database_slow_query_ms(default=500.0) -> float:
+    """Statements which take longer are logged (with their fingerprint, not their parameters), 0 turns the log off"""
+    return float(os.getenv("MERCI_DATABASE_SLOW_QUERY_MS") or default)
+
+
 def database_encryption_secret_key(default=None) -> Optional[str]:
     secret_key = os.getenv("DATABASE_ENCRYPTION_SECRET_KEY", default)
     if secret_key == "":
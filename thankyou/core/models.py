@@ -115,6 +115,11 @@ class ThankYouMessage:
     images: List[ThankYouMessageImage] = field(default_factory=list)
     slack_deliveries: List[ThankYouMessageSlackDelivery] = field(default_factory=list)
 
+    # Derived from the text and the images when the message is saved, so they are not recomputed on every render.
+    # has_valid_image is None until they are computed
+    markdown_text: Optional[str] = None
+    has_valid_image: Optional[bool] = None
+
     uuid: UUID_Type = field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = field(default_factory=datetime.utcnow)
 
@@ -125,6 +130,40 @@ class ThankYouMessage:
         return sorted(self.images, key=lambda i: i.ordering_key)
 
 
+class SlackDeliveryOutboxItemKind(Enum):
+    INVITE_RECEIVERS_TO_CHANNEL = "invite_receivers_to_channel"
+    CHANNEL_MESSAGE = "channel_message"
+    EPHEMERAL_MESSAGE = "ephemeral_message"
+    DIRECT_MESSAGE = "direct_message"
+    NOT_DELIVERED_TO_CHANNEL_NOTICE = "not_delivered_to_channel_notice"
+
+
+class SlackDeliveryOutboxItemStatus(Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class SlackDeliveryOutboxItem:
+    """A Slack delivery of a thank you message which is waiting to be made by the dispatcher. There is at most one
+    item per (message, kind, channel, user): slack_channel_id and slack_user_id are empty strings when they do not
+    apply to the kind"""
+    thank_you_message_uuid: UUID_Type
+    company_uuid: UUID_Type
+    kind: SlackDeliveryOutboxItemKind
+    slack_channel_id: Slack_Channel_ID_Type = ""
+    slack_user_id: Slack_User_ID_Type = ""
+
+    status: SlackDeliveryOutboxItemStatus = SlackDeliveryOutboxItemStatus.PENDING
+    attempts: int = 0
+    next_attempt_at: datetime = field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+
+    uuid: UUID_Type = field(default_factory=lambda: str(uuid.uuid4()))
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+
 @dataclass
 class ThankYouStats:
     type: ThankYouType
@@ -4,6 +4,7 @@ from threading import Lock
 
 from thankyou.core.config import get_active_dao_type, DaoType, INITIAL_THANK_YOU_TYPES, database_encryption_secret_key
 from thankyou.core.models import Company, ThankYouType
+from thankyou.dao.interface import AsyncDao
 from thankyou.dao.postres import PostgresDao
 from thankyou.dao.sqlite import SQLiteDao
 
@@ -34,6 +35,18 @@ with __CREATE_DAO_LOCK:
     else:
         raise TypeError(f"DAO {get_active_dao_type().name} is not supported")
 
+_async_dao = None
+
+
+def get_async_dao() -> AsyncDao:
+    """The asyncio DAO of the process (see SQLAlchemyDao.create_async_dao). It is created on the first call, its
+    engine is bound to the event loop it is first used in"""
+    global _async_dao
+    with __CREATE_DAO_LOCK:
+        if _async_dao is None:
+            _async_dao = dao.create_async_dao()
+        return _async_dao
+
 
 def create_initial_data(company: Company):
     existing_thank_you_types = dao.read_thank_you_types(company_uuid=company.uuid)
@@ -0,0 +1,91 @@
+import argparse
+import logging
+import sys
+
+from thankyou.dao import dao
+from thankyou.dao.sqlalchemy import SQLAlchemyDao
+
+
+def rebuild_daily_counts(args):
+    if not isinstance(dao, SQLAlchemyDao):
+        raise TypeError(f"Daily counts can not be rebuilt for the Dao type {type(dao)}")
+    dao.rebuild_thank_you_daily_counts(batch_size=args.batch_size, progress=print)
+
+
+def backfill_derived_fields(args):
+    if not isinstance(dao, SQLAlchemyDao):
+        raise TypeError(f"Derived fields can not be backfilled for the Dao type {type(dao)}")
+    dao.backfill_thank_you_message_derived_fields(batch_size=args.batch_size, progress=print)
+
+
+def migrate(args):
+    if not isinstance(dao, SQLAlchemyDao):
+        raise TypeError(f"The schema can not be migrated for the Dao type {type(dao)}")
+    from thankyou.dao.migrations import MIGRATIONS, applied_versions, migrate as migrate_schema
+    if args.list:
+        versions = set(applied_versions(dao))
+        for migration in MIGRATIONS:
+            print(f"{migration.version:>4} {migration.name}: {'applied' if migration.version in versions else 'pending'}")
+        return
+    applied = migrate_schema(dao, progress=print)
+    print(f"{len(applied)} migration(s) applied")
+
+
+def explain(args):
+    if not isinstance(dao, SQLAlchemyDao):
+        raise TypeError(f"Queries can not be explained for the Dao type {type(dao)}")
+    from thankyou.dao.advisor import advise
+    failed = advise(dao, seed_messages=args.seed_messages, min_rows=args.min_rows, verbose=args.verbose)
+    if failed:
+        print(f"{len(failed)} DAO method(s) read whole tables: {', '.join(result.method for result in failed)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m thankyou.dao", description="Database maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_daily_counts_parser = subparsers.add_parser(
+        "rebuild-daily-counts",
+        help="Rebuild the leaderboard rollup table (thank_you_daily_counts) from the thank you messages history"
+    )
+    rebuild_daily_counts_parser.add_argument("--batch-size", type=int, default=1000,
+                                             help="Number of thank you messages read per query")
+    rebuild_daily_counts_parser.set_defaults(func=rebuild_daily_counts)
+
+    backfill_derived_fields_parser = subparsers.add_parser(
+        "backfill-derived-fields",
+        help="Compute the markdown rendition and the image flag of the thank you messages saved before these "
+             "columns were added"
+    )
+    backfill_derived_fields_parser.add_argument("--batch-size", type=int, default=1000,
+                                                help="Number of thank you messages updated per transaction")
+    backfill_derived_fields_parser.set_defaults(func=backfill_derived_fields)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate",
+        help="Apply the pending schema migrations (see thankyou.dao.migrations). Indexes are created concurrently on "
+             "Postgres and the existing rows are updated in batches, so it can run while the bot is serving"
+    )
+    migrate_parser.add_argument("--list", action="store_true", help="Only list the migrations and their status")
+    migrate_parser.set_defaults(func=migrate)
+
+    explain_parser = subparsers.add_parser(
+        "explain",
+        help="Explain the queries of the DAO methods against a seeded company and fail if any of them reads a whole "
+             "table (see thankyou.dao.advisor)"
+    )
+    explain_parser.add_argument("--seed-messages", type=int, default=5000,
+                                help="Number of thank you messages the advisor company is seeded with")
+    explain_parser.add_argument("--min-rows", type=int, default=1000,
+                                help="Sequential scans of the tables with fewer rows are not reported")
+    explain_parser.add_argument("--verbose", action="store_true", help="Print the plans of all the queries")
+    explain_parser.set_defaults(func=explain)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
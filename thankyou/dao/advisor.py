@@ -0,0 +1,234 @@
+"""Explains the queries of the DAO methods and reports the ones which read a whole table (a sequential scan).
+
+The DAO methods are called the way the Slack handlers call them, against a company seeded with thank you messages
+(see seed_company), and every SELECT they run is explained with the same parameters. Tables smaller than min_rows
+are not reported: the databases scan them instead of using an index anyway.
+
+    python -m thankyou.dao explain --seed-messages 5000
+"""
+import json
+import random
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+
+from sqlalchemy import Connection, event
+
+from thankyou.core.models import Company, LeaderbordTimeSettings, ThankYouMessage, ThankYouReceiver, Employee
+from thankyou.dao import create_initial_data
+from thankyou.dao.interface import LoadProfile
+from thankyou.dao.sqlalchemy import SQLAlchemyDao
+
+
+ADVISOR_COMPANY_SLACK_TEAM_ID = "thank_you_dao_advisor"
+
+# A full scan of a table or of one of its indexes (SEARCH is an index lookup)
+_SQLITE_TABLE_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$")
+
+
+@dataclass
+class StatementPlan:
+    statement: str
+    plan: List[str]
+    # Tables read with a sequential scan or a full index scan
+    scanned_tables: List[str] = field(default_factory=list)
+
+
+@dataclass
+class MethodPlans:
+    method: str
+    statements: List[StatementPlan] = field(default_factory=list)
+    # Scanned tables which have at least min_rows rows
+    sequential_scans: List[str] = field(default_factory=list)
+
+
+@contextmanager
+def _captured_statements(dao: SQLAlchemyDao) -> Generator[List[Tuple[str, tuple]], None, None]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(dao.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(dao.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _explain_sqlite(connection: Connection, statement: str, parameters) -> StatementPlan:
+    details = [row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    scanned_tables = [match.group(1) for match in map(_SQLITE_TABLE_SCAN.match, details) if match]
+    return StatementPlan(statement=statement, plan=details, scanned_tables=scanned_tables)
+
+
+def _explain_postgresql(connection: Connection, statement: str, parameters) -> StatementPlan:
+    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    lines = []
+    scanned_tables = []
+
+    def walk(node: dict, depth: int):
+        relation = f" on {node['Relation Name']}" if "Relation Name" in node else ""
+        index = f" using {node['Index Name']}" if "Index Name" in node else ""
+        lines.append(f"{'  ' * depth}{node['Node Type']}{relation}{index}")
+        if node["Node Type"] == "Seq Scan" or (node["Node Type"] in ("Index Scan", "Index Only Scan")
+                                                and "Index Cond" not in node):
+            scanned_tables.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child, depth + 1)
+
+    walk(plan[0]["Plan"], 0)
+    return StatementPlan(statement=statement, plan=lines, scanned_tables=scanned_tables)
+
+
+def explain(dao: SQLAlchemyDao, method: str, call: Callable[[], object], table_rows: Dict[str, int],
+            min_rows: int) -> MethodPlans:
+    with _captured_statements(dao) as statements:
+        call()
+
+    explain_statement = _explain_postgresql if dao.engine.dialect.name == "postgresql" else _explain_sqlite
+    result = MethodPlans(method=method)
+    with dao.engine.connect() as connection:
+        for statement, parameters in statements:
+            statement_plan = explain_statement(connection, statement, parameters)
+            result.statements.append(statement_plan)
+            result.sequential_scans.extend(table for table in statement_plan.scanned_tables
+                                           if table_rows.get(table, 0) >= min_rows)
+    return result
+
+
+def seed_company(dao: SQLAlchemyDao, messages_num: int, users_num: int = 200, days_num: int = 365) -> Company:
+    """Creates the advisor company and its thank you messages, unless it already has messages_num of them"""
+    companies = dao.read_companies(slack_team_id=ADVISOR_COMPANY_SLACK_TEAM_ID)
+    if companies:
+        company = companies[0]
+    else:
+        company = Company(
+            slack_team_id=ADVISOR_COMPANY_SLACK_TEAM_ID,
+            admins=[],
+            enable_sharing_in_a_slack_channel=False,
+            share_messages_in_slack_channel=None,
+            leaderbord_time_settings=LeaderbordTimeSettings.LAST_30_DAYS,
+            enable_weekly_thank_you_limit=True,
+            weekly_thank_you_limit=10,
+            receivers_number_limit=10,
+            enable_leaderboard=True,
+            enable_private_message_counting_in_leaderboard=False,
+            enable_company_values=True,
+            enable_rich_text_in_thank_you_messages=False,
+            enable_attaching_files=False,
+            enable_private_messages=True,
+            max_attached_files_num=0,
+        )
+        dao.create_company(company)
+        create_initial_data(company)
+
+    existing_messages_num = dao.read_thank_you_messages_num(company_uuid=company.uuid, deleted=None)
+    thank_you_types = dao.read_thank_you_types(company_uuid=company.uuid)
+    slack_user_ids = [f"U_ADVISOR_{i}" for i in range(users_num)]
+    now = datetime.utcnow()
+    rnd = random.Random(existing_messages_num)
+    for batch_start in range(existing_messages_num, messages_num, 100):
+        with dao.transaction():
+            for i in range(batch_start, min(batch_start + 100, messages_num)):
+                thank_you_message = ThankYouMessage(
+                    text=f"Thank you #{i}",
+                    company=company,
+                    is_rich_text=False,
+                    is_private=rnd.random() < 0.1,
+                    type=rnd.choice(thank_you_types),
+                    author_slack_user_id=rnd.choice(slack_user_ids),
+                    receivers=[ThankYouReceiver(slack_user_id=slack_user_id)
+                               for slack_user_id in rnd.sample(slack_user_ids, rnd.randint(1, 3))],
+                    created_at=now - timedelta(minutes=rnd.randint(0, days_num * 24 * 60)),
+                )
+                dao.create_thank_you_message(thank_you_message)
+                if rnd.random() < 0.05:
+                    dao.delete_thank_you_message(thank_you_message.uuid)
+    for slack_user_id in slack_user_ids:
+        if dao.read_employee_by_slack_id(company_uuid=company.uuid, slack_user_id=slack_user_id) is None:
+            dao.create_employee(Employee(company_uuid=company.uuid, slack_user_id=slack_user_id,
+                                         closed_welcome_message=False))
+
+    # Let the planner know the sizes of the tables
+    with dao.engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    return company
+
+
+def dao_method_calls(dao: SQLAlchemyDao, company: Company) -> List[Tuple[str, Callable[[], object]]]:
+    """The read methods of the DAO, called with the arguments the Slack handlers use"""
+    now = datetime.utcnow()
+    month_ago = now - timedelta(days=30)
+    week_ago = now - timedelta(days=7)
+    slack_user_id = "U_ADVISOR_1"
+    thank_you_types = dao.read_thank_you_types(company_uuid=company.uuid)
+    messages, cursor = dao.read_thank_you_messages_page(company_uuid=company.uuid, page_size=20, private=False)
+    message_uuid = messages[0].uuid if messages else ""
+
+    return [
+        ("read_companies", lambda: dao.read_companies(slack_team_id=company.slack_team_id)),
+        ("read_company", lambda: dao.read_company(company.uuid)),
+        ("read_thank_you_types", lambda: dao.read_thank_you_types(company_uuid=company.uuid)),
+        ("read_thank_you_type", lambda: dao.read_thank_you_type(company_uuid=company.uuid,
+                                                                thank_you_type_uuid=thank_you_types[0].uuid)),
+        ("read_employee_by_slack_id", lambda: dao.read_employee_by_slack_id(company_uuid=company.uuid,
+                                                                            slack_user_id=slack_user_id)),
+        ("read_thank_you_message", lambda: dao.read_thank_you_message(
+            company_uuid=company.uuid, thank_you_message_uuid=message_uuid, load_profile=LoadProfile.FULL)),
+        ("read_thank_you_messages_page (company)", lambda: dao.read_thank_you_messages_page(
+            company_uuid=company.uuid, page_size=20, private=False, load_profile=LoadProfile.HOME_FEED)),
+        ("read_thank_you_messages_page (company, older)", lambda: dao.read_thank_you_messages_page(
+            company_uuid=company.uuid, page_size=20, private=False, older_than=cursor,
+            load_profile=LoadProfile.HOME_FEED)),
+        ("read_thank_you_messages_page (author or receiver)", lambda: dao.read_thank_you_messages_page(
+            company_uuid=company.uuid, page_size=20, author_slack_user_id=slack_user_id,
+            receiver_slack_user_id=slack_user_id, load_profile=LoadProfile.HOME_FEED)),
+        ("read_thank_you_messages (author, week)", lambda: dao.read_thank_you_messages(
+            company_uuid=company.uuid, author_slack_user_id=slack_user_id, created_after=week_ago,
+            created_before=now)),
+        ("read_thank_you_messages_num (company)", lambda: dao.read_thank_you_messages_num(
+            company_uuid=company.uuid, created_after=now - timedelta(days=10 * 365), private=False)),
+        ("get_thank_you_sender_leaders", lambda: dao.get_thank_you_sender_leaders(
+            company_uuid=company.uuid, created_after=month_ago, created_before=now)),
+        ("get_thank_you_receiver_leaders", lambda: dao.get_thank_you_receiver_leaders(
+            company_uuid=company.uuid, created_after=month_ago, created_before=now)),
+        ("get_thank_you_sender_leaders_by_type", lambda: dao.get_thank_you_sender_leaders_by_type(
+            company_uuid=company.uuid, created_after=month_ago, created_before=now)),
+        ("get_thank_you_receiver_leaders_by_type", lambda: dao.get_thank_you_receiver_leaders_by_type(
+            company_uuid=company.uuid, created_after=month_ago, created_before=now)),
+    ]
+
+
+def table_rows(dao: SQLAlchemyDao) -> Dict[str, int]:
+    with dao.engine.connect() as connection:
+        return {table.name: connection.exec_driver_sql(f"SELECT count(*) FROM {table.name}").scalar()
+                for table in dao.metadata.sorted_tables}
+
+
+def advise(dao: SQLAlchemyDao, seed_messages: int = 5000, min_rows: int = 1000,
+           output: Optional[Callable[[str], None]] = print, verbose: bool = False) -> List[MethodPlans]:
+    """Explains the queries of every DAO read method and returns the methods which read whole tables"""
+    company = seed_company(dao, messages_num=seed_messages)
+    rows = table_rows(dao)
+    failed = []
+    for method, call in dao_method_calls(dao, company):
+        result = explain(dao, method, call, table_rows=rows, min_rows=min_rows)
+        if result.sequential_scans:
+            failed.append(result)
+        if output:
+            status = "SEQ SCAN " + ", ".join(sorted(set(result.sequential_scans))) if result.sequential_scans else "ok"
+            output(f"{method}: {status}")
+            if verbose or result.sequential_scans:
+                for statement_plan in result.statements:
+                    output("    " + " ".join(statement_plan.statement.split()))
+                    for line in statement_plan.plan:
+                        output("        " + line)
+    return failed
+
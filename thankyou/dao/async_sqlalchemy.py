@@ -0,0 +1,289 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from thankyou.core.models import ThankYouType, Company, ThankYouMessage, Slack_User_ID_Type, CompanyAdmin, \
+    UUID_Type, Employee, ThankYouMessageSlackDelivery, SlackDeliveryOutboxItem
+from thankyou.dao.interface import AsyncDao, LoadProfile
+from thankyou.dao.sqlalchemy import SQLAlchemyDao, _transaction_session
+
+
+_T = TypeVar("_T")
+
+# The session of the transaction() block the current asyncio task is in, if any
+_async_transaction_session: ContextVar[Optional[AsyncSession]] = ContextVar(
+    "thank_you_async_dao_transaction_session", default=None)
+_async_transaction_after_commit_callbacks: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar(
+    "thank_you_async_dao_transaction_after_commit_callbacks", default=None)
+
+
+def _call_in_session(session: Session, fn: Callable[[Session], _T]) -> _T:
+    """Makes the SQLAlchemyDao methods called by fn use the session (as if they were in its transaction() block)"""
+    token = _transaction_session.set(session)
+    try:
+        return fn(session)
+    finally:
+        _transaction_session.reset(token)
+
+
+class AsyncSQLAlchemyDao(AsyncDao):
+    """Runs the queries of a SQLAlchemyDao on an asyncio engine (asyncpg, aiosqlite).
+
+    The tables, the mappers and the queries are the ones of the SQLAlchemyDao: every method runs the SQLAlchemyDao
+    method with AsyncSession.run_sync(), which executes the synchronous ORM code in a greenlet and awaits the
+    database driver. The sessions don't expire the objects on commit, so they can be used after the call.
+    """
+
+    def __init__(self, dao: SQLAlchemyDao, engine: AsyncEngine):
+        self._dao = dao
+        self._engine = engine
+        self._session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine
+
+    async def dispose(self):
+        await self._engine.dispose()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncGenerator[None, None]:
+        if _async_transaction_session.get() is not None:
+            yield
+            return
+
+        after_commit_callbacks = []
+        async with self._session_maker() as session:
+            token = _async_transaction_session.set(session)
+            callbacks_token = _async_transaction_after_commit_callbacks.set(after_commit_callbacks)
+            try:
+                yield
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _async_transaction_after_commit_callbacks.reset(callbacks_token)
+                _async_transaction_session.reset(token)
+
+        for callback in after_commit_callbacks:
+            callback()
+
+    def call_after_commit(self, callback: Callable[[], None]):
+        after_commit_callbacks = _async_transaction_after_commit_callbacks.get()
+        if after_commit_callbacks is None:
+            callback()
+        else:
+            after_commit_callbacks.append(callback)
+
+    async def _run(self, fn: Callable[[Session], _T]) -> _T:
+        session = _async_transaction_session.get()
+        if session is not None:
+            return await session.run_sync(_call_in_session, fn)
+
+        async with self._session_maker() as session:
+            result = await session.run_sync(_call_in_session, fn)
+            await session.commit()
+            return result
+
+    async def _call(self, method_name: str, *args, **kwargs):
+        method = getattr(self._dao, method_name)
+        return await self._run(lambda session: method(*args, **kwargs))
+
+    async def create_thank_you_message(self, thank_you_message: ThankYouMessage):
+        await self._call("create_thank_you_message", thank_you_message)
+
+    async def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str,
+                                     load_profile: LoadProfile = None) -> Optional[ThankYouMessage]:
+        return await self._call("read_thank_you_message", company_uuid=company_uuid,
+                                thank_you_message_uuid=thank_you_message_uuid, load_profile=load_profile)
+
+    async def read_thank_you_messages(self, company_uuid: str, created_after: datetime = None,
+                                      created_before: datetime = None, with_types: List[str] = None,
+                                      deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                      author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                      last_n: int = None, load_profile: LoadProfile = None) \
+            -> List[ThankYouMessage]:
+        return await self._call(
+            "read_thank_you_messages",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            with_types=with_types,
+            deleted=deleted,
+            private=private,
+            author_slack_user_id=author_slack_user_id,
+            receiver_slack_user_id=receiver_slack_user_id,
+            last_n=last_n,
+            load_profile=load_profile
+        )
+
+    async def read_thank_you_messages_page(self, company_uuid: str, page_size: int,
+                                           older_than: Optional[Tuple[datetime, UUID_Type]] = None,
+                                           deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                           author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                           load_profile: LoadProfile = None) \
+            -> Tuple[List[ThankYouMessage], Optional[Tuple[datetime, UUID_Type]]]:
+        return await self._call(
+            "read_thank_you_messages_page",
+            company_uuid=company_uuid,
+            page_size=page_size,
+            older_than=older_than,
+            deleted=deleted,
+            private=private,
+            author_slack_user_id=author_slack_user_id,
+            receiver_slack_user_id=receiver_slack_user_id,
+            load_profile=load_profile
+        )
+
+    async def read_thank_you_messages_num(self, company_uuid: str, created_after: datetime = None,
+                                          created_before: datetime = None, with_types: List[str] = None,
+                                          deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                          author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                          last_n: int = None) -> int:
+        return await self._call(
+            "read_thank_you_messages_num",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            with_types=with_types,
+            deleted=deleted,
+            private=private,
+            author_slack_user_id=author_slack_user_id,
+            receiver_slack_user_id=receiver_slack_user_id,
+            last_n=last_n
+        )
+
+    async def update_thank_you_message(self, thank_you_message: ThankYouMessage,
+                                       edited_thank_you_message: ThankYouMessage):
+        def update(session: Session):
+            # A message read outside of this transaction is detached, its current state is loaded into the session
+            attached = thank_you_message if thank_you_message in session else session.merge(thank_you_message)
+            self._dao.update_thank_you_message(attached, edited_thank_you_message)
+
+        await self._run(update)
+
+    async def delete_thank_you_message(self, thank_you_message_uuid: str):
+        await self._call("delete_thank_you_message", thank_you_message_uuid)
+
+    async def create_thank_you_message_slack_deliveries(self, slack_deliveries: List[ThankYouMessageSlackDelivery]):
+        await self._call("create_thank_you_message_slack_deliveries", slack_deliveries)
+
+    async def create_slack_delivery_outbox_items(self, items: List[SlackDeliveryOutboxItem]):
+        await self._call("create_slack_delivery_outbox_items", items)
+
+    async def claim_slack_delivery_outbox_items(self, limit: int, lease_seconds: float) \
+            -> List[SlackDeliveryOutboxItem]:
+        return await self._call("claim_slack_delivery_outbox_items", limit=limit, lease_seconds=lease_seconds)
+
+    async def update_slack_delivery_outbox_item(self, item: SlackDeliveryOutboxItem):
+        await self._call("update_slack_delivery_outbox_item", item)
+
+    async def create_company(self, company: Company):
+        await self._call("create_company", company)
+
+    async def read_company(self, company_uuid: str) -> Optional[Company]:
+        def read(session: Session):
+            company = self._dao.read_company(company_uuid)
+            if company is not None:
+                _ = company.admins  # Detached objects can not lazy load their relationships
+            return company
+
+        return await self._run(read)
+
+    async def read_companies(self, slack_team_id: str = None, deleted: Optional[bool] = False) -> List[Company]:
+        def read(session: Session):
+            companies = self._dao.read_companies(slack_team_id=slack_team_id, deleted=deleted)
+            for company in companies:
+                _ = company.admins  # Detached objects can not lazy load their relationships
+            return companies
+
+        return await self._run(read)
+
+    async def create_company_admin(self, company_admin: CompanyAdmin):
+        await self._call("create_company_admin", company_admin)
+
+    async def delete_company_admin(self, company_uuid: str, slack_user_id: str):
+        await self._call("delete_company_admin", company_uuid=company_uuid, slack_user_id=slack_user_id)
+
+    async def create_thank_you_type(self, thank_you_type: ThankYouType):
+        await self._call("create_thank_you_type", thank_you_type)
+
+    async def read_thank_you_type(self, company_uuid: str, thank_you_type_uuid: str) -> Optional[ThankYouType]:
+        return await self._call("read_thank_you_type", company_uuid=company_uuid,
+                                thank_you_type_uuid=thank_you_type_uuid)
+
+    async def read_thank_you_types(self, company_uuid: str, name: str = None, deleted: Optional[bool] = False) \
+            -> List[ThankYouType]:
+        return await self._call("read_thank_you_types", company_uuid=company_uuid, name=name, deleted=deleted)
+
+    async def delete_thank_you_type(self, company_uuid: str, thank_you_type_uuid: str):
+        await self._call("delete_thank_you_type", company_uuid=company_uuid, thank_you_type_uuid=thank_you_type_uuid)
+
+    async def get_thank_you_sender_leaders(self, company_uuid: str, created_after: datetime = None,
+                                           created_before: datetime = None, thank_you_type: ThankYouType = None,
+                                           leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]:
+        return await self._call(
+            "get_thank_you_sender_leaders",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            thank_you_type=thank_you_type,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
+
+    async def get_thank_you_receiver_leaders(self, company_uuid: str, created_after: datetime = None,
+                                             created_before: datetime = None, thank_you_type: ThankYouType = None,
+                                             leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]:
+        return await self._call(
+            "get_thank_you_receiver_leaders",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            thank_you_type=thank_you_type,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
+
+    async def get_thank_you_sender_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                                   created_before: datetime = None, leaders_num: int = 3,
+                                                   include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]:
+        return await self._call(
+            "get_thank_you_sender_leaders_by_type",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
+
+    async def get_thank_you_receiver_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                                     created_before: datetime = None, leaders_num: int = 3,
+                                                     include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]:
+        return await self._call(
+            "get_thank_you_receiver_leaders_by_type",
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
+
+    async def create_employee(self, employee: Employee):
+        await self._call("create_employee", employee)
+
+    async def read_employee(self, company_uuid: UUID_Type, uuid: UUID_Type) -> Optional[Employee]:
+        return await self._call("read_employee", company_uuid=company_uuid, uuid=uuid)
+
+    async def read_employee_by_slack_id(self, company_uuid: UUID_Type, slack_user_id: Slack_User_ID_Type) \
+            -> Optional[Employee]:
+        return await self._call("read_employee_by_slack_id", company_uuid=company_uuid, slack_user_id=slack_user_id)
@@ -0,0 +1,188 @@
+"""Prometheus metrics of the DAO methods and a slow query log.
+
+Every statement is timed with the cursor execution events of the engines of the DAO and attributed to the DAO method
+(the outermost one, when a method calls another) and to the Slack handler it is executed for. The slow query log
+records the statement fingerprint (the statement with its literals and placeholders replaced with "?") and the shape
+of its parameters (their types, never their values, some of which are encrypted in the database).
+"""
+import hashlib
+import logging
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from timeit import default_timer as timer
+from types import FunctionType
+from typing import Optional, Generator
+
+from prometheus_client import Histogram, Counter as PrometheusCounter
+from sqlalchemy import Engine, event
+
+from thankyou.core.config import database_slow_query_ms
+
+
+logger = logging.getLogger(__name__)
+
+_INSTRUMENTED_METHOD_PREFIXES = ("create_", "read_", "update_", "delete_", "get_", "claim_", "rebuild_", "backfill_")
+
+_STATEMENTS_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+dao_method_latency_metric = Histogram(
+    name='dao_method_latency',
+    documentation='Time spent in a DAO method, including the time spent waiting for a database connection',
+    labelnames=["method"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0),
+)
+
+dao_method_statements_metric = Histogram(
+    name='dao_method_statements',
+    documentation='The number of SQL statements executed by a DAO method call',
+    labelnames=["method"],
+    buckets=_STATEMENTS_BUCKETS,
+)
+
+dao_method_rows_metric = Histogram(
+    name='dao_method_rows_returned',
+    documentation='The number of objects (rows) returned by a DAO method call',
+    labelnames=["method"],
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+
+slack_handler_statements_metric = Histogram(
+    name='slack_handler_dao_statements',
+    documentation='The number of SQL statements executed by a Slack handler invocation',
+    labelnames=["handler"],
+    buckets=_STATEMENTS_BUCKETS,
+)
+
+slow_queries_counter = PrometheusCounter(
+    name='dao_slow_queries',
+    documentation='The total number of SQL statements slower than MERCI_DATABASE_SLOW_QUERY_MS',
+    labelnames=["method"],
+)
+
+
+@dataclass
+class _StatementsCount:
+    statements: int = 0
+
+
+# The DAO method call and the Slack handler invocation the current thread (or asyncio task) is in, if any
+_dao_method: ContextVar[Optional[str]] = ContextVar("thank_you_dao_method", default=None)
+_dao_method_statements: ContextVar[Optional[_StatementsCount]] = ContextVar("thank_you_dao_method_statements",
+                                                                            default=None)
+_handler_statements: ContextVar[Optional[_StatementsCount]] = ContextVar("thank_you_slack_handler_statements",
+                                                                         default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\?|%\(\w+\)s|%s|\$\d+|:\w+")
+_PLACEHOLDERS_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_fingerprint(statement: str) -> str:
+    """The statement without its literals and parameters, the same for all the executions of a query. IN lists of
+    any length have the same fingerprint"""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDERS_LIST.sub("(?...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def parameters_shape(parameters, executemany: bool = False) -> str:
+    """The types of the statement parameters, e.g. {company_uuid: str, limit: int} or 50 x (str, int)"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        return f"{len(parameters)} x {parameters_shape(parameters[0]) if parameters else '()'}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["dao_statement_started_at"] = timer()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.pop("dao_statement_started_at", None)
+    for statements_count in (_dao_method_statements.get(), _handler_statements.get()):
+        if statements_count is not None:
+            statements_count.statements += 1
+
+    slow_query_ms = database_slow_query_ms()
+    if started_at is None or not slow_query_ms:
+        return
+    duration_ms = (timer() - started_at) * 1000
+    if duration_ms >= slow_query_ms:
+        method = _dao_method.get() or "unknown"
+        slow_queries_counter.labels(method).inc()
+        fingerprint = statement_fingerprint(statement)
+        logger.warning(f"Slow query ({duration_ms:.1f} ms) in {method}, "
+                       f"fingerprint {hashlib.sha1(fingerprint.encode()).hexdigest()[:12]}: {fingerprint} "
+                       f"parameters: {parameters_shape(parameters, executemany)}")
+
+
+def instrument_engine(engine: Engine):
+    """Counts and times the statements executed by the engine (the sync_engine of an AsyncEngine)"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _rows_returned(result) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, tuple) and result and isinstance(result[0], list):  # A page and the cursor of the next one
+        return len(result[0])
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def _instrumented(method):
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if _dao_method.get() is not None:
+            return method(*args, **kwargs)
+
+        statements_count = _StatementsCount()
+        method_token = _dao_method.set(name)
+        statements_token = _dao_method_statements.set(statements_count)
+        start = timer()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            dao_method_latency_metric.labels(name).observe(timer() - start)
+            dao_method_statements_metric.labels(name).observe(statements_count.statements)
+            _dao_method_statements.reset(statements_token)
+            _dao_method.reset(method_token)
+        dao_method_rows_metric.labels(name).observe(_rows_returned(result))
+        return result
+    return wrapper
+
+
+def instrument_dao_methods(cls):
+    """Reports the latency, the statements and the rows returned of the data methods (create_*, read_*, ...) defined
+    in the Dao class"""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, FunctionType) and name.startswith(_INSTRUMENTED_METHOD_PREFIXES):
+            setattr(cls, name, _instrumented(attr))
+    return cls
+
+
+@contextmanager
+def count_handler_statements(handler_name: str) -> Generator[None, None, None]:
+    """Reports the number of statements executed by the DAO calls made in the block for a Slack handler"""
+    statements_count = _StatementsCount()
+    token = _handler_statements.set(statements_count)
+    try:
+        yield
+    finally:
+        _handler_statements.reset(token)
+        slack_handler_statements_metric.labels(handler_name).observe(statements_count.statements)
@@ -1,10 +1,18 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime
+from enum import Enum
 
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Dict, Generator, Callable, AsyncGenerator
 
 from thankyou.core.models import Company, ThankYouMessage, ThankYouType, Slack_User_ID_Type, CompanyAdmin, Employee, \
-    UUID_Type
+    UUID_Type, ThankYouMessageSlackDelivery, SlackDeliveryOutboxItem
+
+
+class LoadProfile(Enum):
+    """Which relationships of a thank you message are loaded together with the message itself"""
+    HOME_FEED = "home_feed"  # Everything required to render a message in a list: type, receivers and images
+    FULL = "full"  # All relationships, including the company and Slack deliveries
 
 
 class Dao(ABC):
@@ -15,18 +23,53 @@ class Dao(ABC):
 
     def delete_flask_session(self, session_id: str): ...
 
+    @abstractmethod
+    @contextmanager
+    def transaction(self) -> Generator[None, None, None]:
+        """A unit of work: all the Dao calls made inside of it are committed (or rolled back on an exception) once,
+        when the outermost transaction block exits. Nested transaction blocks join the outer one"""
+
+    @abstractmethod
+    def call_after_commit(self, callback: Callable[[], None]):
+        """Calls the callback once the current transaction is committed (right away when not in a transaction).
+        It is not called if the transaction is rolled back"""
+
+    @contextmanager
+    def on_behalf_of(self, slack_user_id: Optional[Slack_User_ID_Type]) -> Generator[None, None, None]:
+        """Marks the Dao calls made inside of it as made for a Slack user. When the Dao reads from replicas, the
+        reads of a user whose transaction has just written go to the primary database, so the user sees their
+        changes"""
+        yield
+
+    @contextmanager
+    def primary_reads(self) -> Generator[None, None, None]:
+        """Makes the reads inside of it query the primary database even if the Dao has replicas, for the callers
+        which must not see a lagging copy of the data"""
+        yield
+
     @abstractmethod
     def create_thank_you_message(self, thank_you_message: ThankYouMessage): ...
 
     @abstractmethod
-    def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str) -> Optional[ThankYouMessage]: ...
+    def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str,
+                               load_profile: LoadProfile = None) -> Optional[ThankYouMessage]: ...
 
     @abstractmethod
     def read_thank_you_messages(self, company_uuid: str, created_after: datetime = None,
                                 created_before: datetime = None, with_types: List[str] = None,
                                 deleted: Optional[bool] = False, private: Optional[bool] = None,
                                 author_slack_user_id: str = None, receiver_slack_user_id: str = None,
-                                last_n: int = None) -> List[ThankYouMessage]: ...
+                                last_n: int = None, load_profile: LoadProfile = None) -> List[ThankYouMessage]: ...
+
+    @abstractmethod
+    def read_thank_you_messages_page(self, company_uuid: str, page_size: int,
+                                     older_than: Optional[Tuple[datetime, UUID_Type]] = None,
+                                     deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                     author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                     load_profile: LoadProfile = None) \
+            -> Tuple[List[ThankYouMessage], Optional[Tuple[datetime, UUID_Type]]]:
+        """Returns up to page_size newest messages created before the older_than (created_at, uuid) keyset, and
+        the keyset of the last returned message if there are more (older) messages to read, None otherwise"""
 
     @abstractmethod
     def read_thank_you_messages_num(self, company_uuid: str, created_after: datetime = None,
@@ -35,9 +78,29 @@ class Dao(ABC):
                                     author_slack_user_id: str = None, receiver_slack_user_id: str = None,
                                     last_n: int = None) -> int: ...
 
+    @abstractmethod
+    def update_thank_you_message(self, thank_you_message: ThankYouMessage,
+                                 edited_thank_you_message: ThankYouMessage): ...
+
     @abstractmethod
     def delete_thank_you_message(self, thank_you_message_uuid: str): ...
 
+    @abstractmethod
+    def create_thank_you_message_slack_deliveries(self, slack_deliveries: List[ThankYouMessageSlackDelivery]): ...
+
+    @abstractmethod
+    def create_slack_delivery_outbox_items(self, items: List[SlackDeliveryOutboxItem]):
+        """Items which are already in the outbox (the same message, kind, channel and user) are skipped"""
+
+    @abstractmethod
+    def claim_slack_delivery_outbox_items(self, limit: int, lease_seconds: float) -> List[SlackDeliveryOutboxItem]:
+        """Returns up to limit pending items which are due, counts an attempt for every one of them and postpones
+        them by lease_seconds, so they are not claimed again while they are being delivered"""
+
+    @abstractmethod
+    def update_slack_delivery_outbox_item(self, item: SlackDeliveryOutboxItem):
+        """Stores the status, attempts, next_attempt_at and last_error of an item"""
+
     @abstractmethod
     def create_company(self, company: Company): ...
 
@@ -79,6 +142,18 @@ class Dao(ABC):
                                        leaders_num: int = 3, include_private: bool = False) \
             -> List[Tuple[Slack_User_ID_Type, int]]: ...
 
+    @abstractmethod
+    def get_thank_you_sender_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                             created_before: datetime = None, leaders_num: int = 3,
+                                             include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]: ...
+
+    @abstractmethod
+    def get_thank_you_receiver_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                               created_before: datetime = None, leaders_num: int = 3,
+                                               include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]: ...
+
     def create_employee(self, employee: Employee): ...
 
     def read_employee(self, company_uuid: UUID_Type, uuid: UUID_Type) -> Optional[Employee]: ...
@@ -87,3 +162,147 @@ class Dao(ABC):
         -> Optional[Employee]: ...
 
     def on_app_error(self, error): ...
+
+
+class AsyncDao(ABC):
+    """The asyncio counterpart of Dao: the same data methods, as coroutines.
+
+    Objects are returned detached from the database session, so the relationships a caller uses must be loaded with
+    a load profile. A read and an update of the same object should be made in one transaction() block.
+
+    These Dao methods are deliberately left out:
+    - on_behalf_of() and primary_reads(): the async Dao has no replicas, all its reads query the primary database
+    - create_flask_session(), delete_flask_session() and on_app_error(): the async app does not use them
+    The async app runs the code which needs them, or which is shared with the sync app and uses the Dao (e.g.
+    the creation of a company and its initial data), with the sync Dao in the default executor (run_in_executor())
+    """
+
+    @abstractmethod
+    @asynccontextmanager
+    async def transaction(self) -> AsyncGenerator[None, None]:
+        """See Dao.transaction(). The transaction is shared by the calls made from the same asyncio task"""
+
+    @abstractmethod
+    def call_after_commit(self, callback: Callable[[], None]):
+        """See Dao.call_after_commit()"""
+
+    @abstractmethod
+    async def create_thank_you_message(self, thank_you_message: ThankYouMessage): ...
+
+    @abstractmethod
+    async def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str,
+                                     load_profile: LoadProfile = None) -> Optional[ThankYouMessage]: ...
+
+    @abstractmethod
+    async def read_thank_you_messages(self, company_uuid: str, created_after: datetime = None,
+                                      created_before: datetime = None, with_types: List[str] = None,
+                                      deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                      author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                      last_n: int = None, load_profile: LoadProfile = None) \
+            -> List[ThankYouMessage]: ...
+
+    @abstractmethod
+    async def read_thank_you_messages_page(self, company_uuid: str, page_size: int,
+                                           older_than: Optional[Tuple[datetime, UUID_Type]] = None,
+                                           deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                           author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                           load_profile: LoadProfile = None) \
+            -> Tuple[List[ThankYouMessage], Optional[Tuple[datetime, UUID_Type]]]:
+        """See Dao.read_thank_you_messages_page()"""
+
+    @abstractmethod
+    async def read_thank_you_messages_num(self, company_uuid: str, created_after: datetime = None,
+                                          created_before: datetime = None, with_types: List[str] = None,
+                                          deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                          author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                          last_n: int = None) -> int: ...
+
+    @abstractmethod
+    async def update_thank_you_message(self, thank_you_message: ThankYouMessage,
+                                       edited_thank_you_message: ThankYouMessage): ...
+
+    @abstractmethod
+    async def delete_thank_you_message(self, thank_you_message_uuid: str): ...
+
+    @abstractmethod
+    async def create_thank_you_message_slack_deliveries(self,
+                                                        slack_deliveries: List[ThankYouMessageSlackDelivery]): ...
+
+    @abstractmethod
+    async def create_slack_delivery_outbox_items(self, items: List[SlackDeliveryOutboxItem]):
+        """See Dao.create_slack_delivery_outbox_items()"""
+
+    @abstractmethod
+    async def claim_slack_delivery_outbox_items(self, limit: int, lease_seconds: float) \
+            -> List[SlackDeliveryOutboxItem]:
+        """See Dao.claim_slack_delivery_outbox_items()"""
+
+    @abstractmethod
+    async def update_slack_delivery_outbox_item(self, item: SlackDeliveryOutboxItem):
+        """See Dao.update_slack_delivery_outbox_item()"""
+
+    @abstractmethod
+    async def create_company(self, company: Company): ...
+
+    @abstractmethod
+    async def read_company(self, company_uuid: str) -> Optional[Company]: ...
+
+    @abstractmethod
+    async def read_companies(self, slack_team_id: str = None, deleted: Optional[bool] = False) \
+        -> List[Company]: ...
+
+    @abstractmethod
+    async def create_company_admin(self, company_admin: CompanyAdmin): ...
+
+    @abstractmethod
+    async def delete_company_admin(self, company_uuid: str, slack_user_id: str): ...
+
+    @abstractmethod
+    async def create_thank_you_type(self, thank_you_type: ThankYouType): ...
+
+    @abstractmethod
+    async def read_thank_you_type(self, company_uuid: str, thank_you_type_uuid: str) -> Optional[ThankYouType]: ...
+
+    @abstractmethod
+    async def read_thank_you_types(self, company_uuid: str, name: str = None, deleted: Optional[bool] = False) \
+        -> List[ThankYouType]: ...
+
+    @abstractmethod
+    async def delete_thank_you_type(self, company_uuid: str, thank_you_type_uuid: str): ...
+
+    @abstractmethod
+    async def get_thank_you_sender_leaders(self, company_uuid: str, created_after: datetime = None,
+                                           created_before: datetime = None, thank_you_type: ThankYouType = None,
+                                           leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]: ...
+
+    @abstractmethod
+    async def get_thank_you_receiver_leaders(self, company_uuid: str, created_after: datetime = None,
+                                             created_before: datetime = None, thank_you_type: ThankYouType = None,
+                                             leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]: ...
+
+    @abstractmethod
+    async def get_thank_you_sender_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                                   created_before: datetime = None, leaders_num: int = 3,
+                                                   include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]: ...
+
+    @abstractmethod
+    async def get_thank_you_receiver_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                                     created_before: datetime = None, leaders_num: int = 3,
+                                                     include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]: ...
+
+    @abstractmethod
+    async def create_employee(self, employee: Employee): ...
+
+    @abstractmethod
+    async def read_employee(self, company_uuid: UUID_Type, uuid: UUID_Type) -> Optional[Employee]: ...
+
+    @abstractmethod
+    async def read_employee_by_slack_id(self, company_uuid: UUID_Type, slack_user_id: Slack_User_ID_Type) \
+        -> Optional[Employee]: ...
+
+    async def dispose(self):
+        """Closes the connections of the pool. To be called before the event loop is closed"""
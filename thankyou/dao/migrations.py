@@ -0,0 +1,165 @@
+"""Versioned schema migrations of SQLAlchemyDao.
+
+    python -m thankyou.dao migrate
+
+The applied versions are stored in the schema_migrations table. A migration is recorded only after it finishes, so
+every migration must be safe to run again after an interruption. The ones which may take long on a big database
+don't lock the tables they change: columns are added as nullable, indexes are created with CREATE INDEX CONCURRENTLY
+on Postgres and existing rows are updated in batches, each committed separately.
+
+A new database gets all the tables, columns and indexes from the first migration (create_all), the next ones then
+find nothing to do.
+"""
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from timeit import default_timer as timer
+from typing import Callable, Generator, List, TYPE_CHECKING
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select
+from sqlalchemy.schema import CreateIndex
+
+if TYPE_CHECKING:
+    from thankyou.dao.sqlalchemy import SQLAlchemyDao
+
+
+Progress = Callable[[str], None]
+
+_metadata_obj = MetaData()
+
+_schema_migrations_table = Table(
+    "schema_migrations",
+    _metadata_obj,
+    Column("version", Integer, primary_key=True, nullable=False),
+    Column("name", String(256), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Any constant shared by all the migration runners
+_POSTGRES_ADVISORY_LOCK_ID = 7_051_301
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[["SQLAlchemyDao", Progress], None]
+
+
+def add_column(dao: "SQLAlchemyDao", table_name: str, column_name: str, progress: Progress):
+    """Adds a nullable column of the DAO schema to an existing table. It doesn't rewrite the table"""
+    column = dao.metadata.tables[table_name].columns[column_name]
+    if not column.nullable:
+        raise ValueError(f"Only nullable columns can be added online, {table_name}.{column_name} is not")
+    if column_name in {c["name"] for c in inspect(dao.engine).get_columns(table_name)}:
+        return
+    progress(f"Adding the {column_name} column to the {table_name} table")
+    with dao.engine.begin() as connection:
+        connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column_name} "
+                                   f"{column.type.compile(dialect=dao.engine.dialect)}")
+
+
+def create_index(dao: "SQLAlchemyDao", table_name: str, index_name: str, progress: Progress):
+    """Creates an index of the DAO schema. On Postgres it is created concurrently, without blocking the writes"""
+    index = next(i for i in dao.metadata.tables[table_name].indexes if i.name == index_name)
+
+    if dao.engine.dialect.name != "postgresql":
+        if index_name not in {i["name"] for i in inspect(dao.engine).get_indexes(table_name)}:
+            progress(f"Creating the {index_name} index on the {table_name} table")
+            with dao.engine.begin() as connection:
+                index.create(bind=connection)
+        return
+
+    # CREATE INDEX CONCURRENTLY can not run in a transaction
+    with dao.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        is_valid = connection.exec_driver_sql(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %(name)s",
+            {"name": index_name}
+        ).scalar()
+        if is_valid:
+            return
+        if is_valid is not None:
+            progress(f"Dropping the invalid {index_name} index left by an interrupted migration")
+            connection.exec_driver_sql(f"DROP INDEX CONCURRENTLY {index_name}")
+        progress(f"Creating the {index_name} index on the {table_name} table concurrently")
+        statement = str(CreateIndex(index).compile(dialect=dao.engine.dialect))
+        connection.exec_driver_sql(statement.replace("CREATE INDEX ", "CREATE INDEX CONCURRENTLY ", 1))
+
+
+def _create_tables(dao: "SQLAlchemyDao", progress: Progress):
+    dao.metadata.create_all(bind=dao.engine, checkfirst=True)
+
+
+def _add_thank_you_message_derived_columns(dao: "SQLAlchemyDao", progress: Progress):
+    add_column(dao, "thank_you_messages", "markdown_text", progress)
+    add_column(dao, "thank_you_messages", "has_valid_image", progress)
+
+
+def _backfill_thank_you_message_derived_fields(dao: "SQLAlchemyDao", progress: Progress):
+    dao.backfill_thank_you_message_derived_fields(batch_size=1000, progress=progress)
+
+
+def _create_query_indexes(dao: "SQLAlchemyDao", progress: Progress):
+    create_index(dao, "thank_you_messages", "ix_thank_you_messages__company__private__created_at", progress)
+    create_index(dao, "thank_you_messages", "ix_thank_you_messages__company__author__created_at", progress)
+    create_index(dao, "thank_you_receivers", "ix_thank_you_receivers__slack_user_id__message", progress)
+    create_index(dao, "thank_you_message_images", "ix_thank_you_message_images__message__ordering_key", progress)
+    create_index(dao, "thank_you_daily_counts", "ix_thank_you_daily_counts__company__role__day", progress)
+    create_index(dao, "thank_you_types", "ix_thank_you_types_company_uuid", progress)
+
+
+def _rebuild_thank_you_daily_counts(dao: "SQLAlchemyDao", progress: Progress):
+    # The rollup table of the leaderboards was created empty on the databases which had messages before it
+    dao.rebuild_thank_you_daily_counts(batch_size=1000, progress=progress)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create_tables", _create_tables),
+    Migration(2, "add_thank_you_message_derived_columns", _add_thank_you_message_derived_columns),
+    Migration(3, "backfill_thank_you_message_derived_fields", _backfill_thank_you_message_derived_fields),
+    Migration(4, "create_query_indexes", _create_query_indexes),
+    Migration(5, "rebuild_thank_you_daily_counts", _rebuild_thank_you_daily_counts),
+]
+
+
+@contextmanager
+def _migration_lock(dao: "SQLAlchemyDao") -> Generator[None, None, None]:
+    """Makes concurrent runners (e.g. several containers starting at once) apply the migrations one by one"""
+    if dao.engine.dialect.name != "postgresql":
+        yield
+        return
+    with dao.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql(f"SELECT pg_advisory_lock({_POSTGRES_ADVISORY_LOCK_ID})")
+        try:
+            yield
+        finally:
+            connection.exec_driver_sql(f"SELECT pg_advisory_unlock({_POSTGRES_ADVISORY_LOCK_ID})")
+
+
+def applied_versions(dao: "SQLAlchemyDao") -> List[int]:
+    if not inspect(dao.engine).has_table(_schema_migrations_table.name):
+        return []
+    with dao.engine.connect() as connection:
+        return list(connection.execute(
+            select(_schema_migrations_table.c.version).order_by(_schema_migrations_table.c.version)).scalars())
+
+
+def migrate(dao: "SQLAlchemyDao", progress: Progress = logging.info) -> List[Migration]:
+    """Applies the migrations which are not applied yet and returns them"""
+    applied = []
+    with _migration_lock(dao):
+        _metadata_obj.create_all(bind=dao.engine, checkfirst=True)
+        versions = set(applied_versions(dao))
+        for migration in MIGRATIONS:
+            if migration.version in versions:
+                continue
+            progress(f"Applying migration {migration.version} ({migration.name})")
+            started_at = timer()
+            migration.upgrade(dao, progress)
+            with dao.engine.begin() as connection:
+                connection.execute(_schema_migrations_table.insert().values(
+                    version=migration.version, name=migration.name, applied_at=datetime.utcnow()))
+            progress(f"Migration {migration.version} ({migration.name}) applied in {timer() - started_at:.1f}s")
+            applied.append(migration)
+    return applied
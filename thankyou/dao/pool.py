@@ -0,0 +1,74 @@
+"""A QueuePool which reports its usage to Prometheus.
+
+The checked out connections and the overflow are gauges summed over the gunicorn workers (multiprocess_mode='livesum'),
+so they can be compared with Postgres max_connections: every worker may open up to pool_size + max_overflow
+connections. The pool is labeled with its logging name (create_engine(pool_logging_name=...)).
+"""
+from timeit import default_timer as timer
+
+from prometheus_client import Gauge, Histogram, Counter as PrometheusCounter
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, ConnectionPoolEntry, PoolProxiedConnection
+
+
+pool_checked_out_connections_metric = Gauge(
+    name='database_pool_checked_out_connections',
+    documentation='The number of database connections checked out of the connection pool',
+    labelnames=["pool"],
+    multiprocess_mode='livesum',
+)
+
+pool_overflow_connections_metric = Gauge(
+    name='database_pool_overflow_connections',
+    documentation='The number of database connections opened above pool_size (up to max_overflow)',
+    labelnames=["pool"],
+    multiprocess_mode='livesum',
+)
+
+pool_checkout_wait_time_metric = Histogram(
+    name='database_pool_checkout_wait_time',
+    documentation='Time spent getting a connection from the connection pool, including opening a new one',
+    labelnames=["pool"],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0),
+)
+
+pool_checkout_timeouts_counter = PrometheusCounter(
+    name='database_pool_number_of_checkout_timeouts',
+    documentation='The total number of times no connection was available within pool_timeout',
+    labelnames=["pool"],
+)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """The checkin pool event is dispatched before the connection is returned to the pool and there is no event for
+    the time spent waiting for a free connection, so the usage is measured around the QueuePool methods instead"""
+
+    @property
+    def _metrics_label(self) -> str:
+        return self._orig_logging_name or "default"
+
+    def _report_usage(self):
+        label = self._metrics_label
+        pool_checked_out_connections_metric.labels(label).set(self.checkedout())
+        pool_overflow_connections_metric.labels(label).set(max(self.overflow(), 0))
+
+    def connect(self) -> PoolProxiedConnection:
+        started_at = timer()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_checkout_timeouts_counter.labels(self._metrics_label).inc()
+            raise
+        finally:
+            pool_checkout_wait_time_metric.labels(self._metrics_label).observe(timer() - started_at)
+            self._report_usage()
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self._report_usage()
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """InstrumentedQueuePool of the asyncio engines (create_async_engine)"""
@@ -1,6 +1,10 @@
 from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-from thankyou.core.config import get_env, Env
+from thankyou.core.config import get_env, Env, database_pool_size, database_pool_max_overflow, \
+    database_pool_timeout_seconds, database_pool_pre_ping, database_pool_use_lifo, database_statement_timeout_ms, \
+    database_application_name, database_replica_hosts
+from thankyou.dao.pool import InstrumentedQueuePool, InstrumentedAsyncAdaptedQueuePool
 from thankyou.dao.sqlalchemy import SQLAlchemyDao
 
 
@@ -8,7 +12,52 @@ class PostgresDao(SQLAlchemyDao):
     def __init__(self, host: str, database: str, user: str, password: str, port: int = 5432,
                  encryption_secret_key: str = None, echo: bool = False):
         self.conn_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+        self.async_conn_string = f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{database}"
         super().__init__(encryption_secret_key=encryption_secret_key, echo=echo)
+        # Every replica has its own pool (and pool metrics label)
+        self.set_replica_engines([
+            self._create_pooled_engine(f"postgresql://{user}:{password}@{replica_host}/{database}",
+                                       f"postgres_replica_{replica_num}")
+            for replica_num, replica_host in enumerate(database_replica_hosts())
+        ])
 
     def _create_engine(self) -> Engine:
-        return create_engine(self.conn_string, echo=self.echo, pool_recycle=3600, pool_timeout=20)
+        return self._create_pooled_engine(self.conn_string, "postgres")
+
+    def _create_pooled_engine(self, conn_string: str, pool_logging_name: str) -> Engine:
+        connect_args = {"application_name": database_application_name()}
+        statement_timeout_ms = database_statement_timeout_ms()
+        if statement_timeout_ms:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout_ms}"
+        return create_engine(
+            conn_string,
+            echo=self.echo,
+            connect_args=connect_args,
+            poolclass=InstrumentedQueuePool,
+            pool_logging_name=pool_logging_name,
+            pool_size=database_pool_size(),
+            max_overflow=database_pool_max_overflow(),
+            pool_timeout=database_pool_timeout_seconds(),
+            pool_pre_ping=database_pool_pre_ping(),
+            pool_use_lifo=database_pool_use_lifo(),
+            pool_recycle=3600,
+        )
+
+    def _create_async_engine(self) -> AsyncEngine:
+        server_settings = {"application_name": database_application_name()}
+        statement_timeout_ms = database_statement_timeout_ms()
+        if statement_timeout_ms:
+            server_settings["statement_timeout"] = str(statement_timeout_ms)
+        return create_async_engine(
+            self.async_conn_string,
+            echo=self.echo,
+            connect_args={"server_settings": server_settings},
+            poolclass=InstrumentedAsyncAdaptedQueuePool,
+            pool_logging_name="postgres_async",
+            pool_size=database_pool_size(),
+            max_overflow=database_pool_max_overflow(),
+            pool_timeout=database_pool_timeout_seconds(),
+            pool_pre_ping=database_pool_pre_ping(),
+            pool_use_lifo=database_pool_use_lifo(),
+            pool_recycle=3600,
+        )
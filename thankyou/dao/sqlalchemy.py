@@ -1,24 +1,104 @@
 import logging
+import random
 from abc import ABC, abstractmethod
+from collections import Counter
 from contextlib import contextmanager
-from datetime import datetime
-from typing import List, Optional, Generator, Tuple
-
-from sqlalchemy import Engine, MetaData, Column, Table, String, ForeignKey, Boolean, Text, DateTime, or_, desc, \
-    and_, func, Integer, Enum, false, UniqueConstraint
-from sqlalchemy.orm import registry, relationship, sessionmaker, Session, scoped_session
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import List, Optional, Generator, Tuple, Dict, Callable, Sequence, TYPE_CHECKING
+
+from sqlalchemy import event, Engine, MetaData, Column, Table, String, ForeignKey, Boolean, Text, DateTime, or_, desc, \
+    and_, func, Integer, Enum, false, UniqueConstraint, Date, inspect, Index, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import registry, relationship, sessionmaker, Session, scoped_session, joinedload, selectinload, \
+    MANYTOONE, ONETOMANY
 from sqlalchemy_utils import StringEncryptedType
 from sqlalchemy_utils.types.encrypted.encrypted_type import AesEngine
 
+from thankyou.core.config import database_migrate_on_startup, database_read_your_writes_seconds
 from thankyou.core.models import ThankYouType, Company, ThankYouMessage, ThankYouReceiver, \
     ThankYouMessageImage, Slack_User_ID_Type, CompanyAdmin, LeaderbordTimeSettings, UUID_Type, Employee, \
-    ThankYouMessageSlackDelivery
-from thankyou.dao.interface import Dao
+    ThankYouMessageSlackDelivery, SlackDeliveryOutboxItem, SlackDeliveryOutboxItemKind, SlackDeliveryOutboxItemStatus
+from thankyou.dao.instrumentation import instrument_dao_methods, instrument_engine
+from thankyou.dao.interface import Dao, LoadProfile
+from thankyou.dao.migrations import migrate
+from thankyou.utils.cache import SharedTTLCache
+from thankyou.utils.richtext import thank_you_message_markdown_text, thank_you_message_has_valid_image
+
+if TYPE_CHECKING:
+    from thankyou.dao.async_sqlalchemy import AsyncSQLAlchemyDao
 
 
 logging.basicConfig(level=logging.DEBUG)
 
+# The session of the transaction() block the current thread (or asyncio task) is in, if any
+_transaction_session: ContextVar[Optional[Session]] = ContextVar("thank_you_dao_transaction_session", default=None)
+_transaction_after_commit_callbacks: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar(
+    "thank_you_dao_transaction_after_commit_callbacks", default=None)
+# Whether the statements being executed belong to a read-only Dao method, which can query a replica
+_replica_read: ContextVar[bool] = ContextVar("thank_you_dao_replica_read", default=False)
+# Whether the reads must query the primary database (see Dao.primary_reads)
+_primary_reads: ContextVar[bool] = ContextVar("thank_you_dao_primary_reads", default=False)
+# The Slack user the Dao calls are made for (see Dao.on_behalf_of)
+_acting_slack_user_id: ContextVar[Optional[Slack_User_ID_Type]] = ContextVar("thank_you_dao_acting_slack_user_id",
+                                                                               default=None)
+
+# The Slack users whose transactions wrote to the primary database recently: their reads don't go to a replica
+_recent_writers = SharedTTLCache(name="dao_recent_writers", maxsize=1024 * 10, ttl=database_read_your_writes_seconds())
+
+
+def replica_read(method):
+    """Marks a read-only Dao method: its statements can go to a replica engine"""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        token = _replica_read.set(True)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _replica_read.reset(token)
+    return wrapper
+
+
+class _ReplicaRoutingSession(Session):
+    """Sends the statements of the read-only Dao methods to one of the replica engines of the Dao (if it has any),
+    unless the session has written in its current transaction (its reads must see the writes), the statement locks
+    rows (SELECT ... FOR UPDATE), the caller asked for primary reads or the acting Slack user has written recently.
+    Everything else goes to the primary engine, the bind of the session. The objects read from a replica are in the
+    same identity map, so the changes made to them are flushed to the primary engine"""
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        replica_engines = self.info.get("replica_engines")
+        if (replica_engines and _replica_read.get() and not _primary_reads.get() and not self._flushing
+                and not self.info.get("has_written") and getattr(clause, "_for_update_arg", None) is None):
+            slack_user_id = _acting_slack_user_id.get()
+            if slack_user_id is None or slack_user_id not in _recent_writers:
+                return random.choice(replica_engines)
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+def _mark_session_written(session: Session, *args):
+    session.info["has_written"] = True
+
+
+def _on_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _mark_session_written(orm_execute_state.session)
 
+
+def _after_commit(session: Session):
+    if session.info.pop("has_written", False):
+        slack_user_id = _acting_slack_user_id.get()
+        if slack_user_id is not None:
+            _recent_writers[slack_user_id] = True
+
+
+def _after_rollback(session: Session):
+    session.info.pop("has_written", None)
+
+
+@instrument_dao_methods
 class SQLAlchemyDao(Dao, ABC):
     _COMPANY_ADMINS_TABLE = "company_admins"
     _COMPANIES_TABLE = "companies"
@@ -28,11 +108,23 @@ class SQLAlchemyDao(Dao, ABC):
     _THANK_YOU_MESSAGE_IMAGES = "thank_you_message_images"
     _THANK_YOU_MESSAGE_SLACK_DELIVERIES = "thank_you_message_slack_deliveries"
     _EMPLOYEES_TABLE = "employees"
+    _THANK_YOU_DAILY_COUNTS_TABLE = "thank_you_daily_counts"
+    _SLACK_DELIVERY_OUTBOX_TABLE = "slack_delivery_outbox"
+
+    _SENDER_ROLE = "sender"
+    _RECEIVER_ROLE = "receiver"
+    _NO_THANK_YOU_TYPE = ""
+    # The first key of the Postgres advisory locks of the company rollup rows (the second one is the company hash)
+    _DAILY_COUNTS_ADVISORY_LOCK_NAMESPACE = 7_051_302
 
     @abstractmethod
     def _create_engine(self) -> Engine:
         ...
 
+    def _create_async_engine(self) -> AsyncEngine:
+        """The asyncio engine of AsyncSQLAlchemyDao, on the same database"""
+        raise NotImplementedError(f"{type(self).__name__} has no asyncio engine")
+
     def encrypted_text_column(self):
         if not self.secret_key:
             return Text
@@ -89,7 +181,8 @@ class SQLAlchemyDao(Dao, ABC):
             self._metadata_obj,
             Column("uuid", String(256), primary_key=True, nullable=False),
             Column("name", self.encrypted_string_column(256), nullable=False),
-            Column("company_uuid", String(256), ForeignKey(f"{self._COMPANIES_TABLE}.uuid"), nullable=False),
+            Column("company_uuid", String(256), ForeignKey(f"{self._COMPANIES_TABLE}.uuid"), nullable=False,
+                   index=True),
             Column("deleted", Boolean, nullable=False),
         )
 
@@ -108,7 +201,25 @@ class SQLAlchemyDao(Dao, ABC):
             Column("created_at", DateTime, nullable=False, index=True),
             Column("thank_you_type_uuid", String(256), ForeignKey(f"{self._THANK_YOU_TYPES_TABLE}.uuid"),
                    nullable=True, index=True),
+            # Derived columns, see _set_derived_fields
+            Column("markdown_text", self.encrypted_text_column(), nullable=True),
+            Column("has_valid_image", Boolean, nullable=True),
         )
+        # The pages of the home tab: messages of a company (and of an author) newest first, see
+        # _read_thank_you_messages_sqlalchemy_result. Deleted messages are never shown, so on Postgres they are
+        # left out of the indexes
+        Index("ix_thank_you_messages__company__private__created_at",
+              self._thank_you_messages_table.c.company_uuid,
+              self._thank_you_messages_table.c.is_private,
+              self._thank_you_messages_table.c.created_at,
+              self._thank_you_messages_table.c.uuid,
+              postgresql_where=self._thank_you_messages_table.c.deleted == false())
+        Index("ix_thank_you_messages__company__author__created_at",
+              self._thank_you_messages_table.c.company_uuid,
+              self._thank_you_messages_table.c.author_slack_user_id,
+              self._thank_you_messages_table.c.created_at,
+              self._thank_you_messages_table.c.uuid,
+              postgresql_where=self._thank_you_messages_table.c.deleted == false())
 
         self._thank_you_receivers_table = Table(
             self._THANK_YOU_RECEIVERS_TABLE,
@@ -116,6 +227,8 @@ class SQLAlchemyDao(Dao, ABC):
             Column("thank_you_message_uuid", String(256), ForeignKey(f"{self._THANK_YOU_MESSAGES_TABLE}.uuid"),
                    primary_key=True, nullable=False),
             Column("slack_user_id", String(256), primary_key=True, nullable=False, index=True),
+            # Messages received by a user, without reading the table
+            Index("ix_thank_you_receivers__slack_user_id__message", "slack_user_id", "thank_you_message_uuid"),
         )
 
         self._thank_you_message_images_table = Table(
@@ -127,6 +240,7 @@ class SQLAlchemyDao(Dao, ABC):
             Column("url", self.encrypted_string_column(1024), nullable=False),
             Column("filename", self.encrypted_string_column(512), nullable=False),
             Column("ordering_key", Integer, nullable=False),
+            Index("ix_thank_you_message_images__message__ordering_key", "thank_you_message_uuid", "ordering_key"),
         )
 
         self._thank_you_message_slack_deliveries_table = Table(
@@ -152,6 +266,51 @@ class SQLAlchemyDao(Dao, ABC):
             UniqueConstraint('company_uuid', 'slack_user_id', name='uix_employees__company__slack_user_id')
         )
 
+        # Leaderboard rollup: one row per company, day, user, company value, privacy and role. It is kept up to date
+        # by the methods which create, edit and delete thank you messages. thank_you_type_uuid is a part of the
+        # primary key, so messages without a company value are stored with an empty string instead of NULL
+        self._thank_you_daily_counts_table = Table(
+            self._THANK_YOU_DAILY_COUNTS_TABLE,
+            self._metadata_obj,
+            Column("company_uuid", String(256), ForeignKey(f"{self._COMPANIES_TABLE}.uuid"),
+                   primary_key=True, nullable=False),
+            Column("day", Date, primary_key=True, nullable=False),
+            Column("slack_user_id", String(256), primary_key=True, nullable=False),
+            Column("thank_you_type_uuid", String(256), primary_key=True, nullable=False),
+            Column("is_private", Boolean, primary_key=True, nullable=False),
+            Column("role", String(16), primary_key=True, nullable=False),
+            Column("messages_num", Integer, nullable=False),
+        )
+        # The leaderboards (see _daily_counts_query) filter on company, role and a range of days. On Postgres the
+        # other columns they read are included, so the leaders are counted with an index-only scan
+        Index("ix_thank_you_daily_counts__company__role__day",
+              self._thank_you_daily_counts_table.c.company_uuid,
+              self._thank_you_daily_counts_table.c.role,
+              self._thank_you_daily_counts_table.c.day,
+              postgresql_include=["is_private", "thank_you_type_uuid", "slack_user_id", "messages_num"])
+
+        # Slack deliveries which are made by the dispatcher (thankyou.slackbot.dispatcher) after the thank you
+        # message is committed. The unique constraint makes enqueuing the same delivery twice a no-op
+        self._slack_delivery_outbox_table = Table(
+            self._SLACK_DELIVERY_OUTBOX_TABLE,
+            self._metadata_obj,
+            Column("uuid", String(256), primary_key=True, nullable=False),
+            Column("thank_you_message_uuid", String(256), ForeignKey(f"{self._THANK_YOU_MESSAGES_TABLE}.uuid"),
+                   nullable=False),
+            Column("company_uuid", String(256), ForeignKey(f"{self._COMPANIES_TABLE}.uuid"), nullable=False),
+            Column("kind", Enum(SlackDeliveryOutboxItemKind), nullable=False),
+            Column("slack_channel_id", String(256), nullable=False),
+            Column("slack_user_id", String(256), nullable=False),
+            Column("status", Enum(SlackDeliveryOutboxItemStatus), nullable=False),
+            Column("attempts", Integer, nullable=False),
+            Column("next_attempt_at", DateTime, nullable=False),
+            Column("last_error", Text, nullable=True),
+            Column("created_at", DateTime, nullable=False),
+            UniqueConstraint("thank_you_message_uuid", "kind", "slack_channel_id", "slack_user_id",
+                             name="uix_slack_delivery_outbox__message__kind__channel__user"),
+            Index("ix_slack_delivery_outbox__status__next_attempt_at", "status", "next_attempt_at"),
+        )
+
         self._mapper_registry.map_imperatively(CompanyAdmin, self._company_admins_table)
 
         self._mapper_registry.map_imperatively(Company, self._companies_table, properties={
@@ -169,7 +328,8 @@ class SQLAlchemyDao(Dao, ABC):
                 "company": relationship(Company),
                 "type": relationship(ThankYouType),
                 "receivers": relationship(ThankYouReceiver),
-                "images": relationship(ThankYouMessageImage),
+                "images": relationship(ThankYouMessageImage,
+                                       order_by=self._thank_you_message_images_table.c.ordering_key),
                 "slack_deliveries": relationship(ThankYouMessageSlackDelivery)
             }
         )
@@ -179,14 +339,24 @@ class SQLAlchemyDao(Dao, ABC):
         self._mapper_registry.map_imperatively(ThankYouMessageSlackDelivery,
                                                self._thank_you_message_slack_deliveries_table)
         self._mapper_registry.map_imperatively(Employee, self._employees_table)
+        self._mapper_registry.map_imperatively(SlackDeliveryOutboxItem, self._slack_delivery_outbox_table)
 
         self._engine = self._create_engine()
-        try:
-            self._metadata_obj.create_all(bind=self._engine, checkfirst=True)
-        except Exception as e:
-            logging.error(f"Can not create database objects (tables / keys): {e}")
-        self._session_maker = sessionmaker(bind=self._engine)
-        self._session = self._session_maker()
+        instrument_engine(self._engine)
+        self._replica_engines: List[Engine] = []
+        self._session_maker = sessionmaker(bind=self._engine, class_=_ReplicaRoutingSession,
+                                           info={"replica_engines": self._replica_engines})
+        event.listen(self._session_maker, "after_flush", _mark_session_written)
+        event.listen(self._session_maker, "do_orm_execute", _on_orm_execute)
+        event.listen(self._session_maker, "after_commit", _after_commit)
+        event.listen(self._session_maker, "after_rollback", _after_rollback)
+        # Outside of a Flask request every thread (listeners, Slack deliveries) gets its own session and connection
+        self._thread_session = scoped_session(self._session_maker)
+        if database_migrate_on_startup():
+            try:
+                migrate(self)
+            except Exception as e:
+                logging.error(f"Can not migrate the database schema: {e}")
 
     @property
     def session_maker(self):
@@ -195,29 +365,118 @@ class SQLAlchemyDao(Dao, ABC):
     def set_scoped_session(self, s_session: scoped_session):
         self._scoped_session = s_session
 
-    @contextmanager
-    def _get_session(self) -> Generator[Session, None, None]:
-        """
-        with self._session_maker() as session:
-            yield session
-            session.commit()
-        """
+    def _current_session(self) -> Session:
         if self._scoped_session:
             try:
                 session: Session = self._scoped_session()
                 logging.debug(f"Successfully created/retrieved a session: {session}")
+                return session
             except Exception as e:
                 logging.debug(f"Can not create session using _flask_scoped_session: {e}")
-                session = self._session
+        return self._thread_session()
+
+    @contextmanager
+    def transaction(self) -> Generator[None, None, None]:
+        if _transaction_session.get() is not None:
+            yield
+            return
+
+        session = self._current_session()
+        after_commit_callbacks = []
+        token = _transaction_session.set(session)
+        callbacks_token = _transaction_after_commit_callbacks.set(after_commit_callbacks)
+        try:
+            yield
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            _transaction_after_commit_callbacks.reset(callbacks_token)
+            _transaction_session.reset(token)
+
+        for callback in after_commit_callbacks:
+            callback()
+
+    @contextmanager
+    def on_behalf_of(self, slack_user_id: Optional[Slack_User_ID_Type]) -> Generator[None, None, None]:
+        token = _acting_slack_user_id.set(slack_user_id)
+        try:
+            yield
+        finally:
+            _acting_slack_user_id.reset(token)
+
+    @contextmanager
+    def primary_reads(self) -> Generator[None, None, None]:
+        token = _primary_reads.set(True)
+        try:
+            yield
+        finally:
+            _primary_reads.reset(token)
+
+    def set_replica_engines(self, engines: Sequence[Engine]):
+        """Makes the read-only methods query the engines (a random one for every statement). The engines must
+        have the schema of the primary engine. An empty list sends everything to the primary engine"""
+        if engines and not _recent_writers.backend.is_shared:
+            # Another gunicorn worker would not know that the user has just written and would read from a replica
+            raise ValueError("Read replicas require a cache backend shared by all the processes (MERCI_CACHE_BACKEND="
+                             "SQLITE) for the read-your-writes window")
+        for engine in engines:
+            instrument_engine(engine)
+        self._replica_engines[:] = engines
+
+    @property
+    def replica_engines(self) -> List[Engine]:
+        return list(self._replica_engines)
+
+    def call_after_commit(self, callback: Callable[[], None]):
+        after_commit_callbacks = _transaction_after_commit_callbacks.get()
+        if after_commit_callbacks is None:
+            callback()
         else:
-            session = self._session
-        yield session
-        session.commit()
+            after_commit_callbacks.append(callback)
+
+    @contextmanager
+    def _get_session(self, read_only: bool = False) -> Generator[Session, None, None]:
+        """
+        with self._session_maker() as session:
+            yield session
+            session.commit()
+
+        A read_only session commits pending changes before the query instead of after it, so the objects it
+        returns (and their eagerly loaded relationships) are not expired by the commit and can be rendered
+        without extra SELECTs. Inside a transaction() block nothing is committed here at all: the session of the
+        transaction is reused and committed once, when the block exits.
+        """
+        session = _transaction_session.get()
+        if session is not None:
+            yield session
+            return
+
+        session = self._current_session()
+        if read_only:
+            session.commit()
+            yield session
+        else:
+            yield session
+            session.commit()
 
     @property
     def engine(self) -> Engine:
         return self._engine
 
+    @property
+    def metadata(self) -> MetaData:
+        return self._metadata_obj
+
+    def create_async_dao(self) -> "AsyncSQLAlchemyDao":
+        """An asyncio DAO sharing the tables and the queries of this one. The engine it creates is bound to the event
+        loop it is first used in"""
+        from thankyou.dao.async_sqlalchemy import AsyncSQLAlchemyDao
+        async_engine = self._create_async_engine()
+        instrument_engine(async_engine.sync_engine)
+        return AsyncSQLAlchemyDao(self, async_engine)
+
     def _get_obj(self, cls, uuid):
         with self._get_session() as session:
             return session.get(cls, uuid)
@@ -226,28 +485,173 @@ class SQLAlchemyDao(Dao, ABC):
         with self._get_session() as session:
             session.merge(obj, load=True)
 
+    def _add_new_objs(self, session: Session, objs: Sequence):
+        """
+        Inserts freshly constructed objects together with their one-to-many children (receivers, images, ...).
+
+        Unlike session.merge(obj, load=True) it doesn't SELECT the primary keys of the objects and of every child
+        first, so the flush is a single INSERT per table. Referenced many-to-one objects (company, type) which are
+        not in the session yet are merged, which is free when they are already in the identity map. The inserted
+        objects are expunged after the flush, so they keep their state after the commit and can still be rendered
+        by the caller without refresh SELECTs.
+        """
+        for obj in objs:
+            for relationship_ in inspect(obj).mapper.relationships:
+                if relationship_.direction is MANYTOONE:
+                    related_obj = getattr(obj, relationship_.key)
+                    if related_obj is not None and related_obj not in session:
+                        setattr(obj, relationship_.key, session.merge(related_obj))
+
+        session.add_all(objs)
+        session.flush()
+
+        for obj in objs:
+            session.expunge(obj)
+            for relationship_ in inspect(obj).mapper.relationships:
+                if relationship_.direction is ONETOMANY:
+                    for child in getattr(obj, relationship_.key):
+                        if child in session:
+                            session.expunge(child)
+
+    def _insert_obj(self, obj):
+        with self._get_session() as session:
+            self._add_new_objs(session, [obj])
+
+    def _thank_you_daily_counts_rows(self, thank_you_message: ThankYouMessage, delta: int) -> List[dict]:
+        common = {
+            "company_uuid": thank_you_message.company.uuid,
+            "day": thank_you_message.created_at.date(),
+            "thank_you_type_uuid": thank_you_message.type.uuid if thank_you_message.type else self._NO_THANK_YOU_TYPE,
+            "is_private": bool(thank_you_message.is_private),
+            "messages_num": delta,
+        }
+        rows = []
+        if thank_you_message.author_slack_user_id:
+            rows.append({**common, "slack_user_id": thank_you_message.author_slack_user_id,
+                         "role": self._SENDER_ROLE})
+        for slack_user_id in sorted(set(r.slack_user_id for r in thank_you_message.receivers)):
+            rows.append({**common, "slack_user_id": slack_user_id, "role": self._RECEIVER_ROLE})
+        return rows
+
+    def _lock_thank_you_daily_counts(self, session: Session, company_uuid: str, exclusive: bool = False):
+        """Takes the transaction-level lock of the company rollup rows on Postgres: the rollup writers share it, the
+        rebuild takes it exclusively, so the messages written during a rebuild are counted once. On SQLite the
+        rebuild deletes the rollup rows first instead, which holds the database write lock until it commits"""
+        if session.get_bind().dialect.name == "postgresql":
+            function = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+            session.execute(text(f"SELECT {function}(:namespace, hashtext(:company_uuid))"),
+                            {"namespace": self._DAILY_COUNTS_ADVISORY_LOCK_NAMESPACE, "company_uuid": company_uuid})
+
+    def _insert_thank_you_daily_counts(self, session: Session, rows: List[dict]):
+        """Adds messages_num of every row to the existing rollup rows (or inserts new ones)"""
+        if not rows:
+            return
+        for company_uuid in sorted(set(row["company_uuid"] for row in rows)):
+            self._lock_thank_you_daily_counts(session, company_uuid)
+        dialect = session.get_bind().dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(self._thank_you_daily_counts_table)
+        elif dialect == "sqlite":
+            statement = sqlite.insert(self._thank_you_daily_counts_table)
+        else:
+            raise TypeError(f"Thank you daily counts can not be updated for the {dialect} dialect")
+        statement = statement.values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[c.name for c in self._thank_you_daily_counts_table.primary_key.columns],
+            set_={"messages_num": self._thank_you_daily_counts_table.c.messages_num
+                  + statement.excluded.messages_num}
+        )
+        session.execute(statement)
+
+    @staticmethod
+    def _set_derived_fields(thank_you_message: ThankYouMessage):
+        """Computes the fields the thank you message blocks are rendered from, so it's done once per write instead of
+        once per render"""
+        thank_you_message.images = sorted(thank_you_message.images, key=lambda i: i.ordering_key)
+        thank_you_message.markdown_text = thank_you_message_markdown_text(thank_you_message)
+        thank_you_message.has_valid_image = thank_you_message_has_valid_image(thank_you_message)
+
     def create_thank_you_message(self, thank_you_message: ThankYouMessage):
-        self._set_obj(thank_you_message)
+        self._set_derived_fields(thank_you_message)
+        with self._get_session() as session:
+            self._add_new_objs(session, [thank_you_message])
+            self._insert_thank_you_daily_counts(session, self._thank_you_daily_counts_rows(thank_you_message, 1))
 
-    def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str) -> Optional[ThankYouMessage]:
-        thank_you_message: ThankYouMessage = self._get_obj(ThankYouMessage, thank_you_message_uuid)
-        if thank_you_message and thank_you_message.company.uuid == company_uuid:
-            return thank_you_message
+    def update_thank_you_message(self, thank_you_message: ThankYouMessage, edited_thank_you_message: ThankYouMessage):
+        with self._get_session() as session:
+            self._insert_thank_you_daily_counts(session, self._thank_you_daily_counts_rows(thank_you_message, -1))
+
+            thank_you_message.text = edited_thank_you_message.text
+            thank_you_message.is_rich_text = edited_thank_you_message.is_rich_text
+            if thank_you_message.type != edited_thank_you_message.type:
+                thank_you_message.type = edited_thank_you_message.type
+
+            new_slack_user_ids = [r.slack_user_id for r in edited_thank_you_message.receivers]
+            receivers = []
+            for receiver in thank_you_message.receivers:
+                if receiver.slack_user_id in new_slack_user_ids:
+                    receivers.append(receiver)
+                else:
+                    session.delete(receiver)
+            for slack_user_id in new_slack_user_ids:
+                if slack_user_id not in (r.slack_user_id for r in receivers):
+                    receivers.append(ThankYouReceiver(slack_user_id=slack_user_id))
+            thank_you_message.receivers = receivers
+
+            for image in thank_you_message.images:
+                session.delete(image)
+            thank_you_message.images = list(edited_thank_you_message.images)
+            self._set_derived_fields(thank_you_message)
+
+            self._insert_thank_you_daily_counts(session, self._thank_you_daily_counts_rows(thank_you_message, 1))
+
+    @staticmethod
+    def _thank_you_message_loader_options(load_profile: Optional[LoadProfile]) -> list:
+        if load_profile is None:
+            return []
+        if load_profile == LoadProfile.HOME_FEED:
+            return [
+                joinedload(ThankYouMessage.type),
+                selectinload(ThankYouMessage.receivers),
+                selectinload(ThankYouMessage.images),
+            ]
+        if load_profile == LoadProfile.FULL:
+            return [
+                joinedload(ThankYouMessage.company).selectinload(Company.admins),
+                joinedload(ThankYouMessage.type),
+                selectinload(ThankYouMessage.receivers),
+                selectinload(ThankYouMessage.images),
+                selectinload(ThankYouMessage.slack_deliveries),
+            ]
+        raise ValueError(f"Unknown load profile: {load_profile}")
+
+    @replica_read
+    def read_thank_you_message(self, company_uuid: str, thank_you_message_uuid: str,
+                               load_profile: LoadProfile = None) -> Optional[ThankYouMessage]:
+        with self._get_session(read_only=load_profile is not None) as session:
+            thank_you_message: ThankYouMessage = session.get(
+                ThankYouMessage, thank_you_message_uuid,
+                options=self._thank_you_message_loader_options(load_profile)
+            )
+            if thank_you_message and thank_you_message.company_uuid == company_uuid:
+                return thank_you_message
 
     @classmethod
     def _read_thank_you_messages_sqlalchemy_result(cls, session: Session, company_uuid: str,
                                                    created_after: datetime = None, created_before: datetime = None,
                                                    with_types: List[str] = None, deleted: Optional[bool] = False,
                                                    private: Optional[bool] = None, author_slack_user_id: str = None,
-                                                   receiver_slack_user_id: str = None, last_n: int = None):
+                                                   receiver_slack_user_id: str = None, last_n: int = None,
+                                                   older_than: Tuple[datetime, UUID_Type] = None):
         result = session.query(ThankYouMessage).join(Company)
         if receiver_slack_user_id:
-            result = result.join(ThankYouReceiver)
+            # A subquery instead of a join, so both sides of the OR can be looked up by an index
+            received = ThankYouMessage.uuid.in_(select(ThankYouReceiver.thank_you_message_uuid).where(
+                ThankYouReceiver.slack_user_id == receiver_slack_user_id))
             if author_slack_user_id:
-                result = result.filter(or_(ThankYouReceiver.slack_user_id == receiver_slack_user_id,
-                                           ThankYouMessage.author_slack_user_id == author_slack_user_id))
+                result = result.filter(or_(received, ThankYouMessage.author_slack_user_id == author_slack_user_id))
             else:
-                result = result.filter(ThankYouReceiver.slack_user_id == receiver_slack_user_id)
+                result = result.filter(received)
         elif author_slack_user_id:
             result = result.filter(ThankYouMessage.author_slack_user_id == author_slack_user_id)
 
@@ -268,20 +672,28 @@ class SQLAlchemyDao(Dao, ABC):
         if private is not None:
             result = result.filter(ThankYouMessage.is_private == private)
 
+        if older_than:
+            older_than_created_at, older_than_uuid = older_than
+            result = result.filter(or_(
+                ThankYouMessage.created_at < older_than_created_at,
+                and_(ThankYouMessage.created_at == older_than_created_at, ThankYouMessage.uuid < older_than_uuid)
+            ))
+
         # noinspection PyTypeChecker
-        result = result.order_by(desc(ThankYouMessage.created_at))
+        result = result.order_by(desc(ThankYouMessage.created_at), desc(ThankYouMessage.uuid))
 
         if last_n is not None:
             result = result.limit(last_n)
 
         return result.distinct()
 
+    @replica_read
     def read_thank_you_messages(self, company_uuid: str, created_after: datetime = None,
                                 created_before: datetime = None, with_types: List[str] = None,
                                 deleted: Optional[bool] = False, private: Optional[bool] = None,
                                 author_slack_user_id: str = None, receiver_slack_user_id: str = None,
-                                last_n: int = None) -> List[ThankYouMessage]:
-        with self._get_session() as session:
+                                last_n: int = None, load_profile: LoadProfile = None) -> List[ThankYouMessage]:
+        with self._get_session(read_only=load_profile is not None) as session:
             result = self._read_thank_you_messages_sqlalchemy_result(
                 session=session,
                 company_uuid=company_uuid,
@@ -295,8 +707,34 @@ class SQLAlchemyDao(Dao, ABC):
                 last_n=last_n
             )
 
-            return result.all()
+            return result.options(*self._thank_you_message_loader_options(load_profile)).all()
+
+    @replica_read
+    def read_thank_you_messages_page(self, company_uuid: str, page_size: int,
+                                     older_than: Optional[Tuple[datetime, UUID_Type]] = None,
+                                     deleted: Optional[bool] = False, private: Optional[bool] = None,
+                                     author_slack_user_id: str = None, receiver_slack_user_id: str = None,
+                                     load_profile: LoadProfile = None) \
+            -> Tuple[List[ThankYouMessage], Optional[Tuple[datetime, UUID_Type]]]:
+        with self._get_session(read_only=load_profile is not None) as session:
+            result = self._read_thank_you_messages_sqlalchemy_result(
+                session=session,
+                company_uuid=company_uuid,
+                deleted=deleted,
+                private=private,
+                author_slack_user_id=author_slack_user_id,
+                receiver_slack_user_id=receiver_slack_user_id,
+                last_n=page_size + 1,
+                older_than=older_than
+            )
+
+            messages = result.options(*self._thank_you_message_loader_options(load_profile)).all()
+            if len(messages) <= page_size:
+                return messages, None
+            messages = messages[0:page_size]
+            return messages, (messages[-1].created_at, messages[-1].uuid)
 
+    @replica_read
     def read_thank_you_messages_num(self, company_uuid: str, created_after: datetime = None,
                                     created_before: datetime = None, with_types: List[str] = None,
                                     deleted: Optional[bool] = False, private: Optional[bool] = None,
@@ -320,16 +758,81 @@ class SQLAlchemyDao(Dao, ABC):
 
     def delete_thank_you_message(self, thank_you_message_uuid: str):
         with self._get_session() as session:
-            session.query(ThankYouMessage).filter(ThankYouMessage.uuid == thank_you_message_uuid).update({
-                ThankYouMessage.deleted: True
-            }, synchronize_session=False)
+            thank_you_message: ThankYouMessage = session.get(ThankYouMessage, thank_you_message_uuid)
+            if thank_you_message is None or thank_you_message.deleted:
+                return
+            self._insert_thank_you_daily_counts(session, self._thank_you_daily_counts_rows(thank_you_message, -1))
+            thank_you_message.deleted = True
 
     def create_thank_you_message_slack_delivery(self, thank_you_message_slack_delivery: ThankYouMessageSlackDelivery):
-        self._set_obj(thank_you_message_slack_delivery)
+        self._insert_obj(thank_you_message_slack_delivery)
+
+    def create_thank_you_message_slack_deliveries(self, slack_deliveries: List[ThankYouMessageSlackDelivery]):
+        if not slack_deliveries:
+            return
+        with self._get_session() as session:
+            self._add_new_objs(session, slack_deliveries)
+
+    def _insert_ignore_statement(self, session: Session, table: Table):
+        dialect = session.get_bind().dialect.name
+        if dialect == "postgresql":
+            return postgresql.insert(table).on_conflict_do_nothing()
+        elif dialect == "sqlite":
+            return sqlite.insert(table).on_conflict_do_nothing()
+        raise TypeError(f"Rows can not be inserted into {table.name} for the {dialect} dialect")
+
+    def create_slack_delivery_outbox_items(self, items: List[SlackDeliveryOutboxItem]):
+        if not items:
+            return
+        with self._get_session() as session:
+            session.execute(self._insert_ignore_statement(session, self._slack_delivery_outbox_table), [{
+                "uuid": item.uuid,
+                "thank_you_message_uuid": item.thank_you_message_uuid,
+                "company_uuid": item.company_uuid,
+                "kind": item.kind,
+                "slack_channel_id": item.slack_channel_id,
+                "slack_user_id": item.slack_user_id,
+                "status": item.status,
+                "attempts": item.attempts,
+                "next_attempt_at": item.next_attempt_at,
+                "last_error": item.last_error,
+                "created_at": item.created_at,
+            } for item in items])
+
+    def claim_slack_delivery_outbox_items(self, limit: int, lease_seconds: float) -> List[SlackDeliveryOutboxItem]:
+        """The claimed items are leased: their next_attempt_at is moved lease_seconds forward, so another
+        dispatcher takes them only if this one does not update them in time. Rows locked by a concurrent claim are
+        skipped (FOR UPDATE SKIP LOCKED) on Postgres"""
+        now = datetime.utcnow()
+        with self._get_session() as session:
+            items: List[SlackDeliveryOutboxItem] = session.query(SlackDeliveryOutboxItem).filter(
+                SlackDeliveryOutboxItem.status == SlackDeliveryOutboxItemStatus.PENDING,
+                SlackDeliveryOutboxItem.next_attempt_at <= now
+            ).order_by(
+                SlackDeliveryOutboxItem.next_attempt_at
+            ).limit(limit).with_for_update(skip_locked=True).all()
+            for item in items:
+                item.attempts += 1
+                item.next_attempt_at = now + timedelta(seconds=lease_seconds)
+            session.flush()
+            for item in items:
+                session.expunge(item)
+            return items
+
+    def update_slack_delivery_outbox_item(self, item: SlackDeliveryOutboxItem):
+        with self._get_session() as session:
+            session.query(SlackDeliveryOutboxItem).filter(SlackDeliveryOutboxItem.uuid == item.uuid).update({
+                SlackDeliveryOutboxItem.status: item.status,
+                SlackDeliveryOutboxItem.attempts: item.attempts,
+                SlackDeliveryOutboxItem.next_attempt_at: item.next_attempt_at,
+                SlackDeliveryOutboxItem.last_error: item.last_error,
+            }, synchronize_session=False)
 
     def create_company(self, company: Company):
         self._set_obj(company)
 
+    # The companies are not read from replicas: a configuration change must be visible (and cached, see
+    # get_or_create_company_by_slack_team_id) as soon as it is committed
     def read_company(self, company_uuid: str) -> Optional[Company]:
         return self._get_obj(Company, company_uuid)
 
@@ -343,8 +846,17 @@ class SQLAlchemyDao(Dao, ABC):
                 result = result.filter(Company.deleted == deleted)
             return result.all()
 
+    @staticmethod
+    def _expire_company_admins(session: Session, company_uuid: str):
+        """Makes a company loaded in the (transaction) session reload its admins on the next access"""
+        company = session.get(Company, company_uuid)
+        if company is not None:
+            session.expire(company, ["admins"])
+
     def create_company_admin(self, company_admin: CompanyAdmin):
-        self._set_obj(company_admin)
+        with self._get_session() as session:
+            self._add_new_objs(session, [company_admin])
+            self._expire_company_admins(session, company_admin.company_uuid)
 
     def delete_company_admin(self, company_uuid: str, slack_user_id: str):
         with self._get_session() as session:
@@ -352,15 +864,18 @@ class SQLAlchemyDao(Dao, ABC):
                 CompanyAdmin.company_uuid == company_uuid,
                 CompanyAdmin.slack_user_id == slack_user_id
             )).delete()
+            self._expire_company_admins(session, company_uuid)
 
     def create_thank_you_type(self, thank_you_type: ThankYouType):
         self._set_obj(thank_you_type)
 
+    @replica_read
     def read_thank_you_type(self, company_uuid: str, thank_you_type_uuid: str) -> Optional[ThankYouType]:
         thank_you_type: ThankYouType = self._get_obj(ThankYouType, thank_you_type_uuid)
         if thank_you_type and thank_you_type.company_uuid == company_uuid:
             return thank_you_type
 
+    @replica_read
     def read_thank_you_types(self, company_uuid: str, name: str = None, deleted: Optional[bool] = False) \
             -> List[ThankYouType]:
         with self._get_session() as session:
@@ -380,76 +895,249 @@ class SQLAlchemyDao(Dao, ABC):
                 ThankYouType.deleted: True
             }, synchronize_session=False)
 
-    def delete_thank_you_receiver(self, receiver: ThankYouReceiver):
-        with self._get_session() as session:
-            session.delete(receiver)
-
     def delete_thank_you_image(self, image: ThankYouMessageImage):
         with self._get_session() as session:
             session.delete(image)
 
-    def get_thank_you_sender_leaders(self, company_uuid: str, created_after: datetime = None,
-                                     created_before: datetime = None, thank_you_type: ThankYouType = None,
-                                     leaders_num: int = 3, include_private: bool = False) \
-            -> List[Tuple[Slack_User_ID_Type, int]]:
-        with self._get_session() as session:
-            result = session.query(ThankYouMessage.author_slack_user_id, func.count())
-            result = result.filter(ThankYouMessage.deleted == False)
-            result = result.join(Company).filter(Company.uuid == company_uuid)
+    def _daily_counts_query(self, session: Session, columns: list, role: str, company_uuid: str,
+                            created_after: datetime = None, created_before: datetime = None,
+                            include_private: bool = False):
+        table = self._thank_you_daily_counts_table
+        result = session.query(*columns)
+        result = result.filter(table.c.company_uuid == company_uuid)
+        result = result.filter(table.c.role == role)
+
+        if created_after:
+            result = result.filter(table.c.day >= created_after.date())
 
-            if created_after:
-                result = result.filter(ThankYouMessage.created_at > created_after)
+        if created_before:
+            result = result.filter(table.c.day <= created_before.date())
 
-            if created_before:
-                result = result.filter(ThankYouMessage.created_at <= created_before)
+        if not include_private:
+            result = result.filter(table.c.is_private == false())
 
-            if thank_you_type:
-                result = result.filter(ThankYouMessage.type == thank_you_type)
+        return result
 
-            if not include_private:
-                result = result.filter(ThankYouMessage.is_private == false())
+    def _leaders(self, role: str, company_uuid: str, created_after: datetime = None, created_before: datetime = None,
+                 thank_you_type: ThankYouType = None, leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]:
+        table = self._thank_you_daily_counts_table
+        messages_num = func.sum(table.c.messages_num)
+        with self._get_session() as session:
+            result = self._daily_counts_query(
+                session=session,
+                columns=[table.c.slack_user_id, messages_num],
+                role=role,
+                company_uuid=company_uuid,
+                created_after=created_after,
+                created_before=created_before,
+                include_private=include_private
+            )
 
-            result = result.group_by(ThankYouMessage.author_slack_user_id)
-            result = result.order_by(func.count().desc())
+            if thank_you_type:
+                result = result.filter(table.c.thank_you_type_uuid == thank_you_type.uuid)
+
+            result = result.group_by(table.c.slack_user_id)
+            result = result.having(messages_num > 0)
+            result = result.order_by(messages_num.desc(), table.c.slack_user_id)
             result = result.limit(leaders_num)
 
-            return result.all()
+            return [(slack_user_id, num) for slack_user_id, num in result]
+
+    @replica_read
+    def get_thank_you_sender_leaders(self, company_uuid: str, created_after: datetime = None,
+                                     created_before: datetime = None, thank_you_type: ThankYouType = None,
+                                     leaders_num: int = 3, include_private: bool = False) \
+            -> List[Tuple[Slack_User_ID_Type, int]]:
+        return self._leaders(
+            role=self._SENDER_ROLE,
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            thank_you_type=thank_you_type,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
 
+    @replica_read
     def get_thank_you_receiver_leaders(self, company_uuid: str, created_after: datetime = None,
                                        created_before: datetime = None, thank_you_type: ThankYouType = None,
                                        leaders_num: int = 3, include_private: bool = False) \
             -> List[Tuple[Slack_User_ID_Type, int]]:
-        with self._get_session() as session:
-            result = session.query(ThankYouReceiver.slack_user_id, func.count()).join(ThankYouMessage)
-            result = result.filter(ThankYouMessage.deleted == False)
-            result = result.join(Company).filter(Company.uuid == company_uuid)
-
-            if created_after:
-                result = result.filter(ThankYouMessage.created_at >= created_after)
-
-            if created_before:
-                result = result.filter(ThankYouMessage.created_at <= created_before)
+        return self._leaders(
+            role=self._RECEIVER_ROLE,
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            thank_you_type=thank_you_type,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
 
-            if thank_you_type:
-                result = result.filter(ThankYouMessage.type == thank_you_type)
+    def _leaders_by_type(self, role: str, company_uuid: str, created_after: datetime = None,
+                         created_before: datetime = None, leaders_num: int = 3, include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]:
+        table = self._thank_you_daily_counts_table
+        messages_num = func.sum(table.c.messages_num)
+        with self._get_session() as session:
+            result = self._daily_counts_query(
+                session=session,
+                columns=[
+                    table.c.thank_you_type_uuid,
+                    table.c.slack_user_id,
+                    messages_num.label("messages_num"),
+                    func.row_number().over(
+                        partition_by=table.c.thank_you_type_uuid,
+                        order_by=(messages_num.desc(), table.c.slack_user_id)
+                    ).label("position")
+                ],
+                role=role,
+                company_uuid=company_uuid,
+                created_after=created_after,
+                created_before=created_before,
+                include_private=include_private
+            )
+            result = result.group_by(table.c.thank_you_type_uuid, table.c.slack_user_id)
+            result = result.having(messages_num > 0)
+
+            ranked = result.subquery()
+            rows = session.query(ranked.c.thank_you_type_uuid, ranked.c.slack_user_id, ranked.c.messages_num) \
+                .filter(ranked.c.position <= leaders_num) \
+                .order_by(ranked.c.thank_you_type_uuid, ranked.c.position)
+
+            leaders: Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]] = {}
+            for thank_you_type_uuid, slack_user_id, num in rows:
+                leaders.setdefault(thank_you_type_uuid or None, []).append((slack_user_id, num))
+            return leaders
+
+    @replica_read
+    def get_thank_you_sender_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                             created_before: datetime = None, leaders_num: int = 3,
+                                             include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]:
+        return self._leaders_by_type(
+            role=self._SENDER_ROLE,
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
 
-            if not include_private:
-                result = result.filter(ThankYouMessage.is_private == false())
+    @replica_read
+    def get_thank_you_receiver_leaders_by_type(self, company_uuid: str, created_after: datetime = None,
+                                               created_before: datetime = None, leaders_num: int = 3,
+                                               include_private: bool = False) \
+            -> Dict[Optional[UUID_Type], List[Tuple[Slack_User_ID_Type, int]]]:
+        return self._leaders_by_type(
+            role=self._RECEIVER_ROLE,
+            company_uuid=company_uuid,
+            created_after=created_after,
+            created_before=created_before,
+            leaders_num=leaders_num,
+            include_private=include_private
+        )
 
-            result = result.group_by(ThankYouReceiver.slack_user_id)
-            result = result.order_by(func.count().desc())
-            result = result.limit(leaders_num)
+    def rebuild_thank_you_daily_counts(self, batch_size: int = 1000, progress: Callable[[str], None] = None):
+        """Recalculates the leaderboard rollup from the thank you messages history
 
-            return result.all()
+        Messages are read company by company using (created_at, uuid) keyset batches, so the memory footprint
+        only depends on the number of distinct rollup rows of a single company. Each company is rebuilt in one
+        transaction which blocks the rollup writers of the company on Postgres (and all the writers on SQLite).
+        """
+        with self._get_session() as session:
+            company_uuids = [uuid for uuid, in session.query(Company.uuid).order_by(Company.uuid)]
+
+        for company_position, company_uuid in enumerate(company_uuids):
+            counts = Counter()
+            messages_num = 0
+            last_key: Optional[Tuple[datetime, str]] = None
+            with self._get_session() as session:
+                self._lock_thank_you_daily_counts(session, company_uuid, exclusive=True)
+                session.execute(self._thank_you_daily_counts_table.delete().where(
+                    self._thank_you_daily_counts_table.c.company_uuid == company_uuid))
+                while True:
+                    batch = session.query(
+                        ThankYouMessage.uuid,
+                        ThankYouMessage.created_at,
+                        ThankYouMessage.author_slack_user_id,
+                        ThankYouMessage.thank_you_type_uuid,
+                        ThankYouMessage.is_private
+                    ).filter(ThankYouMessage.company_uuid == company_uuid, ThankYouMessage.deleted == false())
+                    if last_key:
+                        batch = batch.filter(or_(
+                            ThankYouMessage.created_at > last_key[0],
+                            and_(ThankYouMessage.created_at == last_key[0], ThankYouMessage.uuid > last_key[1])
+                        ))
+                    batch = batch.order_by(ThankYouMessage.created_at, ThankYouMessage.uuid).limit(batch_size).all()
+                    if not batch:
+                        break
+
+                    receivers: Dict[str, set] = {}
+                    for message_uuid, slack_user_id in session.query(
+                            ThankYouReceiver.thank_you_message_uuid, ThankYouReceiver.slack_user_id
+                    ).filter(ThankYouReceiver.thank_you_message_uuid.in_([m.uuid for m in batch])):
+                        receivers.setdefault(message_uuid, set()).add(slack_user_id)
+
+                    for uuid, created_at, author_slack_user_id, thank_you_type_uuid, is_private in batch:
+                        key = (created_at.date(), thank_you_type_uuid or self._NO_THANK_YOU_TYPE, bool(is_private))
+                        if author_slack_user_id:
+                            counts[(*key, author_slack_user_id, self._SENDER_ROLE)] += 1
+                        for slack_user_id in receivers.get(uuid, ()):
+                            counts[(*key, slack_user_id, self._RECEIVER_ROLE)] += 1
+
+                    messages_num += len(batch)
+                    last_key = (batch[-1].created_at, batch[-1].uuid)
+
+                rows = [{
+                    "company_uuid": company_uuid,
+                    "day": day,
+                    "thank_you_type_uuid": thank_you_type_uuid,
+                    "is_private": is_private,
+                    "slack_user_id": slack_user_id,
+                    "role": role,
+                    "messages_num": num,
+                } for (day, thank_you_type_uuid, is_private, slack_user_id, role), num in counts.items()]
+                for i in range(0, len(rows), batch_size):
+                    session.execute(self._thank_you_daily_counts_table.insert(), rows[i:i + batch_size])
+
+            if progress:
+                progress(f"[{company_position + 1}/{len(company_uuids)}] Company {company_uuid}: "
+                         f"{messages_num} messages, {len(counts)} rollup rows")
+
+    def backfill_thank_you_message_derived_fields(self, batch_size: int = 1000,
+                                                  progress: Callable[[str], None] = None):
+        """Computes the derived columns of the thank you messages saved before they were added. Every batch is
+        committed separately, so the backfill can be interrupted and restarted"""
+        messages_num = 0
+        last_uuid: Optional[str] = None
+        while True:
+            with self._get_session() as session:
+                batch = session.query(ThankYouMessage).filter(ThankYouMessage.has_valid_image.is_(None))
+                if last_uuid:
+                    batch = batch.filter(ThankYouMessage.uuid > last_uuid)
+                batch = batch.options(selectinload(ThankYouMessage.images)) \
+                    .order_by(ThankYouMessage.uuid).limit(batch_size).all()
+                for thank_you_message in batch:
+                    self._set_derived_fields(thank_you_message)
+                if batch:
+                    last_uuid = batch[-1].uuid
+            if not batch:
+                break
+            messages_num += len(batch)
+            if progress:
+                progress(f"{messages_num} messages updated")
 
     def create_employee(self, employee: Employee):
-        self._set_obj(employee)
+        self._insert_obj(employee)
 
+    @replica_read
     def read_employee(self, company_uuid: UUID_Type, uuid: UUID_Type) -> Optional[Employee]:
         employee: Employee = self._get_obj(Employee, uuid)
         if employee and employee.company_uuid == company_uuid:
             return employee
 
+    @replica_read
     def read_employee_by_slack_id(self, company_uuid: UUID_Type, slack_user_id: Slack_User_ID_Type) \
             -> Optional[Employee]:
         with self._get_session() as session:
@@ -1,12 +1,76 @@
 import os
 import sys
+from typing import List, Optional
 
-from sqlalchemy import Engine, create_engine, NullPool
+from sqlalchemy import Engine, create_engine, event, NullPool, QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-from thankyou.core.config import get_env, Env
+from thankyou.core.config import get_env, Env, SQLiteMode, get_sqlite_mode, sqlite_database_file, sqlite_pool_size, \
+    sqlite_mmap_size_bytes, sqlite_cache_size_kib, sqlite_busy_timeout_ms
 from thankyou.dao.sqlalchemy import SQLAlchemyDao
 
 
+def _tuned_sqlite_pragmas() -> List[str]:
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={sqlite_mmap_size_bytes()}",
+        f"PRAGMA cache_size=-{sqlite_cache_size_kib()}",
+        f"PRAGMA busy_timeout={sqlite_busy_timeout_ms()}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def _set_pragmas_on_connect(engine: Engine, pragmas: List[str]):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def create_sqlite_engine(filename: str, echo: bool = False, mode: Optional[SQLiteMode] = None) -> Engine:
+    """In the TUNED mode readers don't wait for writers (WAL journal) and don't reopen the database file on every DAO
+    call: the connections are kept in a pool and configured once, when they are opened"""
+    mode = mode or get_sqlite_mode()
+    if mode == SQLiteMode.SIMPLE:
+        return create_engine(f"sqlite:///{filename}", echo=echo, poolclass=NullPool)
+
+    pool_size = sqlite_pool_size()
+    engine = create_engine(
+        f"sqlite:///{filename}",
+        echo=echo,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        connect_args={"check_same_thread": False, "timeout": sqlite_busy_timeout_ms() / 1000},
+    )
+    _set_pragmas_on_connect(engine, _tuned_sqlite_pragmas())
+    return engine
+
+
+def create_async_sqlite_engine(filename: str, echo: bool = False, mode: Optional[SQLiteMode] = None) -> AsyncEngine:
+    """The aiosqlite counterpart of create_sqlite_engine()"""
+    mode = mode or get_sqlite_mode()
+    if mode == SQLiteMode.SIMPLE:
+        return create_async_engine(f"sqlite+aiosqlite:///{filename}", echo=echo, poolclass=NullPool)
+
+    pool_size = sqlite_pool_size()
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{filename}",
+        echo=echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        connect_args={"timeout": sqlite_busy_timeout_ms() / 1000},
+    )
+    _set_pragmas_on_connect(engine.sync_engine, _tuned_sqlite_pragmas())
+    return engine
+
+
 class SQLiteDao(SQLAlchemyDao):
     _DB_FILENAME = "thank_you.db"
     _DB_PYTEST_FILENAME = "pytest_thank_you.db"
@@ -18,9 +82,12 @@ class SQLiteDao(SQLAlchemyDao):
     @property
     def _db_file(self):
         filename = self._DB_FILENAME if "pytest" not in sys.modules else self._DB_PYTEST_FILENAME
-        return os.path.join(self._db_folder, filename)
+        return sqlite_database_file() or os.path.join(self._db_folder, filename)
 
     def _create_engine(self) -> Engine:
         if not os.path.isdir(self._db_folder):
             os.mkdir(self._db_folder)
-        return create_engine(f"sqlite:///{self._db_file}", echo=self.echo, poolclass=NullPool)
+        return create_sqlite_engine(self._db_file, echo=self.echo)
+
+    def _create_async_engine(self) -> AsyncEngine:
+        return create_async_sqlite_engine(self._db_file, echo=self.echo)
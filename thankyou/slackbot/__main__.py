@@ -1,15 +1,36 @@
+import asyncio
+
 from prometheus_client import start_http_server
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-from thankyou.core.config import slack_app_token
-from thankyou.slackbot.utils.app import app, is_socket_mode
+from thankyou.core.config import slack_app_token, get_slack_app_mode, SlackAppMode
 
 
-if __name__ == "__main__":
-    start_http_server(8010)
+def _start_sync_app():
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
+    from thankyou.slackbot.utils.app import app, is_socket_mode
 
     if is_socket_mode():
         handler = SocketModeHandler(app, slack_app_token())
         handler.start()
     else:
         app.start(port=3000)
+
+
+def _start_async_app():
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+    from thankyou.slackbot.utils.asyncapp import async_app, is_socket_mode
+
+    if is_socket_mode():
+        handler = AsyncSocketModeHandler(async_app, slack_app_token())
+        asyncio.run(handler.start_async())
+    else:
+        async_app.start(port=3000)
+
+
+if __name__ == "__main__":
+    start_http_server(8010)
+
+    if get_slack_app_mode() == SlackAppMode.ASYNC:
+        _start_async_app()
+    else:
+        _start_sync_app()
@@ -0,0 +1,99 @@
+"""Builders of Slack blocks as plain dicts, for the views which are rendered on every home tab update.
+
+The slack_sdk block objects validate themselves on every to_dict() call, which costs more than building the blocks.
+These builders return the same JSON the objects serialize to, and validate it with slack_sdk only when
+validate_slack_blocks() is enabled (it is under pytest).
+"""
+from typing import List, Optional, Union
+
+from slack_sdk.models.blocks import Block
+from slack_sdk.models.views import View
+
+from thankyou.core.config import validate_slack_blocks
+
+
+_validate = validate_slack_blocks()
+
+
+def _validated_block(block: dict) -> dict:
+    if _validate:
+        Block.parse(block).validate_json()
+    return block
+
+
+def plain_text(text: str, emoji: bool = True) -> dict:
+    return {"type": "plain_text", "text": text, "emoji": emoji}
+
+
+def mrkdwn(text: str) -> dict:
+    return {"type": "mrkdwn", "text": text}
+
+
+def option(value: str, label: str) -> dict:
+    return {"text": plain_text(label), "value": value}
+
+
+def confirm_object(title: str, text: str, confirm: str = "Yes", deny: str = "No") -> dict:
+    return {"title": plain_text(title), "text": mrkdwn(text), "confirm": plain_text(confirm), "deny": plain_text(deny)}
+
+
+def button_element(text: str, action_id: str, value: str = None, style: str = None, confirm: dict = None) -> dict:
+    result = {"type": "button", "text": plain_text(text), "action_id": action_id}
+    if value is not None:
+        result["value"] = value
+    if style:
+        result["style"] = style
+    if confirm:
+        result["confirm"] = confirm
+    return result
+
+
+def overflow_menu_element(action_id: str, options: List[dict]) -> dict:
+    return {"type": "overflow", "action_id": action_id, "options": options}
+
+
+def header_block(text: str) -> dict:
+    return _validated_block({"type": "header", "text": plain_text(text)})
+
+
+def divider_block() -> dict:
+    return {"type": "divider"}
+
+
+def section_block(text: Union[str, dict] = None, fields: List[Optional[str]] = None, accessory: dict = None) -> dict:
+    """Like SectionBlock, takes strings as markdown text and skips empty fields"""
+    result = {"type": "section"}
+    if text is not None:
+        result["text"] = mrkdwn(text) if isinstance(text, str) else text
+    if fields is not None:
+        result["fields"] = [mrkdwn(field) for field in fields if field is not None]
+    if accessory:
+        result["accessory"] = accessory
+    return _validated_block(result)
+
+
+def actions_block(elements: List[dict]) -> dict:
+    return _validated_block({"type": "actions", "elements": elements})
+
+
+def context_block(elements: List[dict]) -> dict:
+    return _validated_block({"type": "context", "elements": elements})
+
+
+def rich_text_block(elements: List[dict]) -> dict:
+    return _validated_block({"type": "rich_text", "elements": elements})
+
+
+def home_view(blocks: List[Union[Block, dict]], title: str = None, private_metadata: str = None) -> dict:
+    """A home tab view. Block objects are serialized, dicts are used as they are"""
+    result = {
+        "type": "home",
+        "blocks": [block.to_dict() if isinstance(block, Block) else block for block in blocks],
+    }
+    if title:
+        result["title"] = plain_text(title)
+    if private_metadata:
+        result["private_metadata"] = private_metadata
+    if _validate:
+        View(**result).validate_json()
+    return result
@@ -1,70 +1,66 @@
 from datetime import date
 from typing import List, Optional, Tuple
 
-from slack_sdk.models.blocks import ButtonElement, ActionsBlock, SectionBlock, HeaderBlock, DividerBlock, TextObject, \
-    ContextBlock, Block, ConfirmObject
-
 from thankyou.core.models import ThankYouMessage, ThankYouType, Slack_User_ID_Type
-from thankyou.slackbot.blocks.thank_you import thank_you_message_blocks
+from thankyou.slackbot.blocks.builders import button_element, actions_block, section_block, header_block, \
+    divider_block, context_block, mrkdwn, confirm_object
+from thankyou.slackbot.blocks.thank_you import thank_you_message_block_dicts
 
 
-def home_page_actions_block(selected: str = "my_updates") -> ActionsBlock:
+def home_page_actions_block(selected: str = "my_updates") -> dict:
     elements = [
-        ButtonElement(
+        button_element(
             text="Say Thank you!",
             style="danger",
             action_id="home_page_say_thank_you_button_clicked"
         ),
-        ButtonElement(
+        button_element(
             text="All Thank yous",
             style="primary" if selected == "company_thank_yous" else None,
             action_id="home_page_company_thank_you_button_clicked"
         ),
-        ButtonElement(
+        button_element(
             text="Your Thank yous",
             style="primary" if selected == "my_thank_yous" else None,
             action_id="home_page_my_thank_you_button_clicked"
         ),
-        ButtonElement(
+        button_element(
             text="Help",
             style="primary" if selected == "help" else None,
             action_id="home_page_help_button_clicked"
         ),
-        ButtonElement(
+        button_element(
             text="Configuration",
             style="primary" if selected == "configuration" else None,
             action_id="home_page_configuration_button_clicked"
         )
     ]
 
-    return ActionsBlock(elements=elements)
+    return actions_block(elements=elements)
 
 
-def home_page_welcome_blocks(app_name: str) -> List[Block]:
+def home_page_welcome_blocks(app_name: str) -> List[dict]:
     return [
-        HeaderBlock(text=f"Welcome to the {app_name} application"),
-        SectionBlock(
+        header_block(text=f"Welcome to the {app_name} application"),
+        section_block(
             text="Recognizing and appreciating your team is a cornerstone of a motivated workforce. "
                  f"The {app_name} Slack application provides a seamless way for you and your colleagues to express "
                  "gratitude and foster a positive workplace culture."
         ),
-        SectionBlock(
+        section_block(
             text="Have you already tried sending a thank you message? If not, click on the \"Say Thank you!\" button "
                  "and send a couple of warm words to your colleague(s)!"
         ),
-        SectionBlock(
-            text=TextObject(
-                type="mrkdwn",
-                text="In case you want your message to appear in a a specific team channel, open this channel and "
-                     "simpy send a `/thanks` or `/merci` command"
-            ),
+        section_block(
+            text="In case you want your message to appear in a a specific team channel, open this channel and "
+                 "simpy send a `/thanks` or `/merci` command"
         ),
-        ActionsBlock(
+        actions_block(
             elements=[
-                ButtonElement(
+                button_element(
                     text="Hide this message",
                     action_id="home_page_hide_welcome_message_button_clicked",
-                    confirm=ConfirmObject(
+                    confirm=confirm_object(
                         title="Are you sure?",
                         text="Are you sure you want to hide this text? "
                              "If you need help, you can check the \"Help\" tab"
@@ -75,10 +71,10 @@ def home_page_welcome_blocks(app_name: str) -> List[Block]:
     ]
 
 
-def home_page_show_leaders_button_block() -> ActionsBlock:
-    return ActionsBlock(
+def home_page_show_leaders_button_block() -> dict:
+    return actions_block(
         elements=[
-            ButtonElement(text="🥇 Show leaders!", action_id="home_page_show_leaders_button_clicked"),
+            button_element(text="🥇 Show leaders!", action_id="home_page_show_leaders_button_clicked"),
         ]
     )
 
@@ -86,7 +82,7 @@ def home_page_show_leaders_button_block() -> ActionsBlock:
 def home_page_leaders_block(sender_leaders: List[Tuple[ThankYouType, List[Tuple[Slack_User_ID_Type, int]]]],
                             receiver_leaders: List[Tuple[ThankYouType, List[Tuple[Slack_User_ID_Type, int]]]],
                             from_date: date = None, until_date: date = None) \
-        -> SectionBlock:
+        -> dict:
     sender_leaders_field = "_*Sent the most \"thank yous\"*_\n\n"
     receiver_leaders_field = "_*Received the most \"thank yous\"*_\n\n"
 
@@ -118,13 +114,13 @@ def home_page_leaders_block(sender_leaders: List[Tuple[ThankYouType, List[Tuple[
         from_until_text = f"\n\n_These statistics only count messages sent between {_format_date(from_date)} " \
                           f"and {_format_date(until_date)}_"
 
-    return SectionBlock(fields=[
+    return section_block(fields=[
         sender_leaders_field, receiver_leaders_field, from_until_text
     ])
 
 
 def home_page_hidden_messages_warn_block(app_name: str, slack_channel_with_all_messages: str = None,
-                                         hidden_messages_num: int = None) -> Optional[ContextBlock]:
+                                         hidden_messages_num: int = None) -> Optional[dict]:
     if slack_channel_with_all_messages:
         if hidden_messages_num and hidden_messages_num > 0:
             text = (f"Only the latest messages are shown below. To read all the Thank You messages, "
@@ -141,43 +137,58 @@ def home_page_hidden_messages_warn_block(app_name: str, slack_channel_with_all_m
             text = None
 
     if text:
-        return ContextBlock(
-            elements=[
-                TextObject(
-                    text=text,
-                    type="mrkdwn"
-                )
-            ]
-        )
+        return context_block(elements=[mrkdwn(text)])
+
+
+def home_page_load_older_messages_button_block(action_id: str) -> dict:
+    return actions_block(
+        elements=[
+            button_element(text="Load older", action_id=action_id),
+        ]
+    )
 
 
 def thank_you_list_blocks(thank_you_messages: List[ThankYouMessage], current_user_slack_id: str = None,
-                          accessory_action_id: str = None, blocks_num_limit: int = None) -> List[SectionBlock]:
+                          accessory_action_id: str = None, blocks_num_limit: int = None) -> List[dict]:
+    blocks, _ = thank_you_list_page_blocks(thank_you_messages, current_user_slack_id=current_user_slack_id,
+                                           accessory_action_id=accessory_action_id, blocks_num_limit=blocks_num_limit)
+    return blocks
+
+
+def thank_you_list_page_blocks(thank_you_messages: List[ThankYouMessage], current_user_slack_id: str = None,
+                               accessory_action_id: str = None, blocks_num_limit: int = None,
+                               min_messages_num: int = 0) -> Tuple[List[dict], int]:
+    """Same as thank_you_list_blocks, but also returns the number of messages which fit into blocks_num_limit.
+    The first min_messages_num messages are rendered even if they don't fit.
+    The blocks of the messages are cached dicts (see thank_you_message_block_dicts)"""
     result = []
+    rendered_messages_num = 0
     last_date: Optional[date] = None
     for thank_you_message in thank_you_messages:
         blocks_to_append = []
 
         if last_date is None or thank_you_message.created_at.date() != last_date:
             last_date = thank_you_message.created_at.date()
-            blocks_to_append.append(HeaderBlock(
+            blocks_to_append.append(header_block(
                 text=last_date.strftime("%A, %B %-d")
             ))
-            blocks_to_append.append(DividerBlock())
+            blocks_to_append.append(divider_block())
 
         blocks_to_append.extend(
-            thank_you_message_blocks(
+            thank_you_message_block_dicts(
                 thank_you_message,
                 show_say_thank_you_button=current_user_slack_id in [
                     r.slack_user_id for r in thank_you_message.receivers]
             )
         )
 
-        blocks_to_append.append(DividerBlock())
+        blocks_to_append.append(divider_block())
 
-        if blocks_num_limit is not None and len(result) + len(blocks_to_append) > blocks_num_limit:
+        if blocks_num_limit is not None and rendered_messages_num >= min_messages_num \
+                and len(result) + len(blocks_to_append) > blocks_num_limit:
             break
 
         result.extend(blocks_to_append)
+        rendered_messages_num += 1
 
-    return result
+    return result, rendered_messages_num
@@ -1,20 +1,24 @@
+import hashlib
 import json
+from threading import Lock
 from typing import List
 
-import validators
-from slack_sdk.models.blocks import SectionBlock, TextObject, ContextBlock, Option, \
-    StaticSelectElement, InputBlock, PlainTextInputElement, UserMultiSelectElement, ImageElement, \
-    RichTextInputElement, RichTextBlock, ActionsBlock, ButtonElement, ConfirmObject, OverflowMenuElement
+from cachetools import LRUCache
+from slack_sdk.models.blocks import Option, StaticSelectElement, InputBlock, PlainTextInputElement, \
+    UserMultiSelectElement, ImageElement, RichTextInputElement, ConfirmObject
 
 from thankyou.core.models import ThankYouMessage, ThankYouType, ThankYouReceiver
-from thankyou.slackbot.blocks.utils import rich_text_block_as_markdown
-from thankyou.slackbot.utils.stringhelpers import es
+from thankyou.slackbot.blocks.builders import section_block, overflow_menu_element, option, rich_text_block, \
+    button_element, actions_block, context_block, mrkdwn
+from thankyou.utils.cache import cache_hits_counter, cache_misses_counter
+from thankyou.utils.richtext import thank_you_message_markdown_text, thank_you_message_has_valid_image
+from thankyou.utils.stringhelpers import es
 
 
 def thank_you_message_blocks(
         thank_you_message: ThankYouMessage,
         show_say_thank_you_button: bool = False
-        ) -> List[SectionBlock]:
+        ) -> List[dict]:
 
     result = []
     title = ""
@@ -26,102 +30,61 @@ def thank_you_message_blocks(
 
     # text = es(thank_you_message.text)
 
+    if thank_you_message.has_valid_image is not None:
+        # Derived when the message was saved, images are loaded sorted by ordering_key
+        markdown_text = thank_you_message.markdown_text
+        has_image = thank_you_message.has_valid_image
+        images = thank_you_message.images
+    else:
+        markdown_text = thank_you_message_markdown_text(thank_you_message)
+        has_image = thank_you_message_has_valid_image(thank_you_message)
+        images = sorted(thank_you_message.images, key=lambda i: i.ordering_key)
+
     is_rich_text = thank_you_message.is_rich_text
     text = thank_you_message.text
-    if is_rich_text and thank_you_message.images:
-        markdown_text = rich_text_block_as_markdown(text)
-        if markdown_text is not None:
-            is_rich_text = False
-            text = markdown_text
-
-    has_image = False
-    image_url = None
-    image_alt_text = None
-    if thank_you_message.images:
-        _images = sorted(thank_you_message.images, key=lambda i: i.ordering_key)
-        if _images[0].url.strip() and validators.url(_images[0].url):
-            has_image = True
-            image_url = _images[0].url.strip()
-            image_alt_text = "image: " + (_images[0].filename or _images[0].url[0:32] or " ").strip()
-
-    result.append(SectionBlock(
-        text=TextObject(
-            type="mrkdwn",
-            text=title,
-            # emoji=True
-        ),
-        accessory=OverflowMenuElement(
+    if is_rich_text and images and markdown_text is not None:
+        is_rich_text = False
+        text = markdown_text
+
+    result.append(section_block(
+        text=title,
+        accessory=overflow_menu_element(
             action_id="thank_you_message_overflow_menu_clicked",
             options=[
-                Option(
-                    value=f"edit:{thank_you_message.uuid}",
-                    label="Edit...",
-                ),
-                Option(
-                    value=f"delete:{thank_you_message.uuid}",
-                    label="Delete...",
-                ),
-                Option(
-                    value=f"thank_back:{thank_you_message.uuid}",
-                    label="Thank back...",
-                ),
+                option(value=f"edit:{thank_you_message.uuid}", label="Edit..."),
+                option(value=f"delete:{thank_you_message.uuid}", label="Delete..."),
+                option(value=f"thank_back:{thank_you_message.uuid}", label="Thank back..."),
             ]
         )
     ))
 
     if is_rich_text:
-        result.append(RichTextBlock(
+        result.append(rich_text_block(
             elements=json.loads(thank_you_message.text)["elements"]
         ))
-        if thank_you_message.images:
-            images = sorted(thank_you_message.images, key=lambda i: i.ordering_key)
+        if images:
             if has_image:
-                result.append(SectionBlock(
-                    text=TextObject(
-                        type="mrkdwn",
-                        text="---\n" + "\n".join([f"<{image.url}|{image.filename or image.url[0:32]}>" for image in images])
-                    ),
-                    # accessory=ImageElement(
-                    #     image_url=image_url,
-                    #     alt_text=image_alt_text,
-                    #     slack_file=None
-                    # )
+                result.append(section_block(
+                    text="---\n" + "\n".join([f"<{image.url}|{image.filename or image.url[0:32]}>" for image in images])
                 ))
     else:
         if not has_image:
-            result.append(SectionBlock(
-                text=TextObject(
-                    type="mrkdwn",
-                    text=text,
-                    # emoji=True
-                )
-            ))
+            result.append(section_block(text=text))
         else:
-            images = sorted(thank_you_message.images, key=lambda i: i.ordering_key)
-
-            result.append(SectionBlock(
-                text=TextObject(
-                    type="mrkdwn",
-                    text=text + "\n---\n"
-                         + "\n".join([f"<{image.url}|{image.filename}>" for image in images])
-                ),
-                # accessory=ImageElement(
-                #     image_url=image_url,
-                #     alt_text=image_alt_text,
-                #     slack_file=None
-                # )
+            result.append(section_block(
+                text=text + "\n---\n" + "\n".join([f"<{image.url}|{image.filename}>" for image in images])
             ))
 
     buttons = []
     if show_say_thank_you_button:
-        buttons.append(ButtonElement(
+        buttons.append(button_element(
             text="Say thanks!",
             action_id="thank_you_message_say_thanks_button_clicked",
             value=thank_you_message.uuid
         ))
 
     if buttons:
-        result.append(ActionsBlock(elements=buttons))
+        result.append(actions_block(elements=buttons))
 
     published_by_text = ""
     if thank_you_message.author_slack_user_id:
@@ -132,18 +95,56 @@ def thank_you_message_blocks(
                               f"by <@{es(thank_you_message.author_slack_user_id)}>_")
 
     if published_by_text:
-        result.append(ContextBlock(
-            elements=[
-                TextObject(
-                    type="mrkdwn",
-                    text=published_by_text
-                )
-            ]
-        ))
+        result.append(context_block(elements=[mrkdwn(published_by_text)]))
 
     return result
 
 
+_thank_you_message_blocks_cache = LRUCache(maxsize=1024 * 4)
+_thank_you_message_blocks_cache_lock = Lock()
+_thank_you_message_blocks_cache_hits_counter = cache_hits_counter.labels("thank_you_message_blocks")
+_thank_you_message_blocks_cache_misses_counter = cache_misses_counter.labels("thank_you_message_blocks")
+
+
+def thank_you_message_version(thank_you_message: ThankYouMessage) -> str:
+    """A hash of everything thank_you_message_blocks renders, so an edited message never gets the blocks of its
+    previous version"""
+    return hashlib.sha1(repr((
+        thank_you_message.text,
+        thank_you_message.is_rich_text,
+        thank_you_message.is_private,
+        thank_you_message.author_slack_user_id,
+        thank_you_message.type.name if thank_you_message.type else None,
+        tuple(receiver.slack_user_id for receiver in thank_you_message.receivers),
+        tuple((image.url, image.filename, image.ordering_key) for image in thank_you_message.images),
+    )).encode()).hexdigest()
+
+
+def thank_you_message_block_dicts(thank_you_message: ThankYouMessage, show_say_thank_you_button: bool = False) \
+        -> List[dict]:
+    """thank_you_message_blocks cached per process. The result is shared between callers, so it must not be
+    modified"""
+    key = (thank_you_message.uuid, thank_you_message_version(thank_you_message), show_say_thank_you_button)
+    with _thank_you_message_blocks_cache_lock:
+        blocks = _thank_you_message_blocks_cache.get(key)
+    if blocks is not None:
+        _thank_you_message_blocks_cache_hits_counter.inc()
+        return blocks
+
+    _thank_you_message_blocks_cache_misses_counter.inc()
+    blocks = thank_you_message_blocks(thank_you_message, show_say_thank_you_button)
+    with _thank_you_message_blocks_cache_lock:
+        _thank_you_message_blocks_cache[key] = blocks
+    return blocks
+
+
+def invalidate_thank_you_message_blocks(thank_you_message_uuid: str):
+    """Drops the cached blocks of all the versions of an edited or deleted message"""
+    with _thank_you_message_blocks_cache_lock:
+        for key in [key for key in _thank_you_message_blocks_cache.keys() if key[0] == thank_you_message_uuid]:
+            _thank_you_message_blocks_cache.pop(key, None)
+
+
 def thank_you_type_block(thank_you_types: List[ThankYouType],
                          label: str = "Select a company value", select_text="Select a company value...",
                          selected_value: ThankYouType = None, block_id: str = None,
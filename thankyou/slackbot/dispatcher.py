@@ -0,0 +1,203 @@
+import logging
+import random
+import signal
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import partial
+from threading import Event
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache, cached
+from prometheus_client import start_http_server, Histogram, Counter as PrometheusCounter
+from slack_sdk import WebClient
+
+from thankyou.core.config import slack_bot_token, slack_delivery_outbox_batch_size, \
+    slack_delivery_outbox_max_attempts, slack_delivery_outbox_poll_interval_seconds
+from thankyou.core.models import SlackDeliveryOutboxItem, SlackDeliveryOutboxItemStatus, ThankYouMessage, \
+    Slack_Team_ID_Type
+from thankyou.dao import dao
+from thankyou.dao.interface import LoadProfile
+from thankyou.slackbot.utils.delivery import SlackDeliveryExecutor, SlackCallResult, slack_delivery_executor
+from thankyou.slackbot.utils.oauth import oauth_settings
+from thankyou.slackbot.utils.outbox import SlackDeliveryOutcome, deliver_slack_delivery_outbox_item, \
+    is_retryable_slack_delivery_error
+from thankyou.slackbot.utils.webclient import RateLimitedWebClient
+
+
+logger = logging.getLogger(__name__)
+
+slack_delivery_outbox_items_counter = PrometheusCounter(
+    name='slack_delivery_outbox_number_of_processed_items',
+    documentation='The total number of Slack delivery outbox items processed by the dispatcher',
+    labelnames=["kind", "result"],
+)
+
+slack_delivery_outbox_lag_metric = Histogram(
+    name='slack_delivery_outbox_lag',
+    documentation='Time between enqueuing a Slack delivery and making it',
+    labelnames=["kind"],
+)
+
+# A claimed item is given back to the other dispatchers if it is not processed within this time
+_LEASE_SECONDS = 120
+_RETRY_DELAY_BASE_SECONDS = 2
+_RETRY_DELAY_MAX_SECONDS = 300
+
+
+def lease_slack_delivery_outbox_items(items: List[SlackDeliveryOutboxItem]):
+    """Marks new items as claimed (see Dao.claim_slack_delivery_outbox_items) before they are enqueued: they are
+    delivered by their creator, the dispatchers only take them over if it does not store their outcome in time"""
+    for item in items:
+        item.attempts += 1
+        item.next_attempt_at = datetime.utcnow() + timedelta(seconds=_LEASE_SECONDS)
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Exponential backoff with jitter: ~2, 4, 8 ... seconds, capped by _RETRY_DELAY_MAX_SECONDS"""
+    delay = min(_RETRY_DELAY_MAX_SECONDS, _RETRY_DELAY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+@cached(cache=TTLCache(maxsize=1024, ttl=10 * 60))
+def web_client_for_slack_team(slack_team_id: Slack_Team_ID_Type) -> WebClient:
+    token = slack_bot_token()
+    if oauth_settings:
+        installation = oauth_settings.installation_store.find_installation(enterprise_id=None,
+                                                                          team_id=slack_team_id)
+        if installation is None or not installation.bot_token:
+            raise LookupError(f"The application is not installed to the {slack_team_id} Slack workspace")
+        token = installation.bot_token
+    return RateLimitedWebClient(token=token, team_id=slack_team_id)
+
+
+class SlackDeliveryDispatcher:
+    """Drains the Slack delivery outbox: claims batches of due items, makes their Slack calls in parallel (per
+    workspace, see SlackDeliveryExecutor) and stores the outcome of every item in its own transaction together with
+    the resulting ThankYouMessageSlackDelivery rows and follow-up items.
+
+    Failed items are retried with a backoff until max_attempts is reached. Several dispatchers can run at once.
+    """
+
+    def __init__(self, batch_size: int, max_attempts: int,
+                 web_client_factory: Callable[[Slack_Team_ID_Type], WebClient] = web_client_for_slack_team,
+                 executor: SlackDeliveryExecutor = slack_delivery_executor):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.web_client_factory = web_client_factory
+        self.executor = executor
+        self._stopped = Event()
+
+    def _deliver(self, item: SlackDeliveryOutboxItem, thank_you_message: ThankYouMessage,
+                 web_client: Optional[WebClient]) -> SlackDeliveryOutcome:
+        client = web_client or self.web_client_factory(thank_you_message.company.slack_team_id)
+        return deliver_slack_delivery_outbox_item(client, item, thank_you_message, logger)
+
+    def _store_result(self, item: SlackDeliveryOutboxItem, result: SlackCallResult[SlackDeliveryOutcome]):
+        if result.error is None:
+            with dao.transaction():
+                dao.create_thank_you_message_slack_deliveries(result.response.slack_deliveries)
+                dao.create_slack_delivery_outbox_items(result.response.follow_up_items)
+                item.status = SlackDeliveryOutboxItemStatus.DONE
+                item.last_error = None
+                dao.update_slack_delivery_outbox_item(item)
+            slack_delivery_outbox_items_counter.labels(item.kind.name, "delivered").inc()
+            slack_delivery_outbox_lag_metric.labels(item.kind.name).observe(
+                (datetime.utcnow() - item.created_at).total_seconds())
+            return
+
+        item.last_error = str(result.error)
+        if is_retryable_slack_delivery_error(result.error) and item.attempts < self.max_attempts:
+            item.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_delay_seconds(item.attempts))
+            logger.warning(f"Could not deliver {item.kind.name} of a thank you message {item.thank_you_message_uuid}"
+                           f" (attempt {item.attempts}), it will be retried at {item.next_attempt_at}: "
+                           f"{result.error}")
+            slack_delivery_outbox_items_counter.labels(item.kind.name, "retried").inc()
+        else:
+            item.status = SlackDeliveryOutboxItemStatus.FAILED
+            logger.error(f"Could not deliver {item.kind.name} of a thank you message {item.thank_you_message_uuid} "
+                         f"to channel '{item.slack_channel_id}' / user '{item.slack_user_id}' "
+                         f"(attempt {item.attempts}): {result.error}")
+            slack_delivery_outbox_items_counter.labels(item.kind.name, "failed").inc()
+        with dao.transaction():
+            dao.update_slack_delivery_outbox_item(item)
+
+    def dispatch_batch(self) -> int:
+        """Processes one batch of due items and returns its size"""
+        with dao.transaction():
+            items = dao.claim_slack_delivery_outbox_items(limit=self.batch_size, lease_seconds=_LEASE_SECONDS)
+        self._deliver_items(items, web_client=None)
+        return len(items)
+
+    def deliver_items(self, items: List[SlackDeliveryOutboxItem], web_client: WebClient):
+        """Delivers the items a Slack handler has just enqueued (leased, see lease_slack_delivery_outbox_items) with
+        its client, and then their follow-up items. Must be called after the items are committed"""
+        while items:
+            items = self._deliver_items(items, web_client=web_client)
+
+    def _deliver_items(self, items: List[SlackDeliveryOutboxItem], web_client: Optional[WebClient]) \
+            -> List[SlackDeliveryOutboxItem]:
+        """Makes the Slack calls of claimed items and stores their outcomes. With a web_client the follow-up items
+        are enqueued leased and returned, so that the caller delivers them as well"""
+        thank_you_messages: Dict[str, Optional[ThankYouMessage]] = {}
+        items_by_company: Dict[str, List[SlackDeliveryOutboxItem]] = defaultdict(list)
+        results: List[Tuple[SlackDeliveryOutboxItem, SlackCallResult[SlackDeliveryOutcome]]] = []
+        for item in items:
+            if item.thank_you_message_uuid not in thank_you_messages:
+                # A replica may not have the message yet, the items are enqueued with it
+                with dao.primary_reads():
+                    thank_you_messages[item.thank_you_message_uuid] = dao.read_thank_you_message(
+                        company_uuid=item.company_uuid,
+                        thank_you_message_uuid=item.thank_you_message_uuid,
+                        load_profile=LoadProfile.FULL
+                    )
+            thank_you_message = thank_you_messages[item.thank_you_message_uuid]
+            if thank_you_message is None:
+                results.append((item, SlackCallResult(error=LookupError(
+                    f"Thank you message {item.thank_you_message_uuid} is not found"))))
+            elif thank_you_message.deleted:
+                # The message was deleted before it was delivered
+                results.append((item, SlackCallResult(response=SlackDeliveryOutcome())))
+            else:
+                items_by_company[item.company_uuid].append(item)
+
+        # The results are stored after all the Slack calls are made: a commit expires the loaded messages, which
+        # the executor threads must not reload
+        for company_uuid, company_items in items_by_company.items():
+            results.extend(zip(company_items, self.executor.run(company_uuid, [
+                partial(self._deliver, item, thank_you_messages[item.thank_you_message_uuid], web_client)
+                for item in company_items
+            ])))
+        follow_up_items = []
+        for item, result in results:
+            if web_client is not None and result.error is None:
+                lease_slack_delivery_outbox_items(result.response.follow_up_items)
+                follow_up_items.extend(result.response.follow_up_items)
+            self._store_result(item, result)
+        return follow_up_items
+
+    def run_forever(self, poll_interval_seconds: float):
+        while not self._stopped.is_set():
+            try:
+                items_num = self.dispatch_batch()
+            except Exception as e:
+                logger.exception(f"Could not dispatch Slack deliveries: {e}")
+                items_num = 0
+            if items_num < self.batch_size:
+                self._stopped.wait(poll_interval_seconds)
+
+    def stop(self):
+        self._stopped.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    start_http_server(8011)
+
+    dispatcher = SlackDeliveryDispatcher(
+        batch_size=slack_delivery_outbox_batch_size(),
+        max_attempts=slack_delivery_outbox_max_attempts(),
+    )
+    for signal_ in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_, lambda *_: dispatcher.stop())
+    logger.info("Dispatching Slack deliveries ...")
+    dispatcher.run_forever(poll_interval_seconds=slack_delivery_outbox_poll_interval_seconds())
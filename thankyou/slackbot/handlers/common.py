@@ -1,15 +1,37 @@
+import asyncio
+import hashlib
+import json
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
+from functools import partial
+from typing import Dict, Optional, Tuple, List, Union, Sequence, TYPE_CHECKING
 
-from cachetools import TTLCache, cached
+from cachetools import cached
+from cachetools.keys import hashkey
+from prometheus_client import Counter as PrometheusCounter
+from slack_sdk.models.views import View
 
 from thankyou.core.models import SlackUserInfo, LeaderbordTimeSettings, ThankYouType, CompanyAdmin, Company
-from thankyou.dao import dao
+from thankyou.dao import dao, get_async_dao
+from thankyou.slackbot.utils.company import CompanySnapshot
+from thankyou.utils.cache import SharedTTLCache, async_cached, async_cache_get, async_cache_set
 from thankyou.slackbot.views.configuration import configuration_no_access_view, configuration_view
 
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
 
-_already_invited_to_a_channel = TTLCache(maxsize=1024 * 20, ttl=10 * 60)
+
+skipped_home_view_publishes_counter = PrometheusCounter(
+    name='slack_handler_number_of_skipped_home_view_publishes',
+    documentation='The total number of views_publish calls skipped because the user already had the same home tab',
+)
+
+# A fingerprint of the home tab view last published to every user. The TTL bounds the time a user can see a stale
+# home tab if it was changed by other means
+_published_home_view_fingerprints = SharedTTLCache(name="published_home_view_fingerprints", maxsize=1024 * 20,
+                                                   ttl=10 * 60)
+
+_already_invited_to_a_channel = SharedTTLCache(name="already_invited_to_a_channel", maxsize=1024 * 20, ttl=10 * 60)
 
 
 def already_invited_to_a_channel(company_id: str, channel: str, user_id: str):
@@ -24,8 +46,12 @@ def already_invited_to_a_channel(company_id: str, channel: str, user_id: str):
     return False
 
 
-@cached(cache=TTLCache(maxsize=1024 * 20, ttl=60 * 60))
-def get_user_info(client, slack_user_id: str) -> Optional[SlackUserInfo]:
+# is_admin and is_owner are the roles of the user in the workspace of the client (an Enterprise Grid user has the same
+# ID in all the workspaces of the organization), so the workspace is a part of the key. They grant access to the
+# configuration, so a demoted admin must lose it soon: the TTL is short
+@cached(cache=SharedTTLCache(name="get_user_info", maxsize=1024 * 20, ttl=60),
+        key=lambda client, slack_team_id, slack_user_id: hashkey(slack_team_id, slack_user_id))
+def get_user_info(client, slack_team_id: str, slack_user_id: str) -> Optional[SlackUserInfo]:
     user = client.users_info(user=slack_user_id)
     try:
         user_data = user.data["user"]
@@ -57,10 +83,10 @@ def get_user_info(client, slack_user_id: str) -> Optional[SlackUserInfo]:
         )
 
 
-def is_user_an_admin(client, company_admins: List[CompanyAdmin], slack_user_id: str):
+def is_user_an_admin(client, slack_team_id: str, company_admins: Sequence[CompanyAdmin], slack_user_id: str):
     result = slack_user_id in [admin.slack_user_id for admin in company_admins]
     if not result:
-        user_info = get_user_info(client, slack_user_id)
+        user_info = get_user_info(client, slack_team_id, slack_user_id)
         result = user_info and (user_info.is_admin or user_info.is_owner)
     return result
 
@@ -73,9 +99,7 @@ class SendersReceiversStats:
     receiver_leaders: List[Tuple[Optional[ThankYouType], List[Tuple[str, int]]]]
 
 
-@cached(cache=TTLCache(maxsize=1024, ttl=60))
-def get_sender_and_receiver_leaders(company_uuid: str, leaderboard_time_settings: LeaderbordTimeSettings,
-                                    group_by_company_values: bool, include_private: bool) -> SendersReceiversStats:
+def leaders_stats_time_range(leaderboard_time_settings: LeaderbordTimeSettings) -> Tuple[datetime, datetime]:
     if leaderboard_time_settings == LeaderbordTimeSettings.LAST_30_DAYS:
         leaders_stats_from_datetime = datetime.utcnow() - timedelta(days=30)
         leaders_stats_until_datetime = datetime.utcnow()
@@ -103,39 +127,25 @@ def get_sender_and_receiver_leaders(company_uuid: str, leaderboard_time_settings
         leaders_stats_until_datetime = leaders_stats_from_datetime + timedelta(days=7) - timedelta(microseconds=1)
     else:
         raise ValueError(f"Unknown leaderboard time settings: {leaderboard_time_settings}")
-    sender_leaders = []
-    receiver_leaders = []
-    if not group_by_company_values:
-        sender_leaders.append((None, dao.get_thank_you_sender_leaders(
-            company_uuid=company_uuid,
-            created_after=leaders_stats_from_datetime,
-            created_before=leaders_stats_until_datetime,
-            include_private=include_private
-        )))
-        receiver_leaders.append((None, dao.get_thank_you_receiver_leaders(
-            company_uuid=company_uuid,
-            created_after=leaders_stats_from_datetime,
-            created_before=leaders_stats_until_datetime,
-            include_private=include_private
-        )))
+    return leaders_stats_from_datetime, leaders_stats_until_datetime
+
+
+def _senders_receivers_stats(leaders_stats_from_datetime: datetime, leaders_stats_until_datetime: datetime,
+                             sender_leaders, receiver_leaders,
+                             thank_you_types: Optional[List[ThankYouType]] = None) -> SendersReceiversStats:
+    """Builds the stats from the sender and receiver leaders, which are grouped by the company value uuid if
+    the thank you types are given"""
+    if thank_you_types is None:
+        sender_leaders, receiver_leaders = [(None, sender_leaders)], [(None, receiver_leaders)]
     else:
-        for thank_you_type in dao.read_thank_you_types(company_uuid=company_uuid):
-            type_leaders = dao.get_thank_you_sender_leaders(
-                company_uuid=company_uuid,
-                thank_you_type=thank_you_type,
-                created_after=leaders_stats_from_datetime,
-                created_before=leaders_stats_until_datetime,
-                include_private=include_private
-            )
-            sender_leaders.append((thank_you_type, type_leaders))
-            type_leaders = dao.get_thank_you_receiver_leaders(
-                company_uuid=company_uuid,
-                thank_you_type=thank_you_type,
-                created_after=leaders_stats_from_datetime,
-                created_before=leaders_stats_until_datetime,
-                include_private=include_private
-            )
-            receiver_leaders.append((thank_you_type, type_leaders))
+        sender_leaders_by_type, receiver_leaders_by_type = sender_leaders, receiver_leaders
+        sender_leaders, receiver_leaders = [], []
+        for thank_you_type in thank_you_types:
+            # The stats are cached and shared between processes, so they must not hold objects bound to a session
+            thank_you_type = ThankYouType(name=thank_you_type.name, company_uuid=thank_you_type.company_uuid,
+                                          uuid=thank_you_type.uuid, deleted=thank_you_type.deleted)
+            sender_leaders.append((thank_you_type, sender_leaders_by_type.get(thank_you_type.uuid, [])))
+            receiver_leaders.append((thank_you_type, receiver_leaders_by_type.get(thank_you_type.uuid, [])))
     return SendersReceiversStats(
         leaders_stats_from_datetime=leaders_stats_from_datetime,
         leaders_stats_until_datetime=leaders_stats_until_datetime,
@@ -144,8 +154,117 @@ def get_sender_and_receiver_leaders(company_uuid: str, leaderboard_time_settings
     )
 
 
-def publish_configuration_view(client, company: Company, user_id: str):
-    is_admin = is_user_an_admin(client=client, company_admins=company.admins, slack_user_id=user_id)
+def _sender_and_receiver_leaders_key(company_uuid: str, leaderboard_time_settings: LeaderbordTimeSettings,
+                                     group_by_company_values: bool, include_private: bool):
+    return hashkey(company_uuid, leaderboard_time_settings, group_by_company_values, include_private)
+
+
+@cached(cache=SharedTTLCache(name="get_sender_and_receiver_leaders", maxsize=1024, ttl=60),
+        key=_sender_and_receiver_leaders_key)
+def get_sender_and_receiver_leaders(company_uuid: str, leaderboard_time_settings: LeaderbordTimeSettings,
+                                    group_by_company_values: bool, include_private: bool) -> SendersReceiversStats:
+    leaders_stats_from_datetime, leaders_stats_until_datetime = leaders_stats_time_range(leaderboard_time_settings)
+    period = dict(company_uuid=company_uuid, created_after=leaders_stats_from_datetime,
+                  created_before=leaders_stats_until_datetime, include_private=include_private)
+    if not group_by_company_values:
+        return _senders_receivers_stats(
+            leaders_stats_from_datetime, leaders_stats_until_datetime,
+            sender_leaders=dao.get_thank_you_sender_leaders(**period),
+            receiver_leaders=dao.get_thank_you_receiver_leaders(**period)
+        )
+    return _senders_receivers_stats(
+        leaders_stats_from_datetime, leaders_stats_until_datetime,
+        sender_leaders=dao.get_thank_you_sender_leaders_by_type(**period),
+        receiver_leaders=dao.get_thank_you_receiver_leaders_by_type(**period),
+        thank_you_types=dao.read_thank_you_types(company_uuid=company_uuid)
+    )
+
+
+@async_cached(cache=get_sender_and_receiver_leaders.cache, key=_sender_and_receiver_leaders_key)
+async def async_get_sender_and_receiver_leaders(company_uuid: str, leaderboard_time_settings: LeaderbordTimeSettings,
+                                                group_by_company_values: bool, include_private: bool) \
+        -> SendersReceiversStats:
+    """`get_sender_and_receiver_leaders` for the async app, the queries are made concurrently"""
+    leaders_stats_from_datetime, leaders_stats_until_datetime = leaders_stats_time_range(leaderboard_time_settings)
+    async_dao = get_async_dao()
+    period = dict(company_uuid=company_uuid, created_after=leaders_stats_from_datetime,
+                  created_before=leaders_stats_until_datetime, include_private=include_private)
+    if not group_by_company_values:
+        sender_leaders, receiver_leaders = await asyncio.gather(
+            async_dao.get_thank_you_sender_leaders(**period),
+            async_dao.get_thank_you_receiver_leaders(**period),
+        )
+        return _senders_receivers_stats(leaders_stats_from_datetime, leaders_stats_until_datetime,
+                                        sender_leaders, receiver_leaders)
+    sender_leaders_by_type, receiver_leaders_by_type, thank_you_types = await asyncio.gather(
+        async_dao.get_thank_you_sender_leaders_by_type(**period),
+        async_dao.get_thank_you_receiver_leaders_by_type(**period),
+        async_dao.read_thank_you_types(company_uuid=company_uuid),
+    )
+    return _senders_receivers_stats(leaders_stats_from_datetime, leaders_stats_until_datetime,
+                                    sender_leaders_by_type, receiver_leaders_by_type, thank_you_types)
+
+
+def home_view_fingerprint(view: Union[View, dict]) -> str:
+    view_dict = view.to_dict() if isinstance(view, View) else view
+    return hashlib.sha256(json.dumps(view_dict, sort_keys=True).encode()).hexdigest()
+
+
+def _home_view_fingerprint_to_publish(view: Union[View, dict], published_fingerprint: Optional[str],
+                                      force: bool) -> Optional[str]:
+    """Returns the fingerprint of the view if it has to be published, None if the user already has it"""
+    fingerprint = home_view_fingerprint(view)
+    if not force and published_fingerprint == fingerprint:
+        skipped_home_view_publishes_counter.inc()
+        return None
+    return fingerprint
+
+
+def _publish_home_view(client, slack_team_id: str, user_id: str, view: Union[View, dict], force: bool):
+    key = hashkey(slack_team_id, user_id)
+    fingerprint = _home_view_fingerprint_to_publish(view, _published_home_view_fingerprints.get(key), force)
+    if fingerprint is None:
+        return
+    client.views_publish(
+        user_id=user_id,
+        view=view
+    )
+    _published_home_view_fingerprints[key] = fingerprint
+
+
+def publish_home_view(client, slack_team_id: str, user_id: str, view: Union[View, dict], force: bool = False):
+    """Publishes the home tab view of a user unless it is the same as the one published last time. Use force if
+    the user may not have the last published view (e.g. they open the home tab for the first time). The view is
+    published once the DAO transaction of the handler is committed"""
+    dao.call_after_commit(partial(_publish_home_view, client, slack_team_id, user_id, view, force))
+
+
+async def async_publish_home_view(client: "AsyncWebClient", slack_team_id: str, user_id: str, view: Union[View, dict],
+                                  force: bool = False):
+    """`publish_home_view` for the async app"""
+    key = hashkey(slack_team_id, user_id)
+    fingerprint = _home_view_fingerprint_to_publish(
+        view, await async_cache_get(_published_home_view_fingerprints, key), force)
+    if fingerprint is None:
+        return
+    await client.views_publish(
+        user_id=user_id,
+        view=view
+    )
+    await async_cache_set(_published_home_view_fingerprints, key, fingerprint)
+
+
+def publish_configuration_view(client, company: Union[Company, CompanySnapshot], user_id: str):
+    """Publishes the configuration page once the DAO transaction of the handler is committed: checking whether
+    the user is an admin is a Slack call"""
+    if isinstance(company, Company):
+        company = CompanySnapshot.from_company(company)  # The company is expired by the commit
+    dao.call_after_commit(partial(_publish_configuration_view, client, company, user_id))
+
+
+def _publish_configuration_view(client, company: CompanySnapshot, user_id: str):
+    is_admin = is_user_an_admin(client=client, slack_team_id=company.slack_team_id, company_admins=company.admins,
+                                slack_user_id=user_id)
 
     if not is_admin:
         view = configuration_no_access_view(app_name=company.merci_app_name,
@@ -170,7 +289,4 @@ def publish_configuration_view(client, company: Company, user_id: str):
             app_name=company.merci_app_name
         )
 
-    client.views_publish(
-        user_id=user_id,
-        view=view
-    )
+    publish_home_view(client, slack_team_id=company.slack_team_id, user_id=user_id, view=view)
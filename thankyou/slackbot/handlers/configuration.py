@@ -1,7 +1,8 @@
 from thankyou.core.models import CompanyAdmin, LeaderbordTimeSettings
 from thankyou.dao import dao
 from thankyou.slackbot.handlers.common import publish_configuration_view
-from thankyou.slackbot.utils.company import get_or_create_company_by_body
+from thankyou.slackbot.utils.company import get_or_create_company_by_body, read_company_for_update_by_body, \
+    invalidate_company_cache
 from thankyou.slackbot.views.appnamedialog import app_name_dialog
 from thankyou.slackbot.views.thankyoutypedialog import thank_you_type_dialog
 
@@ -18,7 +19,7 @@ def home_page_configuration_button_clicked_action_handler(body, client, logger):
 def home_page_configuration_admin_slack_user_ids_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     selected_slack_user_ids = body["actions"][0]["selected_users"]
 
@@ -31,6 +32,8 @@ def home_page_configuration_admin_slack_user_ids_value_changed_action_handler(bo
         dao.delete_company_admin(company_uuid=company.uuid, slack_user_id=admin.slack_user_id)
     for admin in admins_to_add:
         dao.create_company_admin(admin)
+    if admins_to_remove or admins_to_add:
+        invalidate_company_cache(company.slack_team_id)
 
     company = dao.read_company(company_uuid=company.uuid)
 
@@ -54,7 +57,7 @@ def home_page_configuration_edit_app_name_button_clicked_handler(body, client, l
 def edit_merci_app_name_dialog_save_button_clicked_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_company_name: str = body["view"]["state"]["values"]["edit_merci_app_name_dialog_app_name_block"][
         "edit_merci_app_name_dialog_app_name_action"]["value"]
@@ -63,6 +66,7 @@ def edit_merci_app_name_dialog_save_button_clicked_handler(body, client, logger)
         company.custom_merci_app_name = new_company_name.strip()
     else:
         company.custom_merci_app_name = None
+    invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -74,7 +78,7 @@ def edit_merci_app_name_dialog_save_button_clicked_handler(body, client, logger)
 def home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_sharing_in_a_slack_channel = ("enable_sharing_in_a_slack_channel"
                                              in [option["value"] for option in body["actions"][0]["selected_options"]])
@@ -82,6 +86,7 @@ def home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_acti
     if company.enable_sharing_in_a_slack_channel != new_enable_sharing_in_a_slack_channel:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_sharing_in_a_slack_channel = new_enable_sharing_in_a_slack_channel
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -93,12 +98,13 @@ def home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_acti
 def home_page_configuration_notification_slack_channel_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     channel_slack_id = body["actions"][0]["selected_channel"]
     if company.share_messages_in_slack_channel != channel_slack_id:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.share_messages_in_slack_channel = channel_slack_id
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -110,7 +116,7 @@ def home_page_configuration_notification_slack_channel_value_changed_action_hand
 def home_page_configuration_enable_private_messages_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_private_messages = ("enable_private_messages"
                                    in [option["value"] for option in body["actions"][0]["selected_options"]])
@@ -118,6 +124,7 @@ def home_page_configuration_enable_private_messages_value_changed_action_handler
     if company.enable_private_messages != new_enable_private_messages:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_private_messages = new_enable_private_messages
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -129,7 +136,7 @@ def home_page_configuration_enable_private_messages_value_changed_action_handler
 def home_page_configuration_enable_leaderboard_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_leaderboard = ("enable_leaderboard"
                               in [option["value"] for option in body["actions"][0]["selected_options"]])
@@ -137,6 +144,7 @@ def home_page_configuration_enable_leaderboard_value_changed_action_handler(body
     if company.enable_leaderboard != new_enable_leaderboard:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_leaderboard = new_enable_leaderboard
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -148,7 +156,7 @@ def home_page_configuration_enable_leaderboard_value_changed_action_handler(body
 def home_page_configuration_stats_time_period_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     try:
         new_time_period = LeaderbordTimeSettings[body["actions"][0]["selected_option"]["value"]]
@@ -158,6 +166,7 @@ def home_page_configuration_stats_time_period_value_changed_action_handler(body,
     if company.leaderbord_time_settings != new_time_period:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.leaderbord_time_settings = new_time_period
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -169,7 +178,7 @@ def home_page_configuration_stats_time_period_value_changed_action_handler(body,
 def handle_home_page_configuration_enable_private_message_counting_in_leaderboard_value_changed_action_handler(client, body, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_private_message_counting_in_leaderboard = (
             "enable_private_message_counting_in_leaderboard"
@@ -179,6 +188,7 @@ def handle_home_page_configuration_enable_private_message_counting_in_leaderboar
     if company.enable_private_message_counting_in_leaderboard != new_enable_private_message_counting_in_leaderboard:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_private_message_counting_in_leaderboard = new_enable_private_message_counting_in_leaderboard
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -190,7 +200,7 @@ def handle_home_page_configuration_enable_private_message_counting_in_leaderboar
 def home_page_configuration_max_number_of_thank_you_receivers_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     try:
         new_limit = int(body["actions"][0]["selected_option"]["value"])
@@ -202,6 +212,7 @@ def home_page_configuration_max_number_of_thank_you_receivers_value_changed_acti
     if company.receivers_number_limit != new_limit:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.receivers_number_limit = new_limit
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -213,7 +224,7 @@ def home_page_configuration_max_number_of_thank_you_receivers_value_changed_acti
 def home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_weekly_thank_you_limit = "enable_weekly_thank_you_limit" \
                                         in [option["value"] for option in body["actions"][0]["selected_options"]]
@@ -221,6 +232,7 @@ def home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_h
     if company.enable_weekly_thank_you_limit != new_enable_weekly_thank_you_limit:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_weekly_thank_you_limit = new_enable_weekly_thank_you_limit
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -232,7 +244,7 @@ def home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_h
 def home_page_configuration_max_number_of_messages_per_week_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     try:
         new_limit = int(body["actions"][0]["selected_option"]["value"])
@@ -244,6 +256,7 @@ def home_page_configuration_max_number_of_messages_per_week_value_changed_action
     if company.weekly_thank_you_limit != new_limit:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.weekly_thank_you_limit = new_limit
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -255,7 +268,7 @@ def home_page_configuration_max_number_of_messages_per_week_value_changed_action
 def home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_rich_text_value = "enable_rich_text_in_thank_you_messages" \
                                  in [option["value"] for option in body["actions"][0]["selected_options"]]
@@ -263,6 +276,7 @@ def home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed
     if company.enable_rich_text_in_thank_you_messages != new_enable_rich_text_value:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_rich_text_in_thank_you_messages = new_enable_rich_text_value
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -274,7 +288,7 @@ def home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed
 def home_page_configuration_enable_attaching_files_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_attaching_files = "enable_attaching_files" \
                                  in [option["value"] for option in body["actions"][0]["selected_options"]]
@@ -282,6 +296,7 @@ def home_page_configuration_enable_attaching_files_value_changed_action_handler(
     if company.enable_attaching_files != new_enable_attaching_files:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_attaching_files = new_enable_attaching_files
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -293,7 +308,7 @@ def home_page_configuration_enable_attaching_files_value_changed_action_handler(
 def home_page_configuration_max_attached_files_num_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     try:
         new_limit = int(body["actions"][0]["selected_option"]["value"])
@@ -305,6 +320,7 @@ def home_page_configuration_max_attached_files_num_value_changed_action_handler(
     if company.max_attached_files_num != new_limit:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.max_attached_files_num = new_limit
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -316,7 +332,7 @@ def home_page_configuration_max_attached_files_num_value_changed_action_handler(
 def home_page_configuration_enable_company_values_value_changed_action_handler(body, client, logger):
     logger.info(body)
     user_id = body["user"]["id"]
-    company = get_or_create_company_by_body(body)
+    company = read_company_for_update_by_body(body)
 
     new_enable_company_values = ("enable_company_values"
                                  in [option["value"] for option in body["actions"][0]["selected_options"]])
@@ -324,6 +340,7 @@ def home_page_configuration_enable_company_values_value_changed_action_handler(b
     if company.enable_company_values != new_enable_company_values:
         # ORM_WARNING: the following statement works because we use SQL Alchemy
         company.enable_company_values = new_enable_company_values
+        invalidate_company_cache(company.slack_team_id)
 
     publish_configuration_view(
         client=client,
@@ -1,58 +1,143 @@
+import asyncio
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, List, Tuple
 
-from cachetools import cached, TTLCache
+from cachetools import cached
+from cachetools.keys import hashkey
 from slack_sdk import WebClient
+from slack_sdk.models.views import View
 
-from thankyou.dao import dao
-from thankyou.slackbot.handlers.common import get_sender_and_receiver_leaders
+from thankyou.core.models import Company, Employee, ThankYouMessage, UUID_Type
+from thankyou.dao import dao, get_async_dao
+from thankyou.dao.interface import LoadProfile
+from thankyou.slackbot.handlers.common import get_sender_and_receiver_leaders, publish_home_view, \
+    async_get_sender_and_receiver_leaders, async_publish_home_view, SendersReceiversStats
 from thankyou.slackbot.utils.company import get_or_create_company_by_event, get_or_create_company_by_slack_team_id, \
-    get_or_create_company_by_body
-from thankyou.slackbot.utils.employee import get_or_create_employee_by_slack_user_id
+    get_or_create_company_by_body, async_get_or_create_company_by_event, slack_team_id_from_body, \
+    async_get_or_create_company_by_slack_team_id, async_get_or_create_company_by_body
+from thankyou.slackbot.utils.employee import get_or_create_employee_by_slack_user_id, \
+    async_get_or_create_employee_by_slack_user_id
+from thankyou.slackbot.utils.privatemetadata import retrieve_private_metadata_from_view, \
+    thank_you_messages_cursor_from_str
 from thankyou.slackbot.views.help import home_page_help_view
 from thankyou.slackbot.views.homepage import home_page_company_thank_yous_view, home_page_my_thank_yous_view
 from thankyou.slackbot.views.thankyoudialog import thank_you_dialog_view
+from thankyou.utils.cache import SharedTTLCache, async_cached
 
 
 NUMBER_OF_MESSAGES_TO_SHOW = 20
 
+# The (created_at, uuid) keyset of the last message of a page
+_MessagesCursor = Tuple[datetime, UUID_Type]
 
-@cached(cache=TTLCache(maxsize=1024, ttl=60))
+
+def _messages_sent_num_key(company_uuid: str, interval: timedelta = timedelta(days=30),
+                           private: Optional[bool] = False):
+    return hashkey(company_uuid, interval, private)
+
+
+@cached(cache=SharedTTLCache(name="messages_sent_num", maxsize=1024, ttl=60), key=_messages_sent_num_key)
 def messages_sent_num(company_uuid: str, interval: timedelta = timedelta(days=30), private: Optional[bool] = False):
     return dao.read_thank_you_messages_num(company_uuid=company_uuid, created_after=datetime.utcnow() - interval,
                                            private=private)
 
 
-def app_home_opened_action_handler(client: WebClient, event, logger):
-    try:
-        company = get_or_create_company_by_event(event)
-    except Exception:
-        company = get_or_create_company_by_slack_team_id(client.default_params["team_id"])
+@async_cached(cache=messages_sent_num.cache, key=_messages_sent_num_key)
+async def async_messages_sent_num(company_uuid: str, interval: timedelta = timedelta(days=30),
+                                  private: Optional[bool] = False):
+    return await get_async_dao().read_thank_you_messages_num(
+        company_uuid=company_uuid, created_after=datetime.utcnow() - interval, private=private)
 
-    user_id = event["user"]
-    employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id)
 
-    messages = dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW, private=False)
+def _company_thank_yous_page_query(company_uuid: str, older_than: Optional[_MessagesCursor] = None) -> dict:
+    return dict(company_uuid=company_uuid, page_size=NUMBER_OF_MESSAGES_TO_SHOW, private=False, older_than=older_than,
+                load_profile=LoadProfile.HOME_FEED)
 
+
+def _my_thank_yous_page_query(company_uuid: str, user_id: str,
+                              older_than: Optional[_MessagesCursor] = None) -> dict:
+    return dict(company_uuid=company_uuid, page_size=NUMBER_OF_MESSAGES_TO_SHOW, author_slack_user_id=user_id,
+                receiver_slack_user_id=user_id, older_than=older_than, load_profile=LoadProfile.HOME_FEED)
+
+
+# The views of the handlers below are built by these functions from what the sync and async handlers have read
+
+
+def _company_thank_yous_view(company: Company, user_id: str, employee: Employee, messages: List[ThankYouMessage],
+                             older_messages_cursor: Optional[_MessagesCursor], sent_messages_num: int) -> View:
     slack_channel_with_all_messages = None
     if company.enable_sharing_in_a_slack_channel and company.share_messages_in_slack_channel:
         slack_channel_with_all_messages = company.share_messages_in_slack_channel
 
-    hidden_messages_num = max(0, messages_sent_num(company_uuid=company.uuid, private=False) - len(messages))
-
-    view = home_page_company_thank_yous_view(
+    return home_page_company_thank_yous_view(
         thank_you_messages=messages,
         app_name=company.merci_app_name,
         current_user_slack_id=user_id,
         enable_leaderboard=company.enable_leaderboard,
         slack_channel_with_all_messages=slack_channel_with_all_messages,
-        hidden_messages_num=hidden_messages_num,
-        show_welcome_message=not employee.closed_welcome_message
+        hidden_messages_num=max(0, sent_messages_num - len(messages)),
+        show_welcome_message=not employee.closed_welcome_message,
+        older_messages_cursor=older_messages_cursor
+    )
+
+
+def _older_company_thank_yous_view(company: Company, user_id: str, messages: List[ThankYouMessage],
+                                   older_messages_cursor: Optional[_MessagesCursor]) -> View:
+    return home_page_company_thank_yous_view(
+        thank_you_messages=messages,
+        app_name=company.merci_app_name,
+        current_user_slack_id=user_id,
+        enable_leaderboard=company.enable_leaderboard,
+        older_messages_cursor=older_messages_cursor
+    )
+
+
+def _leaders_view(company: Company, user_id: str, employee: Employee, senders_receivers_stats: SendersReceiversStats,
+                  messages: List[ThankYouMessage], older_messages_cursor: Optional[_MessagesCursor]) -> View:
+    return home_page_company_thank_yous_view(
+        thank_you_messages=messages,
+        app_name=company.merci_app_name,
+        current_user_slack_id=user_id,
+        sender_leaders=senders_receivers_stats.sender_leaders,
+        receiver_leaders=senders_receivers_stats.receiver_leaders,
+        leaders_stats_from_date=senders_receivers_stats.leaders_stats_from_datetime.date(),
+        leaders_stats_until_date=senders_receivers_stats.leaders_stats_until_datetime.date(),
+        enable_leaderboard=company.enable_leaderboard,
+        show_welcome_message=not employee.closed_welcome_message,
+        older_messages_cursor=older_messages_cursor
+    )
+
+
+def _leaders_query(company: Company) -> dict:
+    return dict(
+        company_uuid=company.uuid,
+        leaderboard_time_settings=company.leaderbord_time_settings,
+        group_by_company_values=company.enable_company_values,
+        include_private=company.enable_private_message_counting_in_leaderboard
     )
 
-    client.views_publish(
+
+def _company_thank_yous_home_view(company: Company, user_id: str) -> View:
+    employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id)
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(**_company_thank_yous_page_query(company.uuid))
+    return _company_thank_yous_view(company, user_id, employee, messages, older_messages_cursor,
+                                    sent_messages_num=messages_sent_num(company_uuid=company.uuid, private=False))
+
+
+def app_home_opened_action_handler(client: WebClient, event, logger):
+    try:
+        company = get_or_create_company_by_event(event)
+    except Exception:
+        company = get_or_create_company_by_slack_team_id(client.default_params["team_id"])
+
+    user_id = event["user"]
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=user_id,
-        view=view
+        view=_company_thank_yous_home_view(company, user_id),
+        # The event has no view when the user has never seen the home tab or Slack has lost it
+        force="view" not in event
     )
 
 
@@ -60,28 +145,24 @@ def home_page_company_thank_you_button_clicked_action_handler(body, client, logg
     logger.info(body)
     user_id = body["user"]["id"]
     company = get_or_create_company_by_body(body)
-    employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id)
+    publish_home_view(client, slack_team_id=company.slack_team_id, user_id=user_id,
+                      view=_company_thank_yous_home_view(company, user_id))
 
-    messages = dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW, private=False)
 
-    slack_channel_with_all_messages = None
-    if company.enable_sharing_in_a_slack_channel and company.share_messages_in_slack_channel:
-        slack_channel_with_all_messages = company.share_messages_in_slack_channel
+def home_page_company_thank_yous_load_older_button_clicked_action_handler(body, client, logger):
+    user_id = body["user"]["id"]
+    company = get_or_create_company_by_body(body)
+    cursor = thank_you_messages_cursor_from_str(retrieve_private_metadata_from_view(body).thank_you_messages_cursor)
 
-    hidden_messages_num = max(0, messages_sent_num(company_uuid=company.uuid, private=False) - len(messages))
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(
+        **_company_thank_yous_page_query(company.uuid, older_than=cursor)
+    )
 
-    client.views_publish(
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=user_id,
-        view=home_page_company_thank_yous_view(
-            thank_you_messages=dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW,
-                                                           private=False),
-            app_name=company.merci_app_name,
-            current_user_slack_id=user_id,
-            enable_leaderboard=company.enable_leaderboard,
-            slack_channel_with_all_messages=slack_channel_with_all_messages,
-            hidden_messages_num=hidden_messages_num,
-            show_welcome_message=not employee.closed_welcome_message
-        )
+        view=_older_company_thank_yous_view(company, user_id, messages, older_messages_cursor)
     )
 
 
@@ -90,43 +171,55 @@ def home_page_show_leaders_button_clicked_action_handler(body, client, logger):
     user_id = body["user"]["id"]
     company = get_or_create_company_by_body(body)
     employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id)
+    senders_receivers_stats = get_sender_and_receiver_leaders(**_leaders_query(company))
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(**_company_thank_yous_page_query(company.uuid))
 
-    senders_receivers_stats = get_sender_and_receiver_leaders(
-        company_uuid=company.uuid,
-        leaderboard_time_settings=company.leaderbord_time_settings,
-        group_by_company_values=company.enable_company_values,
-        include_private=company.enable_private_message_counting_in_leaderboard
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=_leaders_view(company, user_id, employee, senders_receivers_stats, messages, older_messages_cursor)
     )
 
-    client.views_publish(
+
+def home_page_my_thank_you_button_clicked_action_handler(body, client, logger):
+    logger.info(body)
+    user_id = body["user"]["id"]
+    company = get_or_create_company_by_body(body)
+
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(
+        **_my_thank_yous_page_query(company.uuid, user_id)
+    )
+
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=user_id,
-        view=home_page_company_thank_yous_view(
-            thank_you_messages=dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW,
-                                                           private=False),
-            app_name=company.merci_app_name,
+        view=home_page_my_thank_yous_view(
+            thank_you_messages=messages,
             current_user_slack_id=user_id,
-            sender_leaders=senders_receivers_stats.sender_leaders,
-            receiver_leaders=senders_receivers_stats.receiver_leaders,
-            leaders_stats_from_date=senders_receivers_stats.leaders_stats_from_datetime.date(),
-            leaders_stats_until_date=senders_receivers_stats.leaders_stats_until_datetime.date(),
-            enable_leaderboard=company.enable_leaderboard,
-            show_welcome_message=not employee.closed_welcome_message
+            older_messages_cursor=older_messages_cursor
         )
     )
 
 
-def home_page_my_thank_you_button_clicked_action_handler(body, client, logger):
-    logger.info(body)
+def home_page_my_thank_yous_load_older_button_clicked_action_handler(body, client, logger):
     user_id = body["user"]["id"]
     company = get_or_create_company_by_body(body)
+    cursor = thank_you_messages_cursor_from_str(retrieve_private_metadata_from_view(body).thank_you_messages_cursor)
+
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(
+        **_my_thank_yous_page_query(company.uuid, user_id, older_than=cursor)
+    )
 
-    client.views_publish(
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=user_id,
         view=home_page_my_thank_yous_view(
-            thank_you_messages=dao.read_thank_you_messages(company_uuid=company.uuid, author_slack_user_id=user_id,
-                                                           last_n=NUMBER_OF_MESSAGES_TO_SHOW,
-                                                           receiver_slack_user_id=user_id),
-            current_user_slack_id=user_id
+            thank_you_messages=messages,
+            current_user_slack_id=user_id,
+            older_messages_cursor=older_messages_cursor
         )
     )
 
@@ -173,30 +266,160 @@ def home_page_hide_welcome_message_button_clicked_action_handler(body, client, l
     company = get_or_create_company_by_body(body)
     employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=body["user"]["id"])
 
-    messages = dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW,
-                                           private=False)
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(
+        company_uuid=company.uuid, page_size=NUMBER_OF_MESSAGES_TO_SHOW, private=False,
+        load_profile=LoadProfile.HOME_FEED
+    )
     hidden_messages_num = max(0, messages_sent_num(company_uuid=company.uuid, private=False) - len(messages))
 
     if not employee.closed_welcome_message:
         employee.closed_welcome_message = True
 
-    client.views_publish(
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=employee.slack_user_id,
         view=home_page_company_thank_yous_view(
-            thank_you_messages=dao.read_thank_you_messages(company_uuid=company.uuid, last_n=NUMBER_OF_MESSAGES_TO_SHOW,
-                                                           private=False),
+            thank_you_messages=messages,
             app_name=company.merci_app_name,
             current_user_slack_id=employee.slack_user_id,
             enable_leaderboard=company.enable_leaderboard,
             slack_channel_with_all_messages=company.share_messages_in_slack_channel,
             hidden_messages_num=hidden_messages_num,
-            show_welcome_message=not employee.closed_welcome_message
+            show_welcome_message=not employee.closed_welcome_message,
+            older_messages_cursor=older_messages_cursor
         )
     )
 
 
 def home_page_help_button_clicked_action_handler(body, client, logger):
-    client.views_publish(
+    publish_home_view(
+        client,
+        slack_team_id=slack_team_id_from_body(body),
+        user_id=body["user"]["id"],
+        view=home_page_help_view()
+    )
+
+
+# The handlers of the async app (MERCI_SLACK_APP_MODE=ASYNC). They make the DAO queries a home tab needs concurrently
+# and publish it with an AsyncWebClient
+
+
+async def _async_company_thank_yous_home_view(company: Company, user_id: str) -> View:
+    employee, (messages, older_messages_cursor), sent_messages_num = await asyncio.gather(
+        async_get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id),
+        get_async_dao().read_thank_you_messages_page(**_company_thank_yous_page_query(company.uuid)),
+        async_messages_sent_num(company_uuid=company.uuid, private=False),
+    )
+    return _company_thank_yous_view(company, user_id, employee, messages, older_messages_cursor, sent_messages_num)
+
+
+async def async_app_home_opened_action_handler(client, event, logger):
+    try:
+        company = await async_get_or_create_company_by_event(event)
+    except Exception:
+        company = await async_get_or_create_company_by_slack_team_id(client.default_params["team_id"])
+
+    user_id = event["user"]
+    await async_publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=await _async_company_thank_yous_home_view(company, user_id),
+        # The event has no view when the user has never seen the home tab or Slack has lost it
+        force="view" not in event
+    )
+
+
+async def async_home_page_company_thank_you_button_clicked_action_handler(body, client, logger):
+    logger.info(body)
+    user_id = body["user"]["id"]
+    company = await async_get_or_create_company_by_body(body)
+    await async_publish_home_view(client, slack_team_id=company.slack_team_id, user_id=user_id,
+                                  view=await _async_company_thank_yous_home_view(company, user_id))
+
+
+async def async_home_page_company_thank_yous_load_older_button_clicked_action_handler(body, client, logger):
+    user_id = body["user"]["id"]
+    company = await async_get_or_create_company_by_body(body)
+    cursor = thank_you_messages_cursor_from_str(retrieve_private_metadata_from_view(body).thank_you_messages_cursor)
+
+    messages, older_messages_cursor = await get_async_dao().read_thank_you_messages_page(
+        **_company_thank_yous_page_query(company.uuid, older_than=cursor)
+    )
+
+    await async_publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=_older_company_thank_yous_view(company, user_id, messages, older_messages_cursor)
+    )
+
+
+async def async_home_page_show_leaders_button_clicked_action_handler(body, client, logger):
+    logger.info(body)
+    user_id = body["user"]["id"]
+    company = await async_get_or_create_company_by_body(body)
+    employee, senders_receivers_stats, (messages, older_messages_cursor) = await asyncio.gather(
+        async_get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id),
+        async_get_sender_and_receiver_leaders(**_leaders_query(company)),
+        get_async_dao().read_thank_you_messages_page(**_company_thank_yous_page_query(company.uuid)),
+    )
+
+    await async_publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=_leaders_view(company, user_id, employee, senders_receivers_stats, messages, older_messages_cursor)
+    )
+
+
+async def async_home_page_my_thank_you_button_clicked_action_handler(body, client, logger):
+    logger.info(body)
+    user_id = body["user"]["id"]
+    company = await async_get_or_create_company_by_body(body)
+
+    messages, older_messages_cursor = await get_async_dao().read_thank_you_messages_page(
+        **_my_thank_yous_page_query(company.uuid, user_id)
+    )
+
+    await async_publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=home_page_my_thank_yous_view(
+            thank_you_messages=messages,
+            current_user_slack_id=user_id,
+            older_messages_cursor=older_messages_cursor
+        )
+    )
+
+
+async def async_home_page_my_thank_yous_load_older_button_clicked_action_handler(body, client, logger):
+    user_id = body["user"]["id"]
+    company = await async_get_or_create_company_by_body(body)
+    cursor = thank_you_messages_cursor_from_str(retrieve_private_metadata_from_view(body).thank_you_messages_cursor)
+
+    messages, older_messages_cursor = await get_async_dao().read_thank_you_messages_page(
+        **_my_thank_yous_page_query(company.uuid, user_id, older_than=cursor)
+    )
+
+    await async_publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
+        user_id=user_id,
+        view=home_page_my_thank_yous_view(
+            thank_you_messages=messages,
+            current_user_slack_id=user_id,
+            older_messages_cursor=older_messages_cursor
+        )
+    )
+
+
+async def async_home_page_help_button_clicked_action_handler(body, client, logger):
+    await async_publish_home_view(
+        client,
+        slack_team_id=slack_team_id_from_body(body),
         user_id=body["user"]["id"],
         view=home_page_help_view()
     )
@@ -0,0 +1,357 @@
+"""The listeners of the Slack app: the Slack events, actions, view submissions, commands and shortcuts it handles and
+the handlers they are dispatched to. Bolt injects the arguments of a listener (ack, client, body...) by their names.
+
+The listeners are registered on the sync app (see thankyou.slackbot.utils.app) and on the async one (see
+thankyou.slackbot.utils.asyncapp), which runs them in threads unless it has a native async version of the handler.
+"""
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, List, Optional
+
+from prometheus_client import Histogram, Counter as PrometheusCounter
+from slack_sdk import WebClient
+
+from thankyou.slackbot.handlers.thankyoumessage import thank_you_message_say_thanks_button_clicked_handler, \
+    thanks_back_dialog_send_button_clicked_handler, thank_you_message_overflow_menu_clicked_handler, \
+    thank_you_deletion_dialog_delete_button_clicked
+from thankyou.slackbot.handlers.configuration import home_page_configuration_button_clicked_action_handler, \
+    home_page_configuration_admin_slack_user_ids_value_changed_action_handler, \
+    home_page_configuration_notification_slack_channel_value_changed_action_handler, \
+    home_page_configuration_stats_time_period_value_changed_action_handler, \
+    home_page_configuration_max_number_of_messages_per_week_value_changed_action_handler, \
+    home_page_configuration_edit_company_value_clicked_action_handler, \
+    home_page_configuration_add_new_company_value_clicked_action_handler, \
+    home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed_action_handler, \
+    home_page_configuration_enable_company_values_value_changed_action_handler, \
+    home_page_configuration_enable_leaderboard_value_changed_action_handler, \
+    home_page_configuration_max_number_of_thank_you_receivers_value_changed_action_handler, \
+    home_page_configuration_enable_attaching_files_value_changed_action_handler, \
+    home_page_configuration_max_attached_files_num_value_changed_action_handler, \
+    home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_handler, \
+    home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_action_handler, \
+    home_page_configuration_enable_private_messages_value_changed_action_handler, \
+    handle_home_page_configuration_enable_private_message_counting_in_leaderboard_value_changed_action_handler, \
+    home_page_configuration_edit_app_name_button_clicked_handler, edit_merci_app_name_dialog_save_button_clicked_handler
+from thankyou.slackbot.handlers.homepage import app_home_opened_action_handler, \
+    home_page_company_thank_you_button_clicked_action_handler, home_page_my_thank_you_button_clicked_action_handler, \
+    home_page_say_thank_you_button_clicked_action_handler, home_page_show_leaders_button_clicked_action_handler, \
+    home_page_hide_welcome_message_button_clicked_action_handler, home_page_help_button_clicked_action_handler, \
+    home_page_company_thank_yous_load_older_button_clicked_action_handler, \
+    home_page_my_thank_yous_load_older_button_clicked_action_handler
+from thankyou.slackbot.handlers.shortcuts import say_thank_you_global_shortcut_action_handler, \
+    say_thank_you_message_shortcut_action_handler
+from thankyou.slackbot.handlers.slashcommands import merci_slash_command_action_handler
+from thankyou.slackbot.handlers.thankyoudialog import thank_you_dialog_save_button_clicked_action_handler
+from thankyou.slackbot.handlers.thankyoutypedialog import thank_you_type_dialog_save_button_clicked_action_handler, \
+    thank_you_type_dialog_delete_value_button_clicked_action_handler, \
+    thank_you_type_deletion_dialog_confirm_deletion_button_clicked_action_handler
+
+
+slack_handler_metric = Histogram(
+    name='slack_handler_metric_histogram',
+    documentation='Time spent processing request',
+    labelnames=["merci_handler", "merci_handler_type", "environment"],
+)
+
+events_counter = PrometheusCounter(
+    name='slack_handler_number_of_events',
+    documentation='The total number of requests received',
+)
+
+
+errors_counter = PrometheusCounter(
+    name='slack_handler_number_of_errors',
+    documentation='The total number of errors happened while processing requests',
+)
+
+
+class EventType(Enum):
+    Event = "event"
+    Action = "action"
+    View = "view"
+    Command = "command"
+    Shortcut = "shortcut"
+
+
+@dataclass(frozen=True)
+class SlackListener:
+    event_type: EventType
+    name: str
+    func: Callable
+
+
+slack_listeners: List[SlackListener] = []
+
+
+def acting_slack_user_id(listener_kwargs: dict) -> Optional[str]:
+    """The Slack user who triggered a listener call, found in the body or the event Bolt passes to the listener"""
+    for payload in (listener_kwargs.get("body"), listener_kwargs.get("event")):
+        if not isinstance(payload, dict):
+            continue
+        user = payload.get("user") or payload.get("user_id")
+        if isinstance(user, dict):
+            user = user.get("id")
+        if user:
+            return user
+    return None
+
+
+def slack_listener(event_type: EventType, name: str):
+    """Adds a listener to slack_listeners. A listener which gets ack must call it before anything else"""
+    def decorator(func: Callable):
+        slack_listeners.append(SlackListener(event_type=event_type, name=name, func=func))
+        return func
+    return decorator
+
+
+@slack_listener(EventType.Event, "app_home_opened")
+def _app_home_opened_action_handler(client: WebClient, event, logger):
+    app_home_opened_action_handler(client, event, logger)
+
+
+@slack_listener(EventType.Action, "home_page_company_thank_you_button_clicked")
+def _home_page_company_thank_you_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_company_thank_you_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_show_leaders_button_clicked")
+def _home_page_show_leaders_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_show_leaders_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_my_thank_you_button_clicked")
+def _home_page_my_thank_you_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_my_thank_you_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_company_thank_yous_load_older_button_clicked")
+def _home_page_company_thank_yous_load_older_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_company_thank_yous_load_older_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_my_thank_yous_load_older_button_clicked")
+def _home_page_my_thank_yous_load_older_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_my_thank_yous_load_older_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_say_thank_you_button_clicked")
+def _home_page_say_thank_you_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_say_thank_you_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_hide_welcome_message_button_clicked")
+def _home_page_hide_welcome_message_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_hide_welcome_message_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "thank_you_dialog_send_privately_action")
+def _thank_you_dialog_send_privately_action_handler(ack):
+    ack()
+
+
+@slack_listener(EventType.View, "thank_you_dialog_save_button_clicked")
+def _thank_you_dialog_save_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    thank_you_dialog_save_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_help_button_clicked")
+def _home_page_help_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_help_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_button_clicked")
+def _home_page_configuration_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_admin_slack_user_ids_value_changed")
+def _home_page_configuration_admin_slack_user_ids_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_admin_slack_user_ids_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_edit_app_name_button_clicked")
+def _home_page_configuration_edit_app_name_button_clicked_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_edit_app_name_button_clicked_handler(body, client, logger)
+
+
+@slack_listener(EventType.View, "edit_merci_app_name_dialog_save_button_clicked")
+def _edit_merci_app_name_dialog_save_button_clicked_handler(ack, client, body, logger):
+    ack()
+    edit_merci_app_name_dialog_save_button_clicked_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_sharing_in_a_slack_channel_value_changed")
+def _home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_sharing_in_a_slack_channel_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_notification_slack_channel_value_changed")
+def _home_page_configuration_notification_slack_channel_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_notification_slack_channel_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_private_messages_value_changed")
+def _home_page_configuration_enable_private_messages_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_private_messages_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_leaderboard_value_changed")
+def _home_page_configuration_enable_leaderboard_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_leaderboard_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_stats_time_period_value_changed")
+def _home_page_configuration_stats_time_period_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_stats_time_period_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action,
+                "home_page_configuration_enable_private_message_counting_in_leaderboard_value_changed")
+def _home_page_configuration_enable_private_message_counting_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    handle_home_page_configuration_enable_private_message_counting_in_leaderboard_value_changed_action_handler(
+        client, body, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_max_number_of_thank_you_receivers_value_changed")
+def _home_page_configuration_max_number_of_thank_you_receivers_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_max_number_of_thank_you_receivers_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_weekly_thank_you_limit_value_changed")
+def _home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_weekly_thank_you_limit_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_max_number_of_messages_per_week_value_changed")
+def _home_page_configuration_max_number_of_messages_per_week_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_max_number_of_messages_per_week_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_edit_company_value_clicked")
+def _home_page_configuration_edit_company_value_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_edit_company_value_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_add_new_company_value_clicked")
+def _home_page_configuration_add_new_company_value_clicked_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_add_new_company_value_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed")
+def _home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed_action_handler(ack, client, body,
+                                                                                                logger):
+    ack()
+    home_page_configuration_enable_rich_text_in_thank_you_messages_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_attaching_files_value_changed")
+def _home_page_configuration_enable_attaching_files_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_attaching_files_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_max_attached_files_num_value_changed")
+def _home_page_configuration_max_attached_files_num_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_max_attached_files_num_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "home_page_configuration_enable_company_values_value_changed")
+def _home_page_configuration_enable_company_values_value_changed_action_handler(ack, client, body, logger):
+    ack()
+    home_page_configuration_enable_company_values_value_changed_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.View, "thank_you_type_dialog_save_button_clicked")
+def _thank_you_type_dialog_save_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    thank_you_type_dialog_save_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "thank_you_type_dialog_delete_value_button_clicked")
+def _thank_you_type_dialog_delete_value_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    thank_you_type_dialog_delete_value_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.View, "thank_you_type_deletion_dialog_confirm_deletion_button_clicked")
+def _thank_you_type_deletion_dialog_confirm_deletion_button_clicked_action_handler(ack, client, body, logger):
+    ack()
+    thank_you_type_deletion_dialog_confirm_deletion_button_clicked_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "thank_you_message_say_thanks_button_clicked")
+def _thank_you_message_say_thanks_button_clicked_handler(ack, client, body, logger):
+    ack()
+    thank_you_message_say_thanks_button_clicked_handler(body, client, logger)
+
+
+@slack_listener(EventType.Action, "thank_you_message_overflow_menu_clicked")
+def _thank_you_message_overflow_menu_clicked_handler(ack, client, body, logger):
+    ack()
+    thank_you_message_overflow_menu_clicked_handler(client, body, logger)
+
+
+@slack_listener(EventType.View, "thank_you_deletion_dialog_delete_button_clicked")
+def _thank_you_deletion_dialog_delete_button_clicked(ack, client, body, logger):
+    ack()
+    thank_you_deletion_dialog_delete_button_clicked(client, body, logger)
+
+
+@slack_listener(EventType.View, "thanks_back_dialog_send_button_clicked")
+def _thanks_back_dialog_send_button_clicked_handler(ack, client, body, logger):
+    ack()
+    thanks_back_dialog_send_button_clicked_handler(body, client, logger)
+
+
+@slack_listener(EventType.Command, "/merci")
+def _merci_slash_command_action_handler(ack, client, body, logger):
+    ack()
+    merci_slash_command_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Command, "/thanks")
+def _merci_slash_command_action_handler(ack, client, body, logger):
+    ack()
+    merci_slash_command_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Command, "/merci_dev")
+def _merci_slash_command_action_handler(ack, client, body, logger):
+    ack()
+    merci_slash_command_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Shortcut, "say_thank_you_global_shortcut")
+def _say_thank_you_global_shortcut_action_handler(ack, client, body, logger):
+    ack()
+    say_thank_you_global_shortcut_action_handler(body, client, logger)
+
+
+@slack_listener(EventType.Shortcut, "say_thank_you_message_shortcut")
+def _say_thank_you_message_shortcut_action_handler(ack, client, body, logger):
+    ack()
+    say_thank_you_message_shortcut_action_handler(body, client, logger)
@@ -1,3 +1,5 @@
+from functools import partial
+
 import validators
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
@@ -5,7 +7,11 @@ from slack_sdk.models.blocks import SectionBlock
 from slack_sdk.models.views import View
 
 from thankyou.dao import dao
+from thankyou.dao.interface import LoadProfile
+from thankyou.slackbot.blocks.thank_you import invalidate_thank_you_message_blocks
+from thankyou.slackbot.handlers.common import publish_home_view
 from thankyou.slackbot.utils.company import get_or_create_company_by_body
+from thankyou.slackbot.utils.delivery import slack_delivery_executor, slack_api_error_code
 from thankyou.slackbot.utils.employee import get_or_create_employee_by_slack_user_id
 from thankyou.slackbot.utils.privatemetadata import PrivateMetadata
 from thankyou.slackbot.views.homepage import home_page_company_thank_yous_view
@@ -96,7 +102,7 @@ def thank_you_message_overflow_menu_clicked_handler(client, body, logger):
     user_id = body["user"]["id"]
 
     action, message_id = str(body["actions"][0]["selected_option"]["value"]).split(":", 1)
-    message = dao.read_thank_you_message(company.uuid, message_id)
+    message = dao.read_thank_you_message(company.uuid, message_id, load_profile=LoadProfile.FULL)
 
     if not message:
         logger.error(f"Could not find a message {message_id} for company {company.uuid}")
@@ -115,20 +121,26 @@ def thank_you_message_overflow_menu_clicked_handler(client, body, logger):
                     for image in message.images:
                         dao.delete_thank_you_image(image)
                     message.images = []
-            try:
-                client.views_open(trigger_id=body["trigger_id"], view=thank_you_dialog_view(
-                    app_name=company.merci_app_name,
-                    state=message,
-                    thank_you_types=dao.read_thank_you_types(company_uuid=company.uuid),
-                    enable_rich_text=company.enable_rich_text_in_thank_you_messages,
-                    enable_company_values=company.enable_company_values,
-                    max_receivers_num=company.receivers_number_limit,
-                    enable_attaching_files=company.enable_attaching_files,
-                    max_attached_files_num=company.max_attached_files_num,
-                    display_private_message_option=company.enable_private_messages,
-                ))
-            except Exception as e:
-                logger.error(f"Error publishing home tab: {e}")
+            view = thank_you_dialog_view(
+                app_name=company.merci_app_name,
+                state=message,
+                thank_you_types=dao.read_thank_you_types(company_uuid=company.uuid),
+                enable_rich_text=company.enable_rich_text_in_thank_you_messages,
+                enable_company_values=company.enable_company_values,
+                max_receivers_num=company.receivers_number_limit,
+                enable_attaching_files=company.enable_attaching_files,
+                max_attached_files_num=company.max_attached_files_num,
+                display_private_message_option=company.enable_private_messages,
+            )
+
+            def open_thank_you_dialog():
+                try:
+                    client.views_open(trigger_id=body["trigger_id"], view=view)
+                except Exception as e:
+                    logger.error(f"Error publishing home tab: {e}")
+
+            # After the invalid images are deleted
+            dao.call_after_commit(open_thank_you_dialog)
         else:
             client.views_open(
                 trigger_id=body["trigger_id"],
@@ -205,7 +217,10 @@ def thank_you_deletion_dialog_delete_button_clicked(client: WebClient, body, log
     employee = get_or_create_employee_by_slack_user_id(company_uuid=company.uuid, slack_user_id=user_id)
 
     message_uuid = PrivateMetadata.from_str(body["view"]["private_metadata"]).thank_you_message_uuid
-    message = dao.read_thank_you_message(company_uuid=company.uuid, thank_you_message_uuid=message_uuid)
+    # The deletion takes the message from the session to compute the rollup delta, so it must not be a lagging copy
+    with dao.primary_reads():
+        message = dao.read_thank_you_message(company_uuid=company.uuid, thank_you_message_uuid=message_uuid,
+                                             load_profile=LoadProfile.FULL)
 
     if not message:
         logger.error(f"Can not find message {message_uuid} from company {company.uuid}")
@@ -226,18 +241,21 @@ def thank_you_deletion_dialog_delete_button_clicked(client: WebClient, body, log
         return
 
     try:
-        for slack_delivery in message.slack_deliveries:
-            if not slack_delivery.deleted:
-                try:
-                    client.chat_delete(
-                        channel=slack_delivery.slack_channel_id,
-                        ts=slack_delivery.message_ts,
-                    )
-                except SlackApiError as api_error:
-                    if api_error.response["error"] != "message_not_found":
-                        raise
+        slack_deliveries = [d for d in message.slack_deliveries if not d.deleted]
+        results = slack_delivery_executor.run(company.uuid, [
+            partial(client.chat_delete, channel=slack_delivery.slack_channel_id, ts=slack_delivery.message_ts)
+            for slack_delivery in slack_deliveries
+        ])
+        first_error = None
+        for slack_delivery, result in zip(slack_deliveries, results):
+            if result.error is None or slack_api_error_code(result.error) == "message_not_found":
                 slack_delivery.deleted = True
+            elif first_error is None:
+                first_error = result.error
+        if first_error is not None:
+            raise first_error
         dao.delete_thank_you_message(thank_you_message_uuid=message_uuid)
+        dao.call_after_commit(partial(invalidate_thank_you_message_blocks, message_uuid))
     except Exception as e:
         logger.error(f"Could not delete a message {message.uuid} for company {company.uuid}: {e}")
         deleted = False
@@ -249,7 +267,8 @@ def thank_you_deletion_dialog_delete_button_clicked(client: WebClient, body, log
     else:
         text = "The message was not deleted due to an internal error. Please, try again later"
 
-    client.views_open(
+    dao.call_after_commit(partial(
+        client.views_open,
         trigger_id=body["trigger_id"],
         view=View(
             type="modal",
@@ -258,15 +277,21 @@ def thank_you_deletion_dialog_delete_button_clicked(client: WebClient, body, log
                 SectionBlock(text=text)
             ]
         ),
-    )
+    ))
 
-    client.views_publish(
+    messages, older_messages_cursor = dao.read_thank_you_messages_page(
+        company_uuid=company.uuid, page_size=20, private=False, load_profile=LoadProfile.HOME_FEED
+    )
+    publish_home_view(
+        client,
+        slack_team_id=company.slack_team_id,
         user_id=user_id,
         view=home_page_company_thank_yous_view(
-            thank_you_messages=dao.read_thank_you_messages(company_uuid=company.uuid, last_n=20, private=False),
+            thank_you_messages=messages,
             app_name=company.merci_app_name,
             current_user_slack_id=user_id,
             enable_leaderboard=company.enable_leaderboard,
-            show_welcome_message=not employee.closed_welcome_message
+            show_welcome_message=not employee.closed_welcome_message,
+            older_messages_cursor=older_messages_cursor
         )
     )
@@ -1,3 +1,5 @@
+from functools import partial
+
 from thankyou.core.models import ThankYouType
 from thankyou.dao import dao
 from thankyou.slackbot.handlers.common import publish_configuration_view
@@ -55,10 +57,11 @@ def thank_you_type_deletion_dialog_confirm_deletion_button_clicked_action_handle
 
     dao.delete_thank_you_type(company_uuid=company.uuid, thank_you_type_uuid=thank_you_type_uuid)
 
-    client.views_open(
+    dao.call_after_commit(partial(
+        client.views_open,
         trigger_id=body["trigger_id"],
         view=thank_you_type_deletion_completion_dialog(thank_you_type_name=thank_you_type_name)
-    )
+    ))
 
     publish_configuration_view(
         client=client,
@@ -0,0 +1,82 @@
+"""The HTTP server of the async Slack app (MERCI_SLACK_APP_MODE=ASYNC), the aiohttp counterpart of wsgi.py:
+
+    gunicorn --worker-class=aiohttp.GunicornWebWorker --workers 2 \
+        --config=thankyou/slackbot/utils/gunicorn_conf.py "thankyou.slackbot.utils.aiohttpapp:slack_app()"
+
+A worker handles any number of Slack requests at once, so a few workers replace the sync workers of wsgi.py.
+"""
+import asyncio
+
+from aiohttp import web
+from prometheus_client import CollectorRegistry, multiprocess, generate_latest, CONTENT_TYPE_LATEST
+from slack_bolt.adapter.aiohttp import to_bolt_request, to_aiohttp_response
+from slack_bolt.async_app import AsyncApp
+
+from thankyou.core.config import slack_signing_secret
+from thankyou.dao import get_async_dao
+from thankyou.slackbot.utils.asyncapp import async_app
+from thankyou.slackbot.utils.dedup import SlackRequestDeduplicator
+from thankyou.slackbot.utils.pages.installbutton import build_default_install_page_html
+from thankyou.slackbot.utils.pages.privacy import privacy_page_html
+from thankyou.slackbot.utils.pages.termsofservice import terms_of_service
+
+
+def create_aiohttp_app(slack_app_: AsyncApp) -> web.Application:
+    aiohttp_app = web.Application()
+    deduplicator = SlackRequestDeduplicator(slack_signing_secret())
+
+    async def handle_slack_request(request: web.Request) -> web.Response:
+        bolt_response = await slack_app_.async_dispatch(await to_bolt_request(request))
+        return await to_aiohttp_response(bolt_response)
+
+    async def metrics(request: web.Request) -> web.Response:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return web.Response(body=generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+    async def slack_events(request: web.Request) -> web.Response:
+        # Slack retries slow requests: every event and view submission is processed once
+        # The processed requests are kept in the shared cache (a SQLite file), which is accessed in the default executor
+        body = await request.text()
+        loop = asyncio.get_event_loop()
+        key, is_duplicate = await loop.run_in_executor(None, deduplicator.start, body, request.headers)
+        if is_duplicate:
+            return web.Response(status=200, headers={"X-Slack-No-Retry": "1"})
+        try:
+            response = await handle_slack_request(request)
+        except BaseException:
+            loop.run_in_executor(None, deduplicator.failed, key)  # Not awaited: the request may have been cancelled
+            raise
+        if response.status >= 500:
+            await loop.run_in_executor(None, deduplicator.failed, key)
+        return response
+
+    async def install_button(request: web.Request) -> web.Response:
+        return web.Response(
+            status=200,
+            text=build_default_install_page_html("https://merci.emgbook.com/slack/install"),
+            content_type="text/html"
+        )
+
+    async def privacy(request: web.Request) -> web.Response:
+        return web.Response(status=200, text=privacy_page_html, content_type="text/html")
+
+    async def tos(request: web.Request) -> web.Response:
+        return web.Response(status=200, text=terms_of_service, content_type="text/html")
+
+    async def dispose_async_dao(app: web.Application):
+        await get_async_dao().dispose()
+
+    aiohttp_app.router.add_get("/metrics", metrics)
+    aiohttp_app.router.add_post("/slack/events", slack_events)
+    aiohttp_app.router.add_get("/slack/install_button", install_button)
+    aiohttp_app.router.add_get("/slack/install", handle_slack_request)
+    aiohttp_app.router.add_get("/slack/oauth_redirect", handle_slack_request)
+    aiohttp_app.router.add_get("/slack/privacy", privacy)
+    aiohttp_app.router.add_get("/slack/tos", tos)
+    aiohttp_app.on_cleanup.append(dispose_async_dao)
+    return aiohttp_app
+
+
+def slack_app() -> web.Application:
+    return create_aiohttp_app(async_app)
@@ -0,0 +1,203 @@
+"""The Slack app on an asyncio event loop (MERCI_SLACK_APP_MODE=ASYNC): a slack_bolt AsyncApp with AsyncWebClient
+clients, served by aiohttp (see thankyou.slackbot.utils.aiohttpapp).
+
+The home tab handlers have native async versions: the DAO queries of a home tab (with the asyncio DAO) and the
+views_publish call of every request run concurrently on the event loop, so a slow Slack API call does not pin a
+process or a thread. The other listeners of thankyou.slackbot.handlers.registry are run in a thread pool, each in a
+DAO transaction, with a blocking WebClient, exactly as the sync app runs them.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from timeit import default_timer as timer
+from typing import Callable, Set, Tuple
+
+from slack_bolt.async_app import AsyncApp, AsyncBoltContext
+
+from thankyou.core.config import slack_bot_token, slack_signing_secret, slack_app_token, get_env, \
+    get_slack_listener_mode, SlackListenerMode, slack_listener_max_workers
+from thankyou.dao import dao
+from thankyou.dao.instrumentation import count_handler_statements
+from thankyou.slackbot.handlers.homepage import async_app_home_opened_action_handler, \
+    async_home_page_company_thank_you_button_clicked_action_handler, \
+    async_home_page_company_thank_yous_load_older_button_clicked_action_handler, \
+    async_home_page_show_leaders_button_clicked_action_handler, \
+    async_home_page_my_thank_you_button_clicked_action_handler, \
+    async_home_page_my_thank_yous_load_older_button_clicked_action_handler, \
+    async_home_page_help_button_clicked_action_handler
+from thankyou.slackbot.handlers.registry import EventType, SlackListener, slack_listeners, slack_handler_metric, \
+    events_counter, errors_counter, acting_slack_user_id
+from thankyou.slackbot.utils.oauth import create_async_oauth_settings
+from thankyou.slackbot.utils.webclient import async_rate_limited_web_client, rate_limited_web_client
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+_IS_SOCKET_MODE = None
+
+_async_oauth_settings = create_async_oauth_settings()
+
+if _async_oauth_settings and slack_signing_secret():
+    _IS_SOCKET_MODE = False
+    logger.info("Creating an async HTTP app with OAuth")
+    async_app = AsyncApp(
+        signing_secret=slack_signing_secret(),
+        oauth_settings=_async_oauth_settings,
+        logger=logger,
+    )
+elif slack_bot_token() and slack_app_token():
+    _IS_SOCKET_MODE = True
+    logger.info("Creating an async socket mode app")
+    async_app = AsyncApp(token=slack_bot_token(), logger=logger)
+else:
+    raise ValueError("Can not create a Slack application instance")
+
+
+def is_socket_mode() -> bool:
+    return _IS_SOCKET_MODE
+
+
+# The listeners without a native async version. They are blocking, so they must not run on the event loop
+sync_listener_executor = ThreadPoolExecutor(max_workers=slack_listener_max_workers(),
+                                            thread_name_prefix="slack-sync-listener")
+
+# (event type, name) of the listeners registered on async_app
+_registered_listeners: Set[Tuple[EventType, str]] = set()
+
+
+@async_app.middleware
+async def _rate_limited_web_client_middleware(context: AsyncBoltContext, next):
+    # Bolt creates a plain AsyncWebClient for every request, listeners get a rate limited copy of it instead
+    if context.client is not None:
+        context["client"] = async_rate_limited_web_client(context.client)
+    await next()
+
+
+async def _ack_right_away(ack):
+    await ack()
+
+
+def _register(event_type: EventType, name: str, wrapper: Callable):
+    if event_type == EventType.Event:
+        app_wrapper = async_app.event
+    elif event_type == EventType.Action:
+        app_wrapper = async_app.action
+    elif event_type == EventType.View:
+        app_wrapper = async_app.view
+    elif event_type == EventType.Command:
+        app_wrapper = async_app.command
+    elif event_type == EventType.Shortcut:
+        app_wrapper = async_app.shortcut
+    else:
+        raise ValueError(f"Unknown EventType: {event_type}")
+
+    if get_slack_listener_mode() == SlackListenerMode.LAZY:
+        app_wrapper(name)(ack=_ack_right_away, lazy=[wrapper])
+    else:
+        app_wrapper(name)(wrapper)
+    _registered_listeners.add((event_type, name))
+
+
+def async_app_event(event_type: EventType, name: str):
+    """Registers a native async handler. Unlike the sync ones, it is not run in a DAO transaction: its DAO calls are
+    committed separately, so that they can be made concurrently. Handlers which write must use
+    get_async_dao().transaction() and make the calls of the transaction one by one"""
+    def decorator(func: Callable):
+        metric_wrapper = slack_handler_metric.labels(func.__name__, event_type.value, get_env().name.lower())
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                with count_handler_statements(func.__name__):
+                    return await func(*args, **kwargs)
+            except Exception:
+                errors_counter.inc(1)
+                raise
+            finally:
+                events_counter.inc(1)
+                metric_wrapper.observe(timer() - start)
+
+        _register(event_type, name, wrapper)
+        return wrapper
+    return decorator
+
+
+def _register_sync_listener(listener: SlackListener):
+    """Registers a listener of the registry which runs in sync_listener_executor. It is acknowledged on the event
+    loop, its own ack() calls do nothing"""
+    func = listener.func
+    metric_wrapper = slack_handler_metric.labels(func.__name__, listener.event_type.value, get_env().name.lower())
+
+    def run(**kwargs):
+        # The executor threads don't inherit the context of the event loop task, the statements are counted in them
+        with count_handler_statements(func.__name__), dao.on_behalf_of(acting_slack_user_id(kwargs)), \
+                dao.transaction():
+            return func(**kwargs)
+
+    @wraps(func)
+    async def wrapper(**kwargs):
+        start = timer()
+        try:
+            if "ack" in kwargs:
+                await kwargs["ack"]()
+                kwargs["ack"] = lambda *args_, **kwargs_: None
+            if "client" in kwargs:
+                kwargs["client"] = rate_limited_web_client(kwargs["client"])
+            return await asyncio.get_event_loop().run_in_executor(sync_listener_executor, lambda: run(**kwargs))
+        except Exception:
+            errors_counter.inc(1)
+            raise
+        finally:
+            events_counter.inc(1)
+            metric_wrapper.observe(timer() - start)
+
+    _register(listener.event_type, listener.name, wrapper)
+
+
+@async_app_event(EventType.Event, "app_home_opened")
+async def _app_home_opened_action_handler(client, event, logger):
+    await async_app_home_opened_action_handler(client, event, logger)
+
+
+@async_app_event(EventType.Action, "home_page_company_thank_you_button_clicked")
+async def _home_page_company_thank_you_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_company_thank_you_button_clicked_action_handler(body, client, logger)
+
+
+@async_app_event(EventType.Action, "home_page_show_leaders_button_clicked")
+async def _home_page_show_leaders_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_show_leaders_button_clicked_action_handler(body, client, logger)
+
+
+@async_app_event(EventType.Action, "home_page_my_thank_you_button_clicked")
+async def _home_page_my_thank_you_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_my_thank_you_button_clicked_action_handler(body, client, logger)
+
+
+@async_app_event(EventType.Action, "home_page_company_thank_yous_load_older_button_clicked")
+async def _home_page_company_thank_yous_load_older_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_company_thank_yous_load_older_button_clicked_action_handler(body, client, logger)
+
+
+@async_app_event(EventType.Action, "home_page_my_thank_yous_load_older_button_clicked")
+async def _home_page_my_thank_yous_load_older_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_my_thank_yous_load_older_button_clicked_action_handler(body, client, logger)
+
+
+@async_app_event(EventType.Action, "home_page_help_button_clicked")
+async def _home_page_help_button_clicked_action_handler(ack, client, body, logger):
+    await ack()
+    await async_home_page_help_button_clicked_action_handler(body, client, logger)
+
+
+for _listener in slack_listeners:
+    if (_listener.event_type, _listener.name) not in _registered_listeners:
+        _register_sync_listener(_listener)
@@ -1,18 +1,71 @@
+import asyncio
+from dataclasses import dataclass, fields
 from threading import Lock
-from typing import Optional
+from typing import Optional, Tuple
 
-from thankyou.core.models import Company, LeaderbordTimeSettings
-from thankyou.dao import dao, create_initial_data
+from thankyou.core.models import Company, LeaderbordTimeSettings, CompanyAdmin, Slack_Team_ID_Type, \
+    Slack_Channel_ID_Type, UUID_Type
+from thankyou.dao import dao, create_initial_data, get_async_dao
+from thankyou.utils.cache import SharedTTLCache, async_cache_get, async_cache_set
 
 CREATE_COMPANY_LOCK = Lock()
 
 
-def get_or_create_company_by_slack_team_id(slack_team_id: str) -> Company:
-    """Retrieves a company from a database or creates a new one if such company does not exist
+@dataclass(frozen=True)
+class CompanySnapshot:
+    """An immutable copy of a company configuration (and its admins) which is safe to share between requests.
 
-    :param slack_team_id: string - a slack team ID of a company
-    :return: a `Company` class object
+    Handlers which change the configuration must work with the `Company` returned by
+    `read_company_for_update_by_body` and call `invalidate_company_cache` afterwards
     """
+    slack_team_id: Slack_Team_ID_Type
+    admins: Tuple[CompanyAdmin, ...]
+    enable_sharing_in_a_slack_channel: bool
+    share_messages_in_slack_channel: Optional[Slack_Channel_ID_Type]
+    leaderbord_time_settings: LeaderbordTimeSettings
+    enable_weekly_thank_you_limit: bool
+    weekly_thank_you_limit: int
+    receivers_number_limit: int
+    enable_leaderboard: bool
+    enable_private_message_counting_in_leaderboard: bool
+    enable_company_values: bool
+    enable_rich_text_in_thank_you_messages: bool
+    enable_attaching_files: bool
+    enable_private_messages: bool
+    max_attached_files_num: int
+    custom_merci_app_name: Optional[str]
+    uuid: UUID_Type
+    deleted: bool
+
+    merci_app_name = Company.merci_app_name
+
+    @classmethod
+    def from_company(cls, company: Company) -> "CompanySnapshot":
+        kwargs = {f.name: getattr(company, f.name) for f in fields(cls) if f.name != "admins"}
+        return cls(
+            admins=tuple(CompanyAdmin(company_uuid=admin.company_uuid, slack_user_id=admin.slack_user_id)
+                         for admin in company.admins),
+            **kwargs
+        )
+
+
+# Shared by the gunicorn workers (MERCI_CACHE_BACKEND=SQLITE), so an invalidation evicts the company in all of them.
+# The snapshots are stored as JSON there
+_companies_cache = SharedTTLCache(name="companies", maxsize=1024 * 10, ttl=60)
+
+
+def invalidate_company_cache(slack_team_id: Slack_Team_ID_Type):
+    """Must be called by every handler which changes a company configuration or its admins. The company is evicted
+    right away and once again after the change is committed, so a concurrent request can not put the configuration
+    it read before the commit back to the cache"""
+    def evict():
+        _companies_cache.pop(slack_team_id, None)
+
+    evict()
+    dao.call_after_commit(evict)
+
+
+def _read_or_create_company(slack_team_id: str) -> Company:
     companies = dao.read_companies(slack_team_id=slack_team_id)
     try:
         return companies[0]
@@ -43,19 +96,71 @@ def get_or_create_company_by_slack_team_id(slack_team_id: str) -> Company:
                 return company
 
 
-def get_or_create_company_by_body(body) -> Company:
+def get_or_create_company_by_slack_team_id(slack_team_id: str) -> CompanySnapshot:
+    """Retrieves a company from the cache or a database, or creates a new one if such company does not exist
+
+    :param slack_team_id: string - a slack team ID of a company
+    :return: a `CompanySnapshot` class object
+    """
+    company = _companies_cache.get(slack_team_id)
+    if company is not None:
+        return company
+
+    company = CompanySnapshot.from_company(_read_or_create_company(slack_team_id))
+    _companies_cache[slack_team_id] = company
+    return company
+
+
+async def async_get_or_create_company_by_slack_team_id(slack_team_id: str) -> CompanySnapshot:
+    """`get_or_create_company_by_slack_team_id` for the async app. A company missing in the cache is read with the
+    async DAO, the rare creation of a new company runs in the default executor"""
+    company = await async_cache_get(_companies_cache, slack_team_id)
+    if company is not None:
+        return company
+
+    companies = await get_async_dao().read_companies(slack_team_id=slack_team_id)
+    if not companies:
+        return await asyncio.get_event_loop().run_in_executor(
+            None, get_or_create_company_by_slack_team_id, slack_team_id)
+
+    company = CompanySnapshot.from_company(companies[0])
+    await async_cache_set(_companies_cache, slack_team_id, company)
+    return company
+
+
+def slack_team_id_from_body(body) -> str:
     try:
         slack_team_id = body["team"]["id"]
     except KeyError:
         slack_team_id = body["team_id"]
     if not slack_team_id:
         raise Exception(f"Can not find slack_team_id in a body: {body}")
+    return slack_team_id
 
-    return get_or_create_company_by_slack_team_id(slack_team_id)
+
+def get_or_create_company_by_body(body) -> CompanySnapshot:
+    return get_or_create_company_by_slack_team_id(slack_team_id_from_body(body))
+
+
+def read_company_for_update_by_body(body) -> Company:
+    """Retrieves a company which can be changed (it bypasses the cache). Call `invalidate_company_cache` after the
+    change"""
+    return _read_or_create_company(slack_team_id_from_body(body))
 
 
-def get_or_create_company_by_event(event) -> Optional[Company]:
+def get_or_create_company_by_event(event) -> Optional[CompanySnapshot]:
     slack_team_id = event["view"]["team_id"]
     if not slack_team_id:
         raise Exception(f"Can not find slack_team_id in event: {event}")
     return get_or_create_company_by_slack_team_id(slack_team_id)
+
+
+async def async_get_or_create_company_by_body(body) -> CompanySnapshot:
+    return await async_get_or_create_company_by_slack_team_id(slack_team_id_from_body(body))
+
+
+async def async_get_or_create_company_by_event(event) -> Optional[CompanySnapshot]:
+    slack_team_id = event["view"]["team_id"]
+    if not slack_team_id:
+        raise Exception(f"Can not find slack_team_id in event: {event}")
+    return await async_get_or_create_company_by_slack_team_id(slack_team_id)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+from typing import Callable, Mapping, Optional, Tuple
+from urllib.parse import parse_qs
+
+from flask import Response
+from prometheus_client import Counter as PrometheusCounter
+from slack_sdk.signature import SignatureVerifier
+
+from thankyou.utils.cache import SharedTTLCache
+
+
+suppressed_duplicates_counter = PrometheusCounter(
+    name='slack_handler_number_of_suppressed_duplicates',
+    documentation='The total number of Slack requests (mostly retries) which were not processed as duplicates',
+    labelnames=["kind", "retry_reason"],
+)
+
+# Slack retries a request up to 3 times within about 5 minutes
+_processed_slack_requests = SharedTTLCache(name="processed_slack_requests", maxsize=1024 * 100, ttl=60 * 60)
+
+
+def slack_request_idempotency_key(body: str) -> Optional[Tuple[str, str]]:
+    """Returns the kind and the idempotency key of an Events API event (its event_id) or of a view submission (a
+    hash of the view, its state and the user), None for the other requests"""
+    if body.startswith("{"):
+        try:
+            event_id = json.loads(body).get("event_id")
+        except (ValueError, AttributeError):
+            return None
+        return ("event", event_id) if event_id else None
+
+    try:
+        payload = json.loads(parse_qs(body).get("payload", [""])[0])
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get("type") != "view_submission":
+        return None
+    view = payload.get("view") or {}
+    submission = json.dumps({
+        "view_id": view.get("id"),
+        "hash": view.get("hash"),
+        "state": view.get("state"),
+        "user_id": (payload.get("user") or {}).get("id"),
+    }, sort_keys=True)
+    return "view_submission", hashlib.sha256(submission.encode()).hexdigest()
+
+
+class SlackRequestDeduplicator:
+    """Processes every event and view submission once, even if Slack retries it because the first request was slow.
+
+    The keys of the requests being processed and processed are kept in a SharedTTLCache, so a retry which reaches
+    another gunicorn worker is recognized too. Only requests with a valid signature are recorded, so forged requests
+    can not suppress real ones. A request which fails (HTTP 5xx or an exception) is forgotten to let Slack retry it.
+
+    With lazy listeners (MERCI_SLACK_LISTENER_MODE=LAZY) the request succeeds as soon as it is acknowledged, before
+    the handler runs, and Slack does not retry an acknowledged request. A handler which fails then is not retried:
+    events and view submissions are processed at most once.
+    """
+
+    def __init__(self, signing_secret: Optional[str], processed_requests: SharedTTLCache = _processed_slack_requests):
+        self.signature_verifier = SignatureVerifier(signing_secret) if signing_secret else None
+        self.processed_requests = processed_requests
+
+    def start(self, body: str, headers: Mapping[str, str]) -> Tuple[Optional[Tuple[str, str]], bool]:
+        """Records a request which is about to be processed. Returns its key (None if the request is not
+        deduplicated) and True if it is a duplicate, which must be answered with an empty HTTP 200 response with the
+        X-Slack-No-Retry header. Call `failed` with the key if processing fails"""
+        key = slack_request_idempotency_key(body) if self.signature_verifier else None
+        if key is None or not self.signature_verifier.is_valid_request(body, dict(headers)):
+            return None, False
+
+        if not self.processed_requests.add(key, True):
+            retry_reason = headers.get("X-Slack-Retry-Reason") or ""
+            logging.info(f"Skipping a duplicate Slack {key[0]} {key[1]} (retry #{headers.get('X-Slack-Retry-Num')}, "
+                         f"reason: '{retry_reason}')")
+            suppressed_duplicates_counter.labels(key[0], retry_reason).inc()
+            return key, True
+        return key, False
+
+    def failed(self, key: Optional[Tuple[str, str]]):
+        """Forgets a request which failed, to let Slack retry it"""
+        if key is not None:
+            self._forget(key)
+
+    def handle(self, body: str, headers: Mapping[str, str], handler: Callable[[], Response]) -> Response:
+        key, is_duplicate = self.start(body, headers)
+        if is_duplicate:
+            return Response(status=200, headers={"X-Slack-No-Retry": "1"})
+
+        try:
+            response = handler()
+        except BaseException:
+            self.failed(key)
+            raise
+        if response.status_code >= 500:
+            self.failed(key)
+        return response
+
+    def _forget(self, key: Tuple[str, str]):
+        try:
+            del self.processed_requests[key]
+        except KeyError:
+            pass
+        except Exception as e:
+            logging.warning(f"Can not forget a failed Slack request {key}: {e}")
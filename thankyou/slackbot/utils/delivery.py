@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import BoundedSemaphore, Lock
+from typing import Callable, Generic, List, Optional, Sequence, TypeVar
+from weakref import WeakValueDictionary
+
+from slack_sdk.errors import SlackApiError
+
+from thankyou.core.config import slack_delivery_max_workers, slack_delivery_max_concurrency_per_workspace
+
+T = TypeVar("T")
+
+
+@dataclass
+class SlackCallResult(Generic[T]):
+    response: Optional[T] = None
+    error: Optional[Exception] = None
+
+
+def slack_api_error_code(error: Optional[Exception]) -> Optional[str]:
+    """Returns the "error" field of a Slack API error response, None for other exceptions"""
+    if isinstance(error, SlackApiError):
+        try:
+            return error.response["error"]
+        except (KeyError, TypeError):
+            return None
+    return None
+
+
+class SlackDeliveryExecutor:
+    """Runs Slack Web API calls (posting, updating and deleting thank you messages) in parallel.
+
+    All the workspaces share one bounded thread pool, and no workspace can run more than
+    max_concurrency_per_workspace calls at once, so a big fan-out in one workspace neither starves the others nor
+    hits its Slack rate limits much harder than sequential calls would. The calls must not use the Dao: blocks are
+    rendered and deliveries are stored by the caller thread.
+    """
+
+    def __init__(self, max_workers: int, max_concurrency_per_workspace: int):
+        self.max_concurrency_per_workspace = max_concurrency_per_workspace
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="slack-delivery")
+        self._workspace_semaphores: "WeakValueDictionary[str, BoundedSemaphore]" = WeakValueDictionary()
+        self._workspace_semaphores_lock = Lock()
+
+    def _workspace_semaphore(self, workspace_id: str) -> BoundedSemaphore:
+        with self._workspace_semaphores_lock:
+            semaphore = self._workspace_semaphores.get(workspace_id)
+            if semaphore is None:
+                semaphore = BoundedSemaphore(self.max_concurrency_per_workspace)
+                self._workspace_semaphores[workspace_id] = semaphore
+            return semaphore
+
+    @staticmethod
+    def _call(semaphore: BoundedSemaphore, call: Callable[[], T]) -> SlackCallResult[T]:
+        with semaphore:
+            try:
+                return SlackCallResult(response=call())
+            except Exception as e:
+                return SlackCallResult(error=e)
+
+    def run(self, workspace_id: str, calls: Sequence[Callable[[], T]]) -> List[SlackCallResult[T]]:
+        """Runs the calls and returns their results (a response or an exception) in the order of the calls"""
+        semaphore = self._workspace_semaphore(workspace_id)
+        if len(calls) <= 1:
+            return [self._call(semaphore, call) for call in calls]
+        futures = [self._executor.submit(self._call, semaphore, call) for call in calls]
+        return [future.result() for future in futures]
+
+
+slack_delivery_executor = SlackDeliveryExecutor(
+    max_workers=slack_delivery_max_workers(),
+    max_concurrency_per_workspace=slack_delivery_max_concurrency_per_workspace()
+)
@@ -1,7 +1,9 @@
+import asyncio
+from functools import partial
 from threading import Lock
 
 from thankyou.core.models import Employee
-from thankyou.dao import dao
+from thankyou.dao import dao, get_async_dao
 
 CREATE_EMPLOYEE_LOCK = Lock()
 
@@ -20,3 +22,13 @@ def get_or_create_employee_by_slack_user_id(company_uuid: str, slack_user_id: st
         )
         dao.create_employee(employee)
         return employee
+
+
+async def async_get_or_create_employee_by_slack_user_id(company_uuid: str, slack_user_id: str) -> Employee:
+    """`get_or_create_employee_by_slack_user_id` for the async app. The rare creation of a new employee runs in the
+    default executor"""
+    employee = await get_async_dao().read_employee_by_slack_id(company_uuid=company_uuid, slack_user_id=slack_user_id)
+    if employee is not None:
+        return employee
+    return await asyncio.get_event_loop().run_in_executor(
+        None, partial(get_or_create_employee_by_slack_user_id, company_uuid=company_uuid, slack_user_id=slack_user_id))
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import wraps
+from threading import BoundedSemaphore
+from timeit import default_timer as timer
+from typing import Callable
+
+from prometheus_client import Gauge, Histogram, Counter as PrometheusCounter
+from slack_bolt import App
+
+from thankyou.core.config import slack_listener_max_workers, slack_listener_max_queue_size, get_env
+from thankyou.dao import dao
+from thankyou.dao.instrumentation import count_handler_statements
+from thankyou.slackbot.handlers.registry import EventType, slack_handler_metric, events_counter, errors_counter, \
+    acting_slack_user_id
+
+
+listener_queue_depth_metric = Gauge(
+    name='slack_listener_queue_depth',
+    documentation='The number of listeners waiting for a thread of the listener executor',
+    labelnames=["executor"],
+    multiprocess_mode='livesum',
+)
+
+listener_time_in_queue_metric = Histogram(
+    name='slack_listener_time_in_queue',
+    documentation='Time a listener waits for a thread of the listener executor',
+    labelnames=["executor"],
+)
+
+listener_caller_runs_counter = PrometheusCounter(
+    name='slack_listener_number_of_caller_runs',
+    documentation='The total number of listeners run by the request thread because the executor queue was full',
+    labelnames=["executor"],
+)
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor with a bounded queue which reports its depth and the time tasks spend in it.
+
+    When max_workers tasks are running and max_queue_size tasks are waiting, a new task is run by the submitting
+    thread, so under overload Slack requests are handled synchronously (as without lazy listeners) instead of piling
+    up in memory.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_size: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self._slots = BoundedSemaphore(max_workers + max_queue_size)
+        self._queue_depth = listener_queue_depth_metric.labels(name)
+        self._time_in_queue = listener_time_in_queue_metric.labels(name)
+        self._caller_runs = listener_caller_runs_counter.labels(name)
+
+    def _run_in_caller_thread(self, fn, *args, **kwargs) -> Future:
+        self._caller_runs.inc()
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            return self._run_in_caller_thread(fn, *args, **kwargs)
+
+        enqueued_at = timer()
+
+        def run():
+            self._queue_depth.dec()
+            self._time_in_queue.observe(timer() - enqueued_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._slots.release()
+
+        self._queue_depth.inc()
+        try:
+            return super().submit(run)
+        except BaseException:
+            self._queue_depth.dec()
+            self._slots.release()
+            raise
+
+
+listener_executor = InstrumentedThreadPoolExecutor(
+    name="slack-listener",
+    max_workers=slack_listener_max_workers(),
+    max_queue_size=slack_listener_max_queue_size(),
+)
+
+
+def _ack_right_away(ack):
+    ack()
+
+
+def register_slack_listener(app: App, event_type: EventType, name: str, func: Callable, lazy: bool = False) -> Callable:
+    """Registers a handler on the app, see app_event()"""
+    metric_wrapper = slack_handler_metric.labels(func.__name__, event_type.value, get_env().name.lower())
+
+    if event_type == EventType.Event:
+        app_wrapper = app.event
+    elif event_type == EventType.Action:
+        app_wrapper = app.action
+    elif event_type == EventType.View:
+        app_wrapper = app.view
+    elif event_type == EventType.Command:
+        app_wrapper = app.command
+    elif event_type == EventType.Shortcut:
+        app_wrapper = app.shortcut
+    else:
+        raise ValueError(f"Unknown EventType: {event_type}")
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = timer()
+        try:
+            # Every DAO call the handler makes is committed once, when the handler returns. The handler makes
+            # its Slack calls before its first write or after the commit (see Dao.call_after_commit()), so the
+            # transaction holds no locks while they wait for Slack
+            with count_handler_statements(func.__name__), dao.on_behalf_of(acting_slack_user_id(kwargs)), \
+                    dao.transaction():
+                return func(*args, **kwargs)
+        except Exception:
+            errors_counter.inc(1)
+            raise
+        finally:
+            # logger.info(f"Sending metrics for {func.__name__}")
+            events_counter.inc(1)
+            metric_wrapper.observe(timer() - start)
+
+    if lazy:
+        app_wrapper(name)(ack=_ack_right_away, lazy=[wrapper])
+    else:
+        app_wrapper(name)(wrapper)
+    return wrapper
@@ -1,13 +1,22 @@
+import asyncio
 import logging
+from functools import partial
+from typing import Optional, TYPE_CHECKING
 
 from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk.oauth import InstallationStore, OAuthStateStore
+from slack_sdk.oauth.installation_store.async_installation_store import AsyncInstallationStore
 from slack_sdk.oauth.installation_store.sqlalchemy import SQLAlchemyInstallationStore
+from slack_sdk.oauth.state_store.async_state_store import AsyncOAuthStateStore
 from slack_sdk.oauth.state_store.sqlalchemy import SQLAlchemyOAuthStateStore
 
 from thankyou.core.config import slack_client_id, slack_client_secret, required_slack_app_permissions
 from thankyou.dao import dao
 from thankyou.dao.sqlalchemy import SQLAlchemyDao
 
+if TYPE_CHECKING:
+    from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+
 
 def get_installation_store(client_id: str):
     if isinstance(dao, SQLAlchemyDao):
@@ -51,3 +60,72 @@ if slack_client_id() and slack_client_secret():
         state_store=get_oauth_state_store(),
         install_page_rendering_enabled=False
     )
+
+
+async def _run_in_executor(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+
+class ExecutorAsyncInstallationStore(AsyncInstallationStore):
+    """Lets the async app use a blocking InstallationStore: its methods run in the default executor"""
+
+    def __init__(self, installation_store: InstallationStore):
+        self.installation_store = installation_store
+
+    @property
+    def logger(self) -> logging.Logger:
+        return self.installation_store.logger
+
+    async def async_save(self, installation):
+        return await _run_in_executor(self.installation_store.save, installation)
+
+    async def async_save_bot(self, bot):
+        return await _run_in_executor(self.installation_store.save_bot, bot)
+
+    async def async_find_bot(self, **kwargs):
+        return await _run_in_executor(self.installation_store.find_bot, **kwargs)
+
+    async def async_find_installation(self, **kwargs):
+        return await _run_in_executor(self.installation_store.find_installation, **kwargs)
+
+    async def async_delete_bot(self, **kwargs):
+        return await _run_in_executor(self.installation_store.delete_bot, **kwargs)
+
+    async def async_delete_installation(self, **kwargs):
+        return await _run_in_executor(self.installation_store.delete_installation, **kwargs)
+
+    async def async_delete_all(self, **kwargs):
+        return await _run_in_executor(self.installation_store.delete_all, **kwargs)
+
+
+class ExecutorAsyncOAuthStateStore(AsyncOAuthStateStore):
+    """Lets the async app use a blocking OAuthStateStore: its methods run in the default executor"""
+
+    def __init__(self, state_store: OAuthStateStore):
+        self.state_store = state_store
+
+    @property
+    def logger(self) -> logging.Logger:
+        return self.state_store.logger
+
+    async def async_issue(self, *args, **kwargs) -> str:
+        return await _run_in_executor(self.state_store.issue, *args, **kwargs)
+
+    async def async_consume(self, state: str) -> bool:
+        return await _run_in_executor(self.state_store.consume, state)
+
+
+def create_async_oauth_settings() -> Optional["AsyncOAuthSettings"]:
+    """The OAuth settings of the async app, None if OAuth is not configured. It shares the stores of oauth_settings"""
+    if oauth_settings is None:
+        return None
+
+    from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+    return AsyncOAuthSettings(
+        client_id=oauth_settings.client_id,
+        client_secret=oauth_settings.client_secret,
+        scopes=oauth_settings.scopes,
+        installation_store=ExecutorAsyncInstallationStore(oauth_settings.installation_store),
+        state_store=ExecutorAsyncOAuthStateStore(oauth_settings.state_store),
+        install_page_rendering_enabled=False
+    )
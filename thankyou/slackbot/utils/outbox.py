@@ -0,0 +1,200 @@
+from dataclasses import dataclass, field
+from typing import List, Iterable
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from thankyou.core.models import ThankYouMessage, SlackDeliveryOutboxItem, SlackDeliveryOutboxItemKind, \
+    ThankYouMessageSlackDelivery, Slack_Channel_ID_Type, Slack_User_ID_Type
+from thankyou.slackbot.blocks.thank_you import thank_you_message_blocks
+from thankyou.slackbot.handlers.common import already_invited_to_a_channel
+from thankyou.slackbot.utils.delivery import slack_api_error_code
+
+
+# Errors after which the same Slack call may succeed later
+RETRYABLE_SLACK_API_ERRORS = {"ratelimited", "internal_error", "fatal_error", "service_unavailable",
+                              "request_timeout"}
+
+
+@dataclass
+class SlackDeliveryOutcome:
+    slack_deliveries: List[ThankYouMessageSlackDelivery] = field(default_factory=list)
+    # Deliveries which have to be made because this one has failed (e.g. direct messages instead of a channel)
+    follow_up_items: List[SlackDeliveryOutboxItem] = field(default_factory=list)
+
+
+def is_retryable_slack_delivery_error(error: Exception) -> bool:
+    if isinstance(error, SlackApiError):
+        return slack_api_error_code(error) in RETRYABLE_SLACK_API_ERRORS
+    return True  # Connection errors, timeouts...
+
+
+def _outbox_item(thank_you_message: ThankYouMessage, kind: SlackDeliveryOutboxItemKind,
+                 slack_channel_id: Slack_Channel_ID_Type = "", slack_user_id: Slack_User_ID_Type = "") \
+        -> SlackDeliveryOutboxItem:
+    return SlackDeliveryOutboxItem(
+        thank_you_message_uuid=thank_you_message.uuid,
+        company_uuid=thank_you_message.company.uuid,
+        kind=kind,
+        slack_channel_id=slack_channel_id,
+        slack_user_id=slack_user_id,
+    )
+
+
+def _channel_items(thank_you_message: ThankYouMessage, channel: Slack_Channel_ID_Type) \
+        -> List[SlackDeliveryOutboxItem]:
+    if not thank_you_message.is_private:
+        return [_outbox_item(thank_you_message, SlackDeliveryOutboxItemKind.CHANNEL_MESSAGE, slack_channel_id=channel)]
+    slack_user_ids = set([r.slack_user_id for r in thank_you_message.receivers]
+                         + [thank_you_message.author_slack_user_id])
+    return [_outbox_item(thank_you_message, SlackDeliveryOutboxItemKind.EPHEMERAL_MESSAGE, slack_channel_id=channel,
+                         slack_user_id=slack_user_id)
+            for slack_user_id in sorted(slack_user_ids)]
+
+
+def _direct_message_items(thank_you_message: ThankYouMessage, slack_user_ids: Iterable[Slack_User_ID_Type]) \
+        -> List[SlackDeliveryOutboxItem]:
+    return [_outbox_item(thank_you_message, SlackDeliveryOutboxItemKind.DIRECT_MESSAGE, slack_user_id=slack_user_id)
+            for slack_user_id in sorted(set(slack_user_ids))]
+
+
+def _channel_not_found_items(thank_you_message: ThankYouMessage) -> List[SlackDeliveryOutboxItem]:
+    """The application is not in the channel the slash command was typed in: the author is told about it and the
+    receivers get the message directly"""
+    return [
+        _outbox_item(thank_you_message, SlackDeliveryOutboxItemKind.NOT_DELIVERED_TO_CHANNEL_NOTICE,
+                     slack_user_id=thank_you_message.author_slack_user_id),
+        *_direct_message_items(thank_you_message, [r.slack_user_id for r in thank_you_message.receivers])
+    ]
+
+
+def initial_slack_delivery_outbox_items(thank_you_message: ThankYouMessage) -> List[SlackDeliveryOutboxItem]:
+    """The deliveries of a new thank you message. They follow the same rules as the inline delivery in
+    thank_you_dialog_save_button_clicked_action_handler"""
+    company = thank_you_message.company
+    if thank_you_message.slash_command_slack_channel_id:
+        return _channel_items(thank_you_message, thank_you_message.slash_command_slack_channel_id)
+    if company.enable_sharing_in_a_slack_channel and company.share_messages_in_slack_channel:
+        return [_outbox_item(thank_you_message, SlackDeliveryOutboxItemKind.INVITE_RECEIVERS_TO_CHANNEL,
+                             slack_channel_id=company.share_messages_in_slack_channel)]
+    return _direct_message_items(thank_you_message, [r.slack_user_id for r in thank_you_message.receivers])
+
+
+def _message_ts(response: SlackResponse) -> str:
+    if "ts" in response.data:
+        return response.data["ts"]
+    return response.data["message_ts"]
+
+
+def _invite_receivers(client: WebClient, item: SlackDeliveryOutboxItem, thank_you_message: ThankYouMessage, logger):
+    def invite_users():
+        slack_user_ids = [r.slack_user_id for r in thank_you_message.receivers
+                          if not already_invited_to_a_channel(company_id=item.company_uuid,
+                                                              channel=item.slack_channel_id,
+                                                              user_id=r.slack_user_id)]
+        if slack_user_ids:
+            client.conversations_invite(channel=item.slack_channel_id, users=slack_user_ids, force=True)
+
+    try:
+        invite_users()
+    except SlackApiError as e:
+        if slack_api_error_code(e) == "not_in_channel":
+            try:
+                client.conversations_join(channel=item.slack_channel_id)
+                invite_users()
+            except SlackApiError as e2:
+                logger.error(f"Could not join the {item.slack_channel_id} slack channel. "
+                             f"Or couldn't invite users to it: {e2}")
+        else:
+            logger.warning(f"Could not invite users to the {item.slack_channel_id} slack channel. Error: {e}")
+
+
+def deliver_slack_delivery_outbox_item(client: WebClient, item: SlackDeliveryOutboxItem,
+                                       thank_you_message: ThankYouMessage, logger) -> SlackDeliveryOutcome:
+    """Makes the Slack calls of an outbox item. Raises an exception if the item has to be retried (or given up on,
+    see is_retryable_slack_delivery_error). Must not use the Dao: it is called by the threads of the delivery
+    executor"""
+    is_slash_command_channel = item.slack_channel_id == thank_you_message.slash_command_slack_channel_id
+    show_say_thank_you_button = thank_you_message.author_slack_user_id in [r.slack_user_id
+                                                                            for r in thank_you_message.receivers]
+
+    def slack_delivery(response: SlackResponse, channel: str, is_direct_message: bool, is_ephemeral_message: bool):
+        return ThankYouMessageSlackDelivery(
+            thank_you_message_uuid=thank_you_message.uuid,
+            slack_channel_id=channel,
+            message_ts=_message_ts(response),
+            is_direct_message=is_direct_message,
+            is_ephemeral_message=is_ephemeral_message,
+        )
+
+    if item.kind == SlackDeliveryOutboxItemKind.INVITE_RECEIVERS_TO_CHANNEL:
+        _invite_receivers(client, item, thank_you_message, logger)
+        return SlackDeliveryOutcome(follow_up_items=_channel_items(thank_you_message, item.slack_channel_id))
+
+    if item.kind == SlackDeliveryOutboxItemKind.CHANNEL_MESSAGE:
+        try:
+            response = client.chat_postMessage(
+                channel=item.slack_channel_id,
+                blocks=thank_you_message_blocks(thank_you_message),
+                unfurl_links=False,
+                unfurl_media=False,
+            )
+        except SlackApiError as e:
+            if is_slash_command_channel and slack_api_error_code(e) == "channel_not_found":
+                return SlackDeliveryOutcome(follow_up_items=_channel_not_found_items(thank_you_message))
+            raise
+        return SlackDeliveryOutcome(slack_deliveries=[
+            slack_delivery(response, item.slack_channel_id, is_direct_message=False, is_ephemeral_message=False)
+        ])
+
+    if item.kind == SlackDeliveryOutboxItemKind.EPHEMERAL_MESSAGE:
+        try:
+            response = client.chat_postEphemeral(
+                user=item.slack_user_id,
+                channel=item.slack_channel_id,
+                blocks=thank_you_message_blocks(thank_you_message,
+                                                show_say_thank_you_button=show_say_thank_you_button),
+                unfurl_links=False,
+                unfurl_media=False,
+            )
+        except SlackApiError as e:
+            if slack_api_error_code(e) == "user_not_in_channel":
+                return SlackDeliveryOutcome(follow_up_items=_direct_message_items(thank_you_message,
+                                                                                  [item.slack_user_id]))
+            if is_slash_command_channel and slack_api_error_code(e) == "channel_not_found":
+                return SlackDeliveryOutcome(follow_up_items=_channel_not_found_items(thank_you_message))
+            raise
+        return SlackDeliveryOutcome(slack_deliveries=[
+            slack_delivery(response, item.slack_channel_id, is_direct_message=False, is_ephemeral_message=True)
+        ])
+
+    if item.kind == SlackDeliveryOutboxItemKind.DIRECT_MESSAGE:
+        response = client.chat_postMessage(
+            text="You received a Thank You message!",
+            channel=item.slack_user_id,
+            blocks=thank_you_message_blocks(thank_you_message, show_say_thank_you_button=show_say_thank_you_button),
+            unfurl_links=False,
+            unfurl_media=False,
+        )
+        return SlackDeliveryOutcome(slack_deliveries=[
+            slack_delivery(response, item.slack_user_id, is_direct_message=True, is_ephemeral_message=True)
+        ])
+
+    if item.kind == SlackDeliveryOutboxItemKind.NOT_DELIVERED_TO_CHANNEL_NOTICE:
+        response = client.chat_postMessage(
+            text=f"Your thank you message could not be "
+                 f"delivered to the Slack channel "
+                 f"<#{thank_you_message.slash_command_slack_channel_id}>. "
+                 f"Are you sure that the {thank_you_message.company.merci_app_name} application was invited "
+                 f"to this channel? "
+                 f"We will deliver your message directly to the receivers",
+            channel=item.slack_user_id,
+            unfurl_links=False,
+            unfurl_media=False,
+        )
+        return SlackDeliveryOutcome(slack_deliveries=[
+            slack_delivery(response, item.slack_user_id, is_direct_message=True, is_ephemeral_message=False)
+        ])
+
+    raise ValueError(f"Unknown Slack delivery outbox item kind: {item.kind}")
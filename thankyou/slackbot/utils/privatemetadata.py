@@ -1,5 +1,7 @@
 import json
 import os
+from datetime import datetime
+from typing import Optional, Tuple
 from urllib.parse import urlparse
 
 from thankyou.core.models import ThankYouMessage, ThankYouReceiver, ThankYouMessageImage
@@ -7,12 +9,30 @@ from thankyou.dao import dao
 from thankyou.slackbot.utils.company import get_or_create_company_by_body
 
 
+def thank_you_messages_cursor_as_str(cursor: Optional[Tuple[datetime, str]]) -> Optional[str]:
+    if cursor is None:
+        return None
+    created_at, uuid = cursor
+    return f"{created_at.isoformat()}/{uuid}"
+
+
+def thank_you_messages_cursor_from_str(s: Optional[str]) -> Optional[Tuple[datetime, str]]:
+    if not s:
+        return None
+    try:
+        created_at, uuid = s.split("/", 1)
+        return datetime.fromisoformat(created_at), uuid
+    except ValueError:
+        return None
+
+
 class PrivateMetadata:
     def __init__(self, thank_you_message_uuid: str = None, thank_you_type_uuid: str = None,
-                 slash_command_slack_channel_id: str = None):
+                 slash_command_slack_channel_id: str = None, thank_you_messages_cursor: str = None):
         self.thank_you_message_uuid = thank_you_message_uuid
         self.thank_you_type_uuid = thank_you_type_uuid
         self.slash_command_slack_channel_id = slash_command_slack_channel_id
+        self.thank_you_messages_cursor = thank_you_messages_cursor
 
     def __str__(self):
         return self.as_str()
@@ -23,6 +43,7 @@ class PrivateMetadata:
             "thank_you_message_uuid": self.thank_you_message_uuid,
             "thank_you_type_uuid": self.thank_you_type_uuid,
             "slash_command_slack_channel_id": self.slash_command_slack_channel_id,
+            "thank_you_messages_cursor": self.thank_you_messages_cursor,
         }.items():
             if value is not None:
                 result[key] = value
@@ -36,7 +57,8 @@ class PrivateMetadata:
         return PrivateMetadata(
             thank_you_message_uuid=d.get("thank_you_message_uuid"),
             thank_you_type_uuid=d.get("thank_you_type_uuid"),
-            slash_command_slack_channel_id=d.get("slash_command_slack_channel_id")
+            slash_command_slack_channel_id=d.get("slash_command_slack_channel_id"),
+            thank_you_messages_cursor=d.get("thank_you_messages_cursor")
         )
 
 
@@ -80,11 +102,10 @@ def retrieve_thank_you_message_from_body(body) -> ThankYouMessage:
     if private_metadata and private_metadata.slash_command_slack_channel_id:
         kwargs["slash_command_slack_channel_id"] = private_metadata.slash_command_slack_channel_id
 
-    slack_team_id = body["team"]["id"]
-    try:
-        company = dao.read_companies(slack_team_id=slack_team_id)[0]
-    except IndexError:
-        raise IndexError(f"Can not find company with slack_team_id = {slack_team_id}")
+    # The message is going to be stored, so it needs the company from the database, not a cached snapshot
+    company = dao.read_company(company_uuid=company_uuid)
+    if company is None:
+        raise IndexError(f"Can not find company with uuid = {company_uuid}")
 
     receivers = [ThankYouReceiver(slack_user_id=receiver_slack_id)
                  for receiver_slack_id in values["thank_you_dialog_receivers_block"][
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from enum import Enum
+from functools import partial
+from typing import Optional, Union
+
+from prometheus_client import Histogram, Counter as PrometheusCounter
+from slack_sdk import WebClient
+from slack_sdk.http_retry import RateLimitErrorRetryHandler, RetryState, HttpRequest, HttpResponse
+from slack_sdk.http_retry.builtin_async_handlers import AsyncRateLimitErrorRetryHandler
+from slack_sdk.web import SlackResponse
+from slack_sdk.web.async_client import AsyncWebClient, AsyncSlackResponse
+
+from thankyou.core.config import slack_rate_limit_max_wait_seconds, slack_rate_limit_max_retries
+from thankyou.utils.ratelimit import TokenBucketStore, default_token_bucket_store
+
+
+slack_api_throttle_wait_metric = Histogram(
+    name='slack_api_throttle_wait_time',
+    documentation='Time spent waiting for a Slack Web API rate limit token before a call',
+    labelnames=["tier"],
+)
+
+slack_api_rate_limited_counter = PrometheusCounter(
+    name='slack_api_number_of_rate_limited_responses',
+    documentation='The total number of HTTP 429 responses received from the Slack Web API',
+    labelnames=["api_method"],
+)
+
+
+class SlackApiTier(Enum):
+    """Slack Web API rate limit tiers, https://api.slack.com/docs/rate-limits. The value is calls per minute"""
+    TIER_1 = 1
+    TIER_2 = 20
+    TIER_3 = 50
+    TIER_4 = 100
+    POST_MESSAGE = 60  # chat.postMessage has a special limit: about 1 message per second per channel
+
+    @property
+    def is_per_channel(self) -> bool:
+        return self is SlackApiTier.POST_MESSAGE
+
+
+_API_METHOD_TIERS = {
+    "chat.postMessage": SlackApiTier.POST_MESSAGE,
+    "chat.postEphemeral": SlackApiTier.TIER_4,
+    "chat.update": SlackApiTier.TIER_3,
+    "chat.delete": SlackApiTier.TIER_3,
+    "conversations.invite": SlackApiTier.TIER_3,
+    "conversations.join": SlackApiTier.TIER_3,
+    "users.info": SlackApiTier.TIER_4,
+    "views.open": SlackApiTier.TIER_4,
+    "views.publish": SlackApiTier.TIER_4,
+    "views.push": SlackApiTier.TIER_4,
+    "views.update": SlackApiTier.TIER_4,
+}
+
+# Methods which are not limited by a tier
+_NOT_LIMITED_API_METHODS = {"auth.test", "oauth.v2.access"}
+
+# Methods which take a trigger_id. It expires 3 seconds after the user action, so these calls never wait longer than
+# _TRIGGER_ID_MAX_WAIT_SECONDS for a token: they are made right away instead, and are retried after a 429
+_TRIGGER_ID_API_METHODS = {"views.open", "views.push"}
+_TRIGGER_ID_MAX_WAIT_SECONDS = 1.0
+
+
+def api_method_tier(api_method: str) -> SlackApiTier:
+    return _API_METHOD_TIERS.get(api_method, SlackApiTier.TIER_3)
+
+
+class CountingRateLimitErrorRetryHandler(RateLimitErrorRetryHandler):
+    """Retries rate limited calls after the Retry-After delay and counts every 429 response"""
+
+    def can_retry(self, *, state: RetryState, request: HttpRequest, response: Optional[HttpResponse] = None,
+                  error: Optional[Exception] = None) -> bool:
+        if response is not None and response.status_code == 429:
+            slack_api_rate_limited_counter.labels(request.url.rsplit("/", 1)[-1]).inc()
+        return super().can_retry(state=state, request=request, response=response, error=error)
+
+
+def _api_call_channel(api_call_kwargs: dict) -> Optional[str]:
+    for arguments in (api_call_kwargs.get("json"), api_call_kwargs.get("params"), api_call_kwargs.get("data")):
+        if isinstance(arguments, dict) and arguments.get("channel"):
+            return arguments["channel"]
+    return None
+
+
+def _reserve_slack_api_call(token_bucket_store: TokenBucketStore, team_id: Optional[str], api_method: str,
+                            max_wait_seconds: float, channel: Optional[str] = None) -> float:
+    """Takes a token from the (team_id, tier) bucket, or the (team_id, tier, channel) one for the tiers limited per
+    channel, and returns how many seconds the call must wait"""
+    if api_method in _NOT_LIMITED_API_METHODS:
+        return 0
+    if api_method in _TRIGGER_ID_API_METHODS:
+        max_wait_seconds = min(max_wait_seconds, _TRIGGER_ID_MAX_WAIT_SECONDS)
+    tier = api_method_tier(api_method)
+    rate_per_second = tier.value / 60
+    key = f"slack:{team_id or '-'}:{tier.name}"
+    if tier.is_per_channel:
+        key += f":{channel or '-'}"
+    wait_seconds = token_bucket_store.reserve(
+        key=key,
+        rate_per_second=rate_per_second,
+        capacity=max(1.0, rate_per_second * 10),  # Allow bursts of 10 seconds worth of calls
+        max_wait_seconds=max_wait_seconds,
+    )
+    slack_api_throttle_wait_metric.labels(tier.name).observe(wait_seconds or 0)
+    return wait_seconds or 0
+
+
+class RateLimitedWebClient(WebClient):
+    """A WebClient which takes a token from the (team_id, tier) bucket before every API call.
+
+    The buckets are shared between processes when the shared cache backend is configured. A call which would have to
+    wait longer than max_wait_seconds is made right away: Slack may answer with a 429 then, and the call is retried
+    after the Retry-After delay by CountingRateLimitErrorRetryHandler.
+    """
+
+    def __init__(self, *args, token_bucket_store: TokenBucketStore = None, max_wait_seconds: float = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_bucket_store = token_bucket_store or default_token_bucket_store()
+        self.max_wait_seconds = slack_rate_limit_max_wait_seconds() if max_wait_seconds is None else max_wait_seconds
+        if not any(isinstance(handler, RateLimitErrorRetryHandler) for handler in self.retry_handlers):
+            self.retry_handlers.append(CountingRateLimitErrorRetryHandler(
+                max_retry_count=slack_rate_limit_max_retries()))
+
+    def api_call(self, api_method: str, **kwargs) -> SlackResponse:
+        wait_seconds = _reserve_slack_api_call(self.token_bucket_store, self.default_params.get("team_id"),
+                                               api_method, self.max_wait_seconds, _api_call_channel(kwargs))
+        if wait_seconds:
+            time.sleep(wait_seconds)
+        return super().api_call(api_method, **kwargs)
+
+
+def rate_limited_web_client(client: Union[WebClient, AsyncWebClient]) -> RateLimitedWebClient:
+    """A RateLimitedWebClient with the settings (token, team, retry handlers...) of the client. The retry handlers
+    of an AsyncWebClient can not be used by a WebClient, the default ones are used instead"""
+    return RateLimitedWebClient(
+        token=client.token,
+        base_url=client.base_url,
+        timeout=client.timeout,
+        ssl=client.ssl,
+        proxy=client.proxy,
+        headers=client.headers,
+        team_id=client.default_params.get("team_id"),
+        retry_handlers=(client.retry_handlers.copy()
+                        if isinstance(client, WebClient) and client.retry_handlers is not None else None),
+    )
+
+
+class AsyncCountingRateLimitErrorRetryHandler(AsyncRateLimitErrorRetryHandler):
+    """CountingRateLimitErrorRetryHandler for AsyncWebClient"""
+
+    async def can_retry_async(self, *, state: RetryState, request: HttpRequest,
+                              response: Optional[HttpResponse] = None, error: Optional[Exception] = None) -> bool:
+        if response is not None and response.status_code == 429:
+            slack_api_rate_limited_counter.labels(request.url.rsplit("/", 1)[-1]).inc()
+        return await super().can_retry_async(state=state, request=request, response=response, error=error)
+
+
+class AsyncRateLimitedWebClient(AsyncWebClient):
+    """RateLimitedWebClient for the async app: it waits for a rate limit token without blocking the event loop"""
+
+    def __init__(self, *args, token_bucket_store: TokenBucketStore = None, max_wait_seconds: float = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token_bucket_store = token_bucket_store or default_token_bucket_store()
+        self.max_wait_seconds = slack_rate_limit_max_wait_seconds() if max_wait_seconds is None else max_wait_seconds
+        if not any(isinstance(handler, AsyncRateLimitErrorRetryHandler) for handler in self.retry_handlers):
+            self.retry_handlers.append(AsyncCountingRateLimitErrorRetryHandler(
+                max_retry_count=slack_rate_limit_max_retries()))
+
+    async def api_call(self, api_method: str, **kwargs) -> AsyncSlackResponse:
+        # The token bucket store can be a SQLite file: the reservation runs in the default executor
+        wait_seconds = await asyncio.get_event_loop().run_in_executor(None, partial(
+            _reserve_slack_api_call, self.token_bucket_store, self.default_params.get("team_id"), api_method,
+            self.max_wait_seconds, _api_call_channel(kwargs)))
+        if wait_seconds:
+            await asyncio.sleep(wait_seconds)
+        return await super().api_call(api_method, **kwargs)
+
+
+def async_rate_limited_web_client(client: AsyncWebClient) -> AsyncRateLimitedWebClient:
+    """An AsyncRateLimitedWebClient with the settings (token, team, HTTP session, retry handlers...) of the client"""
+    return AsyncRateLimitedWebClient(
+        token=client.token,
+        base_url=client.base_url,
+        timeout=client.timeout,
+        ssl=client.ssl,
+        proxy=client.proxy,
+        session=client.session,
+        headers=client.headers,
+        team_id=client.default_params.get("team_id"),
+        retry_handlers=client.retry_handlers.copy() if client.retry_handlers is not None else None,
+    )
@@ -2,8 +2,10 @@ from flask import Flask, request, Response
 from prometheus_client import CollectorRegistry, multiprocess, generate_latest, CONTENT_TYPE_LATEST
 from slack_bolt.adapter.flask import SlackRequestHandler
 
+from thankyou.core.config import slack_signing_secret
 from thankyou.dao import dao
 from thankyou.slackbot.utils.app import app
+from thankyou.slackbot.utils.dedup import SlackRequestDeduplicator
 from thankyou.slackbot.utils.pages.installbutton import build_default_install_page_html
 from thankyou.slackbot.utils.pages.privacy import privacy_page_html
 from thankyou.slackbot.utils.pages.termsofservice import terms_of_service
@@ -13,6 +15,7 @@ from thankyou.utils.flask import flask_scoped_session
 def create_flask_app(slack_app_):
     flask_app = Flask(__name__)
     slack_handler = SlackRequestHandler(slack_app_)
+    deduplicator = SlackRequestDeduplicator(slack_signing_secret())
 
     dao.set_scoped_session(flask_scoped_session(dao.session_maker, flask_app))
 
@@ -34,7 +37,12 @@ def create_flask_app(slack_app_):
 
     @flask_app.route("/slack/events", methods=["POST"])
     def slack_events():
-        return slack_handler.handle(request)
+        # Slack retries slow requests: every event and view submission is processed once
+        return deduplicator.handle(
+            body=request.get_data(as_text=True),
+            headers=request.headers,
+            handler=lambda: slack_handler.handle(request)
+        )
 
     @flask_app.route("/slack/install_button", methods=["GET"])
     def install_button():
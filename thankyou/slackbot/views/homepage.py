@@ -1,38 +1,72 @@
-from datetime import date
-from typing import List, Tuple
-
-from slack_sdk.models.blocks import DividerBlock, SectionBlock
-from slack_sdk.models.views import View
+from datetime import date, datetime
+from typing import List, Tuple, Optional
 
 from thankyou.core.models import ThankYouMessage, ThankYouType, Slack_User_ID_Type
-from thankyou.slackbot.blocks.homepage import home_page_actions_block, thank_you_list_blocks, home_page_leaders_block, \
-    home_page_show_leaders_button_block, home_page_hidden_messages_warn_block, home_page_welcome_blocks
+from thankyou.slackbot.blocks.builders import divider_block, section_block, home_view
+from thankyou.slackbot.blocks.homepage import home_page_actions_block, home_page_leaders_block, \
+    home_page_show_leaders_button_block, home_page_hidden_messages_warn_block, home_page_welcome_blocks, \
+    thank_you_list_page_blocks, home_page_load_older_messages_button_block
+from thankyou.slackbot.utils.privatemetadata import PrivateMetadata, thank_you_messages_cursor_as_str
 
 
 MAX_BLOCKS_IN_A_VIEW = 100
 
 
+def _thank_you_list_page(blocks_before: list, thank_you_messages: List[ThankYouMessage], current_user_slack_id: str,
+                         older_messages_cursor: Optional[Tuple[datetime, str]], load_older_action_id: str,
+                         accessory_action_id: str = None) -> Tuple[list, str]:
+    """Renders as many messages as fit into a view (at least one, so that "Load older" always moves forward), followed
+    by a "Load older" button if there are messages left. Returns the blocks and the private metadata pointing at the
+    last rendered message"""
+    list_blocks, rendered_messages_num = thank_you_list_page_blocks(
+        thank_you_messages,
+        current_user_slack_id=current_user_slack_id,
+        accessory_action_id=accessory_action_id,
+        blocks_num_limit=MAX_BLOCKS_IN_A_VIEW - len(blocks_before) - 1,
+        min_messages_num=1
+    )
+    if rendered_messages_num < len(thank_you_messages):
+        last_message = thank_you_messages[rendered_messages_num - 1]
+        older_messages_cursor = (last_message.created_at, last_message.uuid)
+
+    if older_messages_cursor:
+        list_blocks.append(home_page_load_older_messages_button_block(load_older_action_id))
+
+    private_metadata = PrivateMetadata(
+        thank_you_messages_cursor=thank_you_messages_cursor_as_str(older_messages_cursor)
+    ).as_str()
+    return list_blocks, private_metadata
+
+
 def home_page_my_thank_yous_view(
         thank_you_messages: List[ThankYouMessage],
-        current_user_slack_id: str = None
-):
+        current_user_slack_id: str = None,
+        older_messages_cursor: Tuple[datetime, str] = None
+) -> dict:
     blocks = [
         home_page_actions_block(selected="my_thank_yous"),
-        DividerBlock(),
-        *([] if thank_you_messages else [SectionBlock(
+        divider_block(),
+        *([] if thank_you_messages else [section_block(
             text="It seems you haven't sent or received a thank you message yet :( "
                  "Why don't you send your first message right now? Just click the \"Send Thank you!\" "
                  "button and write a few kind words to your colleague(s)"
         )])
     ]
 
-    return View(
-        type="home",
+    list_blocks, private_metadata = _thank_you_list_page(
+        blocks_before=blocks,
+        thank_you_messages=thank_you_messages,
+        current_user_slack_id=current_user_slack_id,
+        older_messages_cursor=older_messages_cursor,
+        load_older_action_id="home_page_my_thank_yous_load_older_button_clicked"
+    )
+
+    return home_view(
         title="Welcome to Chirik Bot!",
+        private_metadata=private_metadata,
         blocks=[
             *blocks,
-            *thank_you_list_blocks(thank_you_messages, current_user_slack_id=current_user_slack_id,
-                                   blocks_num_limit=MAX_BLOCKS_IN_A_VIEW - len(blocks))
+            *list_blocks
         ]
     )
 
@@ -45,8 +79,9 @@ def home_page_company_thank_yous_view(thank_you_messages: List[ThankYouMessage],
                                       leaders_stats_from_date: date = None, leaders_stats_until_date: date = None,
                                       current_user_slack_id: str = None, enable_leaderboard: bool = True,
                                       slack_channel_with_all_messages: str = None, hidden_messages_num: int = None,
-                                      show_welcome_message: bool = False
-                                      ):
+                                      show_welcome_message: bool = False,
+                                      older_messages_cursor: Tuple[datetime, str] = None
+                                      ) -> dict:
     leaders_blocks = []
     if sender_leaders and receiver_leaders:
         leaders_blocks.append(home_page_leaders_block(
@@ -65,20 +100,26 @@ def home_page_company_thank_yous_view(thank_you_messages: List[ThankYouMessage],
 
     blocks = [
         home_page_actions_block(selected="company_thank_yous"),
-        DividerBlock(),
-        *([] if not show_welcome_message else [*home_page_welcome_blocks(app_name), DividerBlock()]),
+        divider_block(),
+        *([] if not show_welcome_message else [*home_page_welcome_blocks(app_name), divider_block()]),
         *leaders_blocks,
         *([] if not hidden_messages_block else [hidden_messages_block])
     ]
 
-    return View(
-        type="home",
+    list_blocks, private_metadata = _thank_you_list_page(
+        blocks_before=blocks,
+        thank_you_messages=thank_you_messages,
+        current_user_slack_id=current_user_slack_id,
+        older_messages_cursor=older_messages_cursor,
+        load_older_action_id="home_page_company_thank_yous_load_older_button_clicked",
+        accessory_action_id="company_thank_yous_message_menu_button_clicked"
+    )
+
+    return home_view(
         title="Say Thank You :)",
+        private_metadata=private_metadata,
         blocks=[
             *blocks,
-            *thank_you_list_blocks(thank_you_messages,
-                                   current_user_slack_id=current_user_slack_id,
-                                   accessory_action_id="company_thank_yous_message_menu_button_clicked",
-                                   blocks_num_limit=MAX_BLOCKS_IN_A_VIEW - len(blocks))
+            *list_blocks
         ]
     )
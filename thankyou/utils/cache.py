@@ -0,0 +1,426 @@
+import asyncio
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from dataclasses import fields, is_dataclass
+from datetime import date, datetime
+from enum import Enum
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+from prometheus_client import Counter as PrometheusCounter
+
+from thankyou.core.config import get_cache_backend_type, CacheBackendType, shared_cache_sqlite_file
+
+
+cache_hits_counter = PrometheusCounter(
+    name='cache_number_of_hits',
+    documentation='The total number of cache lookups which found a value',
+    labelnames=["cache"],
+)
+
+cache_misses_counter = PrometheusCounter(
+    name='cache_number_of_misses',
+    documentation='The total number of cache lookups which did not find a value',
+    labelnames=["cache"],
+)
+
+
+def connect_shared_sqlite_file(filename: str, busy_timeout_seconds: float) -> sqlite3.Connection:
+    """Opens the SQLite file shared by the processes of a host. Its values are trusted (e.g. the roles of Slack users),
+    so the file is created readable and writable by its owner only, and a symbolic link or a file of another user is
+    refused"""
+    folder = os.path.dirname(filename)
+    if folder:
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        stat = os.fstat(fd)
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"The shared SQLite file {filename} belongs to another user")
+        if stat.st_mode & 0o077:
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+    connection = sqlite3.connect(filename, timeout=busy_timeout_seconds, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def _type_name(value_type: type) -> str:
+    return f"{value_type.__module__}:{value_type.__qualname__}"
+
+
+def _value_type(name: str) -> type:
+    """The class named by _type_name(). Only the classes of this package can be loaded"""
+    module_name, _, qualname = name.partition(":")
+    if module_name.split(".")[0] != __name__.split(".")[0]:
+        raise ValueError(f"Can not load a cached value of type {name}")
+    value_type = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        value_type = getattr(value_type, attribute)
+    return value_type
+
+
+def _to_json_value(value) -> Any:
+    """Converts a value to JSON. Tuples, dicts, datetimes, dates, enums and dataclasses are objects with a single key
+    naming their type, so they are restored as they were"""
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, Enum):
+        return {"enum": _type_name(type(value)), "name": value.name}
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    if isinstance(value, list):
+        return [_to_json_value(item) for item in value]
+    if isinstance(value, tuple):
+        return {"tuple": [_to_json_value(item) for item in value]}
+    if isinstance(value, dict):
+        return {"dict": [[_to_json_value(k), _to_json_value(v)] for k, v in value.items()]}
+    if is_dataclass(value) and not isinstance(value, type):
+        return {"dataclass": _type_name(type(value)),
+                "fields": {f.name: _to_json_value(getattr(value, f.name)) for f in fields(value) if f.init}}
+    raise TypeError(f"A {type(value).__name__} value can not be stored in a shared cache")
+
+
+def _from_json_value(value) -> Any:
+    if isinstance(value, list):
+        return [_from_json_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "enum" in value:
+        enum_type = _value_type(value["enum"])
+        if not (isinstance(enum_type, type) and issubclass(enum_type, Enum)):
+            raise ValueError(f"{value['enum']} is not an enum")
+        return enum_type[value["name"]]
+    if "datetime" in value:
+        return datetime.fromisoformat(value["datetime"])
+    if "date" in value:
+        return date.fromisoformat(value["date"])
+    if "tuple" in value:
+        return tuple(_from_json_value(item) for item in value["tuple"])
+    if "dict" in value:
+        return {_from_json_value(k): _from_json_value(v) for k, v in value["dict"]}
+    if "dataclass" in value:
+        dataclass_type = _value_type(value["dataclass"])
+        if not (isinstance(dataclass_type, type) and is_dataclass(dataclass_type)):
+            raise ValueError(f"{value['dataclass']} is not a dataclass")
+        return dataclass_type(**{name: _from_json_value(v) for name, v in value["fields"].items()})
+    raise ValueError(f"Unknown cached value: {value}")
+
+
+def dump_cache_value(value) -> str:
+    return json.dumps(_to_json_value(value), separators=(",", ":"))
+
+
+def load_cache_value(data: str) -> Any:
+    return _from_json_value(json.loads(data))
+
+
+class CacheBackend(ABC):
+    """A storage for the SharedTTLCache objects. Every cache is a separate namespace of a backend"""
+
+    # Whether all the processes of a host (e.g. all gunicorn workers) see the same values
+    is_shared = False
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns a value which has not expired yet. Raises a KeyError otherwise"""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int): ...
+
+    @abstractmethod
+    def add(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int) -> bool:
+        """Sets the value only if the key has no value which has not expired yet. Returns whether it was set"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        """Raises a KeyError if there is no such key"""
+
+    @abstractmethod
+    def keys(self, namespace: str) -> List[str]: ...
+
+
+class InProcessCacheBackend(CacheBackend):
+    """Keeps every namespace in a private cachetools.TTLCache of the current process"""
+
+    def __init__(self):
+        self._caches: Dict[str, TTLCache] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        with self._lock:
+            return self._caches[namespace][key]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int):
+        with self._lock:
+            if namespace not in self._caches:
+                self._caches[namespace] = TTLCache(maxsize=maxsize, ttl=ttl)
+            self._caches[namespace][key] = value
+
+    def add(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int) -> bool:
+        with self._lock:
+            if namespace not in self._caches:
+                self._caches[namespace] = TTLCache(maxsize=maxsize, ttl=ttl)
+            if key in self._caches[namespace]:
+                return False
+            self._caches[namespace][key] = value
+            return True
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            del self._caches[namespace][key]
+
+    def keys(self, namespace: str) -> List[str]:
+        with self._lock:
+            return list(self._caches.get(namespace, {}).keys())
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Keeps the caches of all the processes of a host (e.g. all gunicorn workers) in one local SQLite file.
+
+    Values are stored as JSON (see dump_cache_value()). Expired entries are never returned. Every _EVICTION_INTERVAL
+    writes a process removes the expired entries of a namespace and the least recently used ones above its maxsize.
+
+    A cache hit is a read only, so hits of all the processes do not queue for the database write lock: the access time
+    of an entry is updated by a hit only if it is older than touch_interval_seconds, which makes the LRU eviction
+    approximate.
+    """
+    _EVICTION_INTERVAL = 100
+    is_shared = True
+
+    def __init__(self, filename: str, busy_timeout_seconds: float = 5, touch_interval_seconds: float = 30):
+        self.filename = filename
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.touch_interval_seconds = touch_interval_seconds
+        self._local = threading.local()
+        self._writes_num = 0
+        self._writes_num_lock = threading.Lock()
+        self._create_table()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can not be shared between threads, nor survive a fork of a gunicorn worker
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = connect_shared_sqlite_file(self.filename, busy_timeout_seconds=self.busy_timeout_seconds)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_table(self):
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                           "namespace TEXT NOT NULL, "
+                           "key TEXT NOT NULL, "
+                           "value TEXT NOT NULL, "
+                           "expires_at REAL NOT NULL, "
+                           "accessed_at REAL NOT NULL, "
+                           "PRIMARY KEY (namespace, key))")
+        connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries__namespace__accessed_at "
+                           "ON cache_entries (namespace, accessed_at)")
+
+    def get(self, namespace: str, key: str) -> Any:
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute("SELECT value, accessed_at FROM cache_entries "
+                                 "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                                 (namespace, key, now)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        if now - row[1] >= self.touch_interval_seconds:
+            connection.execute("UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                               (now, namespace, key))
+        return load_cache_value(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           (namespace, key, dump_cache_value(value), now + ttl, now))
+
+        with self._writes_num_lock:
+            self._writes_num += 1
+            evict = self._writes_num % self._EVICTION_INTERVAL == 0
+        if evict:
+            self.evict(namespace, maxsize)
+
+    def add(self, namespace: str, key: str, value: Any, ttl: float, maxsize: int) -> bool:
+        now = time.time()
+        # A single statement: concurrent processes can not both add the same key
+        cursor = self._connection().execute(
+            "INSERT INTO cache_entries (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET "
+            "value = excluded.value, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at "
+            "WHERE cache_entries.expires_at <= ?",
+            (namespace, key, dump_cache_value(value), now + ttl, now, now))
+        if not cursor.rowcount:
+            return False
+
+        with self._writes_num_lock:
+            self._writes_num += 1
+            evict = self._writes_num % self._EVICTION_INTERVAL == 0
+        if evict:
+            self.evict(namespace, maxsize)
+        return True
+
+    def evict(self, namespace: str, maxsize: int):
+        connection = self._connection()
+        connection.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+                           (namespace, time.time()))
+        connection.execute("DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                           "SELECT key FROM cache_entries WHERE namespace = ? "
+                           "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                           (namespace, namespace, maxsize))
+
+    def delete(self, namespace: str, key: str):
+        cursor = self._connection().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                                            (namespace, key))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def keys(self, namespace: str) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT key FROM cache_entries WHERE namespace = ? AND expires_at > ?", (namespace, time.time()))]
+
+
+_default_cache_backend: Optional[CacheBackend] = None
+_default_cache_backend_lock = threading.Lock()
+
+
+def default_cache_backend() -> CacheBackend:
+    global _default_cache_backend
+    with _default_cache_backend_lock:
+        if _default_cache_backend is None:
+            if get_cache_backend_type() == CacheBackendType.SQLITE:
+                try:
+                    _default_cache_backend = SQLiteCacheBackend(shared_cache_sqlite_file())
+                except (sqlite3.Error, OSError) as e:
+                    logging.error(f"Can not use the shared cache file {shared_cache_sqlite_file()}, "
+                                  f"falling back to in-process caches: {e}")
+            if _default_cache_backend is None:
+                _default_cache_backend = InProcessCacheBackend()
+        return _default_cache_backend
+
+
+class SharedTTLCache(MutableMapping):
+    """A TTL + LRU cache stored in a CacheBackend (the configured default one if backend is None).
+
+    It can be used with the cachetools decorators in place of a TTLCache: @cached(cache=SharedTTLCache(...)).
+    Keys are stored as their repr(), so they must be built of values with a stable repr (strings, numbers, enums).
+    Iterating over the cache yields these repr() strings.
+    Values stored in a shared backend must be built of JSON values, tuples, datetimes and the dataclasses and enums
+    of this package (see dump_cache_value()), and must not be bound to a database session.
+    Backend errors are logged and treated as cache misses.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, backend: CacheBackend = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._backend = backend
+        self._hits_counter = cache_hits_counter.labels(name)
+        self._misses_counter = cache_misses_counter.labels(name)
+
+    @property
+    def backend(self) -> CacheBackend:
+        if self._backend is None:
+            self._backend = default_cache_backend()
+        return self._backend
+
+    def __getitem__(self, key):
+        try:
+            value = self.backend.get(self.name, repr(key))
+        except KeyError:
+            self._misses_counter.inc()
+            raise
+        except Exception as e:
+            logging.warning(f"Can not read a value from the {self.name} cache: {e}")
+            self._misses_counter.inc()
+            raise KeyError(key)
+        self._hits_counter.inc()
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            self.backend.set(self.name, repr(key), value, ttl=self.ttl, maxsize=self.maxsize)
+        except Exception as e:
+            logging.warning(f"Can not store a value in the {self.name} cache: {e}")
+
+    def add(self, key, value) -> bool:
+        """Atomically stores the value if the key is not in the cache. Returns False if it already is. When the
+        backend fails, the value is treated as added"""
+        try:
+            return self.backend.add(self.name, repr(key), value, ttl=self.ttl, maxsize=self.maxsize)
+        except Exception as e:
+            logging.warning(f"Can not add a value to the {self.name} cache: {e}")
+            return True
+
+    def __delitem__(self, key):
+        self.backend.delete(self.name, repr(key))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.backend.keys(self.name))
+
+    def __len__(self) -> int:
+        return len(self.backend.keys(self.name))
+
+
+def _blocks_on_io(cache: MutableMapping) -> bool:
+    return isinstance(cache, SharedTTLCache) and cache.backend.is_shared
+
+
+async def async_cache_get(cache: MutableMapping, key, default=None):
+    """cache.get() for coroutines: the lookups of a shared backend (a SQLite file) run in the default executor, so
+    they don't block the event loop"""
+    if _blocks_on_io(cache):
+        return await asyncio.get_event_loop().run_in_executor(None, cache.get, key, default)
+    return cache.get(key, default)
+
+
+async def async_cache_set(cache: MutableMapping, key, value):
+    """cache[key] = value for coroutines, see async_cache_get. Values too large for the cache are not stored"""
+    try:
+        if _blocks_on_io(cache):
+            await asyncio.get_event_loop().run_in_executor(None, cache.__setitem__, key, value)
+        else:
+            cache[key] = value
+    except ValueError:
+        pass  # The value is too large
+
+
+_MISSING = object()
+
+
+def async_cached(cache: MutableMapping, key: Callable[..., Hashable] = hashkey):
+    """cachetools.cached for coroutine functions. A function and its async version share the cached values if they
+    are decorated with the same cache and key function. Concurrent misses of a key all call the function"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs)
+            value = await async_cache_get(cache, k, _MISSING)
+            if value is not _MISSING:
+                return value
+            value = await func(*args, **kwargs)
+            await async_cache_set(cache, k, value)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_key = key
+        return wrapper
+    return decorator
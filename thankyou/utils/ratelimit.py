@@ -0,0 +1,108 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+from thankyou.core.config import get_cache_backend_type, CacheBackendType, shared_cache_sqlite_file
+from thankyou.utils.cache import connect_shared_sqlite_file
+
+
+class TokenBucketStore(ABC):
+    """Token buckets: every bucket is refilled with rate_per_second tokens per second up to capacity tokens"""
+
+    @abstractmethod
+    def reserve(self, key: str, rate_per_second: float, capacity: float, max_wait_seconds: float) -> Optional[float]:
+        """Takes a token from the bucket and returns how many seconds the caller must wait before using it (0 if a
+        token is available right now). Takes nothing and returns None if the wait would be longer than
+        max_wait_seconds"""
+
+    def __deepcopy__(self, memo):
+        # A store is shared by all the clients of a process, also by the copies Bolt makes for lazy listeners
+        return self
+
+    @staticmethod
+    def _reserve(tokens: float, updated_at: float, now: float, rate_per_second: float, capacity: float,
+                 max_wait_seconds: float) -> Tuple[Optional[float], float]:
+        """Returns the wait time (or None) and the number of tokens left in a bucket after the reservation. The
+        number of tokens goes below zero when the tokens of the future are reserved"""
+        tokens = min(capacity, tokens + (now - updated_at) * rate_per_second)
+        wait_seconds = max(0.0, (1 - tokens) / rate_per_second)
+        if wait_seconds > max_wait_seconds:
+            return None, tokens
+        return wait_seconds, tokens - 1
+
+
+class InProcessTokenBucketStore(TokenBucketStore):
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, rate_per_second: float, capacity: float, max_wait_seconds: float) -> Optional[float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            wait_seconds, tokens = self._reserve(tokens, updated_at, now, rate_per_second, capacity, max_wait_seconds)
+            self._buckets[key] = (tokens, now)
+        return wait_seconds
+
+
+class SQLiteTokenBucketStore(TokenBucketStore):
+    """Keeps the buckets in a local SQLite file, so all the processes of a host (e.g. all gunicorn workers) share
+    them. A reservation is a single write transaction"""
+
+    def __init__(self, filename: str, busy_timeout_seconds: float = 5):
+        self.filename = filename
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self._local = threading.local()
+        self._connection().execute("CREATE TABLE IF NOT EXISTS token_buckets ("
+                                   "key TEXT NOT NULL PRIMARY KEY, "
+                                   "tokens REAL NOT NULL, "
+                                   "updated_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can not be shared between threads, nor survive a fork of a gunicorn worker
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            connection = connect_shared_sqlite_file(self.filename, busy_timeout_seconds=self.busy_timeout_seconds)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def reserve(self, key: str, rate_per_second: float, capacity: float, max_wait_seconds: float) -> Optional[float]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = connection.execute("SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row is not None else (capacity, now)
+            wait_seconds, tokens = self._reserve(tokens, updated_at, now, rate_per_second, capacity, max_wait_seconds)
+            connection.execute("INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                               (key, tokens, now))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait_seconds
+
+
+_default_token_bucket_store: Optional[TokenBucketStore] = None
+_default_token_bucket_store_lock = threading.Lock()
+
+
+def default_token_bucket_store() -> TokenBucketStore:
+    """Shares the buckets between processes when the shared (SQLite) cache backend is configured"""
+    global _default_token_bucket_store
+    with _default_token_bucket_store_lock:
+        if _default_token_bucket_store is None:
+            if get_cache_backend_type() == CacheBackendType.SQLITE:
+                try:
+                    _default_token_bucket_store = SQLiteTokenBucketStore(shared_cache_sqlite_file())
+                except (sqlite3.Error, OSError) as e:
+                    logging.error(f"Can not use the shared cache file {shared_cache_sqlite_file()} for rate limits, "
+                                  f"falling back to in-process token buckets: {e}")
+            if _default_token_bucket_store is None:
+                _default_token_bucket_store = InProcessTokenBucketStore()
+        return _default_token_bucket_store
@@ -2,7 +2,10 @@ import json
 from json import JSONDecodeError
 from typing import Optional, List, Dict
 
-from thankyou.slackbot.utils.stringhelpers import es
+import validators
+
+from thankyou.core.models import ThankYouMessage
+from thankyou.utils.stringhelpers import es
 
 
 def rich_text_block_as_markdown(text: str) -> Optional[str]:
@@ -60,3 +63,16 @@ def rich_text_block_as_markdown(text: str) -> Optional[str]:
             return None
 
     return result
+
+
+def thank_you_message_markdown_text(thank_you_message: ThankYouMessage) -> Optional[str]:
+    if not thank_you_message.is_rich_text:
+        return None
+    return rich_text_block_as_markdown(thank_you_message.text)
+
+
+def thank_you_message_has_valid_image(thank_you_message: ThankYouMessage) -> bool:
+    if not thank_you_message.images:
+        return False
+    first_image = min(thank_you_message.images, key=lambda i: i.ordering_key)
+    return bool(first_image.url.strip() and validators.url(first_image.url))